@@ -1,178 +1,404 @@
 import asyncio
-import json
 import sys
-from datetime import datetime
+import threading
+import uuid
 from pathlib import Path
+from types import SimpleNamespace
 
-import gradio as gr
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageOps
+
+from mask_utils import invert, resize_mask
+from result_cache import ResultCache, image_key
 
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-input_points = []
 IMG_SIZE = 512
-input_image = None
 CACHE_DIR = Path("outputs/app_runs")
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
-LATEST_IMAGE_PATH = CACHE_DIR / "latest.png"
-LATEST_METADATA_PATH = CACHE_DIR / "latest.json"
-
-
-def _store_latest_result(image, prompt, negative_prompt, cfg, seed, target):
-    """Persist the most recent inpainted image so the notebook can display it."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    run_path = CACHE_DIR / f"inpaint_{timestamp}.png"
-    image.save(run_path)
-    image.save(LATEST_IMAGE_PATH)
-    metadata = {
-        "timestamp": timestamp,
-        "prompt": prompt,
-        "negative_prompt": negative_prompt,
-        "cfg_scale": cfg,
-        "seed": seed,
-        "target": target,
-        "image_path": str(run_path.resolve()),
+
+
+def pad_to_square(image, size=IMG_SIZE):
+    """
+    `image` padded with white to a centred square and resized to `size`px, as the app shows it.
+
+    Returns (square image, (left, top, width, height) of the original inside the padded square);
+    shared with `batch_runner` so headless runs see exactly what the app would.
+    """
+    image = image.convert("RGB")
+    width, height = image.size
+    side = max(width, height)
+    left, top = (side - width) // 2, (side - height) // 2
+    if width != height:
+        square = Image.new("RGB", (side, side), "white")
+        square.paste(image, (left, top))
+        image = square
+    return image.resize((size, size)), (left, top, width, height)
+
+
+def _store_latest_result(cache, key, image, prompt, negative_prompt, cfg, seed, target):
+    """
+    Persist an inpainted image in the result cache (also the notebook's latest result).
+
+    The app's cache writes in the background, so this only queues the image.
+    """
+    cache.put(
+        key,
+        image,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        cfg_scale=cfg,
+        seed=seed,
+        target=target,
+    )
+
+
+def new_session():
+    """Per-browser-session state, held in a `gr.State` so concurrent users never share points."""
+    return {
+        # Identifies the session's inpaint jobs when there is no gr.Request (scripted use)
+        "id": uuid.uuid4().hex,
+        "points": [],
+        # Untouched input image (the display copy gets crossmarks drawn on it)
+        "image": None,
+        # Full-resolution upload and its (left, top, width, height) inside the padded square,
+        # used by `inpaint_region`
+        "original": None,
+        "original_box": None,
+        # Resized SAM mask for the current image + points, reused by `run` instead of recomputing SAM
+        "mask": None,
+        # Hash of the image we last put in the Input canvas, so its echo `change` event is ignored
+        "display_key": None,
     }
-    LATEST_METADATA_PATH.write_text(json.dumps(metadata, indent=2))
 
-def generate_app(get_processed_inputs, inpaint):
-    
-    global input_points
-    global input_image
-    suppress_preprocess = False
-    
-    def get_points(img, evt: gr.SelectData):
-        
-        global input_image
-        nonlocal suppress_preprocess
-        suppress_preprocess = True
-        
-        try:
-            # The first time this is called, we save the untouched
-            # input image
-            if len(input_points) == 0:
-                input_image = img.copy()
-            
-            x = evt.index[0]
-            y = evt.index[1]
 
-            input_points.append([x, y])
-            
-            # Run SAM
-            sam_output = run_sam()
-            
-            # Mark selected points with a green crossmark
-            draw = ImageDraw.Draw(img)
-            size = 10
-            for point in input_points:
+def build_handlers(get_processed_inputs, inpaint, inpaint_batch=None, result_cache=None, inpaint_stream=None,
+                   inpaint_region=None):
+    """
+    Event handlers of the app as plain functions of (inputs..., session).
 
-                x, y = point
+    Every handler takes the session dict last and returns it (updated) as its last
+    output, so they can be driven without a browser, e.g. with stub callables:
 
-                draw.line((x - size, y, x + size, y), fill="green", width=5)
-                draw.line((x, y - size, x, y + size), fill="green", width=5)
-            
-            return sam_output, img
-        finally:
-            suppress_preprocess = False
+        h = build_handlers(lambda image, points: np.ones((512, 512), bool),
+                           lambda image, mask, *args: image)
+        session = h.new_session()
+        img, session = h.preprocess(Image.open("car.png"), session)
+        sam_output, img, session = h.add_point(img, 150, 170, session)
+        *_, (result, status, session) = h.run("a car on Mars", "", 7, 0, False, None, session)
 
+    `run` is a generator: it yields (preview, status, session) while the diffusion runs
+    and the final image last. Previews come from `inpaint_stream` (see
+    `streaming_inpaint.make_streaming_inpaint`); without it `inpaint` runs blocking and
+    only the status is shown until it returns.
 
-    def run_sam():
-        
-        if input_image is None:
+    Each session has at most one live inpaint job. `claim_job` registers a new one and
+    cancels the previous job of the same session, so a stale request still waiting in
+    the queue returns as soon as it starts and a running one stops at its next
+    denoising step; `cancel_job` (the Cancel button) and `cancel_session` (the browser
+    tab went away) cancel the current job. `run` with `job_id=None` claims a job itself.
+    Only streamed runs stop mid-way: a blocking `inpaint` is skipped if cancelled before
+    it starts, and its result is dropped otherwise.
+
+    `inpaint_batch` (see `batch_inpaint.make_batch_inpaint`) runs the seeds x CFG grid of
+    `run_batch` in batched pipeline calls; without it the grid loops over `inpaint`.
+
+    Results go through `result_cache` (a background-writing `ResultCache` in
+    `outputs/app_runs` by default): a run whose image, mask, prompts, seed and CFG were
+    seen before is returned from disk instead of being recomputed, and new results are
+    encoded off the request thread.
+
+    With `inpaint_region` (see `region_inpaint.make_region_inpaint`) `run` inpaints the
+    full-resolution upload instead of the 512px square: the SAM mask is scaled up to the
+    original and only the crops/tiles around it are diffused, then blended back in. The
+    Output shows a 512px view; the cache keeps the full-size image. `run_batch` stays at
+    512px.
+    """
+    # Imported here so `import app` stays cheap (gradio alone takes seconds)
+    import gradio as gr
+
+    from streaming_inpaint import InpaintCancelled, blocking_inpaint_stream
+
+    if result_cache is None:
+        result_cache = ResultCache(CACHE_DIR, background=True)
+
+    if inpaint_stream is None:
+        inpaint_stream = blocking_inpaint_stream(inpaint)
+
+    # session key -> (job id, cancel event) of the newest inpaint request
+    jobs = {}
+    jobs_lock = threading.Lock()
+
+    def session_key(session, request):
+        return request.session_hash if request is not None else session["id"]
+
+    def claim_job(session, request: gr.Request = None):
+        job = (uuid.uuid4().hex, threading.Event())
+        with jobs_lock:
+            previous = jobs.get(session_key(session, request))
+            jobs[session_key(session, request)] = job
+        if previous is not None:
+            previous[1].set()
+        return job[0], "Queued..."
+
+    def cancel_job(session, request: gr.Request = None):
+        with jobs_lock:
+            job = jobs.get(session_key(session, request))
+        if job is None:
+            return "Nothing to cancel"
+        job[1].set()
+        return "Cancelling..."
+
+    def cancel_session(request: gr.Request = None):
+        if request is None:
+            return
+        with jobs_lock:
+            job = jobs.pop(request.session_hash, None)
+        if job is not None:
+            job[1].set()
+
+    def add_point(img, x, y, session):
+        # The first time this is called, we save the untouched input image
+        if len(session["points"]) == 0:
+            session["image"] = img.copy()
+
+        session["points"].append([x, y])
+
+        # Run SAM
+        sam_output, session = run_sam(session)
+
+        # Mark selected points with a green crossmark
+        draw = ImageDraw.Draw(img)
+        size = 10
+        for point in session["points"]:
+
+            x, y = point
+
+            draw.line((x - size, y, x + size, y), fill="green", width=5)
+            draw.line((x, y - size, x, y + size), fill="green", width=5)
+
+        session["display_key"] = image_key(img)
+        return sam_output, img, session
+
+    def get_points(img, session, evt: gr.SelectData):
+        return add_point(img, evt.index[0], evt.index[1], session)
+
+    def run_sam(session):
+
+        if session["image"] is None:
             raise gr.Error("No points provided. Click on the image to select the object to segment with SAM")
-        
-        if len(input_points) == 0:
+
+        if len(session["points"]) == 0:
             raise gr.Error("Please select at least one point on the image before running SAM")
-        
+
         try:
-            
-            mask = get_processed_inputs(input_image, [input_points])
-            
-            res_mask = np.array(Image.fromarray(mask).resize((IMG_SIZE, IMG_SIZE)))
-            
+
+            mask = get_processed_inputs(session["image"], [session["points"]])
+
+            # Keep the mask at the image's own resolution (what inpaint receives); only
+            # the preview is brought to the display size
+            width, height = session["image"].size
+            session["mask"] = resize_mask(mask, (height, width))
+            res_mask = resize_mask(session["mask"], (IMG_SIZE, IMG_SIZE))
+
             return (
-                input_image.resize((IMG_SIZE, IMG_SIZE)), 
+                session["image"].resize((IMG_SIZE, IMG_SIZE)),
                 [
-                    (res_mask, "background"), 
-                    (~res_mask, "subject")
+                    (res_mask, "background"),
+                    (invert(res_mask), "subject")
                 ]
-            )
+            ), session
         except Exception as e:
             raise gr.Error(str(e))
 
+    def target_mask(invert_selection, session):
 
-    def run(prompt, negative_prompt, cfg, seed, invert):
-
-        if input_image is None:
+        if session["image"] is None:
             raise gr.Error("No points provided. Click on the image to select the object to segment with SAM")
-        
-        amask = run_sam()[1][0][0]
-        
-        if bool(invert):
-            what = 'subject'
-            amask = ~amask
-        else:
-            what = 'background'
-        
-        gr.Info(f"Inpainting {what}... (this will take up to a few minutes)")
+
+        # The mask only changes on clicks, so reuse the one computed by the last SAM run
+        if session["mask"] is None:
+            session = run_sam(session)[1]
+        amask = session["mask"]
+
+        if bool(invert_selection):
+            return invert(amask), 'subject', session
+        return amask, 'background', session
+
+    def original_mask(amask, session):
+        # Undo the padding and resize of `preprocess`: scale the square mask to the padded
+        # original's size, then cut out the original
+        left, top, width, height = session["original_box"]
+        side = max(width, height)
+        return resize_mask(amask, (side, side))[top:top + height, left:left + width]
+
+    def display_size(image):
+        # Full-resolution results keep their aspect ratio in the Output canvas
+        if image.width == image.height:
+            return image.resize((IMG_SIZE, IMG_SIZE))
+        return ImageOps.contain(image, (IMG_SIZE, IMG_SIZE))
+
+    def run(prompt, negative_prompt, cfg, seed, invert, job_id, session, request: gr.Request = None):
+
+        if not job_id:
+            job_id, _ = claim_job(session, request)
+        with jobs_lock:
+            job = jobs.get(session_key(session, request))
+        if job is None or job[0] != job_id:
+            yield gr.update(), "Skipped: replaced by a newer request", session
+            return
+
         try:
-            inpainted = inpaint(input_image, amask, prompt, negative_prompt, seed, cfg)
+            amask, what, session = target_mask(invert, session)
+
+            image, stream = session["image"], inpaint_stream
+            if inpaint_region is not None and session["original"] is not None:
+                image, amask, stream = session["original"], original_mask(amask, session), inpaint_region
+
+            key = result_cache.key(image, amask, prompt, negative_prompt, seed, cfg)
+            inpainted = result_cache.get(key)
+            if inpainted is not None:
+                yield display_size(inpainted), f"Same {what} inpaint ran before, cached result", session
+                return
+
+            gr.Info(f"Inpainting {what}... (this will take up to a few minutes)")
+            try:
+                for update in stream(image, amask, prompt, negative_prompt, seed, cfg, cancel=job[1]):
+                    if update.done:
+                        break
+                    preview = display_size(update.preview) if update.preview else gr.update()
+                    yield preview, update.status(), session
+            except InpaintCancelled:
+                yield gr.update(), "Cancelled", session
+                return
+            except Exception as e:
+                raise gr.Error(str(e))
+
+            inpainted = update.image
+            _store_latest_result(result_cache, key, inpainted, prompt, negative_prompt, cfg, seed, what)
+
+            yield display_size(inpainted), update.status(), session
+        finally:
+            with jobs_lock:
+                if jobs.get(session_key(session, request)) is job:
+                    del jobs[session_key(session, request)]
+
+    def run_batch(prompt, negative_prompt, seeds, cfgs, invert, session):
+        # batch_inpaint imports torch, so it is only loaded once a batch is requested
+        from batch_inpaint import BatchResult, parse_values, sequential_inpaint_batch
+
+        try:
+            seeds = parse_values(seeds, int)
+            cfgs = parse_values(cfgs, float)
+        except ValueError:
+            raise gr.Error("Seeds and CFG scales must be numbers separated by commas or spaces")
+
+        amask, what, session = target_mask(invert, session)
+
+        keys = {}
+        results = {}
+        missing = {}
+        for cfg in cfgs:
+            for seed in seeds:
+                keys[seed, cfg] = result_cache.key(session["image"], amask, prompt, negative_prompt, seed, cfg)
+                cached = result_cache.get(keys[seed, cfg])
+                if cached is not None:
+                    results[seed, cfg] = BatchResult(cached, seed, cfg)
+                else:
+                    missing.setdefault(cfg, []).append(seed)
+
+        todo = sum(len(group) for group in missing.values())
+        gr.Info(f"Inpainting {what} for {len(seeds)} seed(s) x {len(cfgs)} CFG value(s), "
+                f"{todo} not cached yet...")
+        try:
+            # Cached results may leave ragged groups, so batch the misses one CFG value at a time
+            for cfg, group in missing.items():
+                for item in (inpaint_batch or sequential_inpaint_batch(inpaint))(
+                        session["image"], amask, prompt, negative_prompt, group, [cfg]):
+                    results[item.seed, item.cfg] = item
+                    _store_latest_result(result_cache, keys[item.seed, item.cfg], item.image,
+                                         prompt, negative_prompt, item.cfg, item.seed, what)
         except Exception as e:
             raise gr.Error(str(e))
 
-        _store_latest_result(inpainted, prompt, negative_prompt, cfg, seed, what)
+        results = [results[seed, cfg] for cfg in dict.fromkeys(cfgs) for seed in dict.fromkeys(seeds)]
+
+        gallery = [
+            (item.image.resize((IMG_SIZE, IMG_SIZE)), f"seed {item.seed} | CFG {item.cfg:g}")
+            for item in results
+        ]
+        return gallery, session
+
+    def reset_points(session=None):
+        fresh = new_session()
+        if session is not None:
+            fresh["id"] = session["id"]
+        return fresh
+
+    def preprocess(input_img, session):
 
-        return inpainted.resize((IMG_SIZE, IMG_SIZE))
-    
-    def reset_points(*args):
-        global input_image
-        input_points.clear()
-        input_image = None
-    
-    
-    def preprocess(input_img):
-        nonlocal suppress_preprocess
-        global input_image
-        
         if input_img is None:
-            return None
-        
-        if suppress_preprocess:
-            return input_img
-        
-        input_points.clear()
-        input_image = None
-        
+            return None, session
+
+        # Our own output (crossmarks or the resize below) coming back as a `change` event
+        if session["display_key"] == image_key(input_img):
+            return input_img, session
+
+        session = new_session()
+
         # Make sure the image is square
-        width, height = input_img.size
-        
-        if width != height:
-            
+        if input_img.width != input_img.height:
             gr.Warning("Image is not square, adding white padding")
+        session["original"] = input_img.convert("RGB")
+        input_img, session["original_box"] = pad_to_square(session["original"])
+        session["display_key"] = image_key(input_img)
+        return input_img, session
 
-            # Determine the size for the new square image
-            new_size = max(width, height)
+    return SimpleNamespace(
+        new_session=new_session,
+        add_point=add_point,
+        get_points=get_points,
+        run_sam=run_sam,
+        claim_job=claim_job,
+        cancel_job=cancel_job,
+        cancel_session=cancel_session,
+        run=run,
+        run_batch=run_batch,
+        reset_points=reset_points,
+        preprocess=preprocess,
+    )
 
-            # Create a new image with the desired size and background color
-            # Change 'black' to your desired background color if needed
-            new_image = Image.new("RGB", (new_size, new_size), 'white')
-            
-            # Calculate the position to paste the original image onto the new image
-            left = (new_size - width) // 2
-            top = (new_size - height) // 2
 
-            # Paste the original image onto the new image
-            new_image.paste(input_img, (left, top))
-            
-            input_img = new_image
-        
-        return input_img.resize((IMG_SIZE, IMG_SIZE))
-    
+def generate_app(get_processed_inputs, inpaint, sam_concurrency=4, inpaint_concurrency=1,
+                 max_queue_size=32, launch=True, inpaint_batch=None, result_cache=None,
+                 inpaint_stream=None, inpaint_region=None):
+    """
+    Build (and by default launch) the inpainting UI.
+
+    Each browser session keeps its own points, image and mask in a `gr.State`.
+    SAM clicks and diffusion runs are queued in separate pools (`concurrency_id`
+    "sam" and "inpaint") so a click never waits behind a multi-minute inpaint:
+    up to `sam_concurrency` clicks and `inpaint_concurrency` inpaints run at once,
+    with at most `max_queue_size` requests waiting in total.
+
+    "Run batch" renders a seeds x CFG grid into a gallery, through `inpaint_batch`
+    when given (batched pipeline calls) or one `inpaint` call per image otherwise.
+    Repeated runs are served from `result_cache` and "Run inpaint" streams previews,
+    step progress and an ETA when `inpaint_stream` is given (see `build_handlers`).
+    With `inpaint_region` it inpaints the uploaded image at full resolution.
+
+    gradio is imported here, so `import app` loads neither gradio nor torch.
+    """
+
+    import gradio as gr
+
+    handlers = build_handlers(get_processed_inputs, inpaint, inpaint_batch, result_cache, inpaint_stream,
+                              inpaint_region)
     
     with gr.Blocks() as demo:
 
+        session = gr.State(new_session)
+
         gr.Markdown(
         """
         # Image inpainting
@@ -197,6 +423,8 @@ def generate_app(get_processed_inputs, inpaint):
                 label="Input", 
                 interactive=True, 
                 type='pil',
+                # Lossless, so our own updates hash the same when they come back
+                format='png',
                 height=IMG_SIZE,
                 width=IMG_SIZE
             )
@@ -215,11 +443,25 @@ def generate_app(get_processed_inputs, inpaint):
                 height=IMG_SIZE,
                 width=IMG_SIZE,
             )            
+
+        # Step progress / ETA of the running inpaint
+        status = gr.Markdown()
         
         # Events
-        display_img.select(get_points, inputs=[display_img], outputs=[sam_mask, display_img])
-        display_img.clear(reset_points)
-        display_img.change(preprocess, inputs=[display_img], outputs=[display_img])
+        display_img.select(
+            handlers.get_points,
+            inputs=[display_img, session],
+            outputs=[sam_mask, display_img, session],
+            concurrency_id="sam",
+            concurrency_limit=sam_concurrency,
+        )
+        display_img.clear(handlers.reset_points, inputs=[session], outputs=[session], concurrency_limit=None)
+        display_img.change(
+            handlers.preprocess,
+            inputs=[display_img, session],
+            outputs=[display_img, session],
+            concurrency_limit=None,
+        )
         
         with gr.Row():
             cfg = gr.Slider(
@@ -257,9 +499,30 @@ def generate_app(get_processed_inputs, inpaint):
                     checkbox
                 ]
             )
-            reset_points_b.click(reset_points)
+            reset_points_b.click(handlers.reset_points, inputs=[session], outputs=[session], concurrency_limit=None)
             
             submit_inpaint = gr.Button(value="Run inpaint")
+            cancel_inpaint = gr.Button(value="Cancel")
+            # Id of this tab's newest inpaint request, sent along with the queued run
+            job_id = gr.Textbox(visible=False)
+
+        with gr.Row():
+            batch_seeds = gr.Textbox(
+                label="Seeds (batch)",
+                value="74294536, 97, 1234"
+            )
+            batch_cfgs = gr.Textbox(
+                label="CFG scales (batch)",
+                value="7"
+            )
+            submit_batch = gr.Button(value="Run batch")
+
+        gallery = gr.Gallery(
+            label="Batch results",
+            columns=4,
+            height=IMG_SIZE
+        )
+        reset_points_b.add(gallery)
 
         with gr.Row():
             examples = gr.Examples(
@@ -292,18 +555,50 @@ def generate_app(get_processed_inputs, inpaint):
 
             )
 
+        # Claiming is instant and cancels this session's previous request; the run itself is queued
         submit_inpaint.click(
-            fn=run, 
+            handlers.claim_job,
+            inputs=[session],
+            outputs=[job_id, status],
+            concurrency_limit=None,
+            trigger_mode="multiple",
+        ).then(
+            fn=handlers.run, 
             inputs=[
                 prompt, 
                 neg_prompt,
                 cfg,
                 random_seed,
-                checkbox
+                checkbox,
+                job_id,
+                session
             ], 
-            outputs=[result]
+            outputs=[result, status, session],
+            concurrency_id="inpaint",
+            concurrency_limit=inpaint_concurrency,
+            trigger_mode="multiple",
         )
 
-    demo.queue(max_size=1).launch(share=True, debug=True, prevent_thread_lock=True)
+        submit_batch.click(
+            fn=handlers.run_batch,
+            inputs=[
+                prompt,
+                neg_prompt,
+                batch_seeds,
+                batch_cfgs,
+                checkbox,
+                session
+            ],
+            outputs=[gallery, session],
+            concurrency_id="inpaint",
+            concurrency_limit=inpaint_concurrency,
+        )
+
+        cancel_inpaint.click(handlers.cancel_job, inputs=[session], outputs=[status], concurrency_limit=None)
+        demo.unload(handlers.cancel_session)
+
+    demo.queue(max_size=max_queue_size)
+    if launch:
+        demo.launch(share=True, debug=True, prevent_thread_lock=True)
     
     return demo
@@ -0,0 +1,165 @@
+"""
+Batched inpainting over several seeds and CFG scales.
+
+Tuning a result in the app meant clicking "Run inpaint" once per seed / CFG value,
+and every click paid the full pipeline overhead again: prompt encoding, the
+`enable_model_cpu_offload()` shuffle of text encoders, UNet and VAE onto the GPU,
+and a batch-of-one UNet pass per denoising step. `make_batch_inpaint` wraps the
+notebook's `pipeline` and runs a seeds x CFG grid as a few batched calls instead:
+
+- diffusers takes a single `guidance_scale` per call, so jobs are grouped by CFG
+  value and each group runs as one call with one `torch.Generator` per image,
+- groups are split into chunks of at most `chunk_size` images to bound memory
+  (with CFG the UNet batch is twice the chunk).
+
+Each image is seeded exactly like the notebook's `inpaint` (`torch.manual_seed(seed)`
+is the default CPU generator) and the image/mask are passed once per item, so every
+VAE encode draws from its own generator in the same order as a single call. A batched
+result therefore matches the single run with the same seed and CFG up to
+batched-kernel numerics (at most 1/255 per pixel on a tiny SD inpainting pipeline).
+
+Usage from the notebook:
+
+    from batch_inpaint import make_batch_inpaint
+    inpaint_batch = make_batch_inpaint(pipeline, chunk_size=4)
+    my_app = app.generate_app(get_processed_inputs, inpaint, inpaint_batch=inpaint_batch)
+
+Running this file times N sequential calls against the batched path on the tiny
+CPU stand-in pipeline from `stand_in_pipeline.py`:
+
+    python batch_inpaint.py --seeds 1 2 3 4 5 6 7 8 --cfgs 7 --chunk-size 4
+"""
+
+import argparse
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+@dataclass
+class BatchResult:
+    image: Image.Image
+    seed: int
+    cfg: float
+
+
+def parse_values(text, cast=float):
+    """'1, 2 3' -> [1.0, 2.0, 3.0]; used for the app's seed / CFG text boxes."""
+    values = [cast(item) for item in str(text).replace(",", " ").split()]
+    if not values:
+        raise ValueError("Provide at least one value")
+    return values
+
+
+def plan_batches(seeds, cfgs, chunk_size):
+    """
+    Seeds x CFG grid as (cfg, [seeds]) pipeline calls of at most `chunk_size` images.
+
+    Order follows the grid (CFG-major), which is also the order results come back in.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be >= 1")
+    calls = []
+    for cfg in dict.fromkeys(cfgs):
+        unique_seeds = list(dict.fromkeys(int(seed) for seed in seeds))
+        for start in range(0, len(unique_seeds), chunk_size):
+            calls.append((cfg, unique_seeds[start:start + chunk_size]))
+    return calls
+
+
+def make_batch_inpaint(pipeline, chunk_size=4):
+    """`inpaint_batch(raw_image, input_mask, prompt, negative_prompt, seeds, cfgs)` for `pipeline`."""
+
+    def inpaint_batch(raw_image, input_mask, prompt, negative_prompt=None, seeds=(74294536,), cfgs=(7,)):
+        mask_image = Image.fromarray(input_mask)
+        results = []
+        for cfg, chunk in plan_batches(seeds, cfgs, chunk_size):
+            images = pipeline(
+                prompt=[prompt] * len(chunk),
+                negative_prompt=[negative_prompt or ""] * len(chunk),
+                # One image/mask per item so each VAE encode draws from that item's generator
+                image=[raw_image] * len(chunk),
+                mask_image=[mask_image] * len(chunk),
+                generator=[torch.Generator("cpu").manual_seed(seed) for seed in chunk],
+                guidance_scale=cfg,
+            ).images
+            results.extend(BatchResult(image, seed, cfg) for image, seed in zip(images, chunk))
+        return results
+
+    return inpaint_batch
+
+
+def sequential_inpaint_batch(inpaint):
+    """Same contract as `make_batch_inpaint`, looping over the notebook's single-image `inpaint`."""
+
+    def inpaint_batch(raw_image, input_mask, prompt, negative_prompt=None, seeds=(74294536,), cfgs=(7,)):
+        return [
+            BatchResult(inpaint(raw_image, input_mask, prompt, negative_prompt, seed, cfg), seed, cfg)
+            for cfg, chunk in plan_batches(seeds, cfgs, chunk_size=1)
+            for seed in chunk
+        ]
+
+    return inpaint_batch
+
+
+def benchmark(pipeline, image, mask, seeds, cfgs, chunk_size, prompt="a car driving on planet Mars"):
+    """Seconds per image for N single calls vs the batched path, and the max pixel difference."""
+
+    def single(raw_image, input_mask, prompt, negative_prompt, seed, cfgs):
+        return pipeline(prompt=prompt, negative_prompt=negative_prompt, image=raw_image,
+                        mask_image=Image.fromarray(input_mask), generator=torch.manual_seed(seed),
+                        guidance_scale=cfgs).images[0]
+
+    start = time.perf_counter()
+    sequential = sequential_inpaint_batch(single)(image, mask, prompt, "", seeds, cfgs)
+    sequential_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = make_batch_inpaint(pipeline, chunk_size)(image, mask, prompt, "", seeds, cfgs)
+    batched_s = time.perf_counter() - start
+
+    max_diff = max(
+        int(np.abs(np.asarray(a.image, dtype=np.int16) - np.asarray(b.image, dtype=np.int16)).max())
+        for a, b in zip(sequential, batched)
+    )
+    n = len(batched)
+    return {
+        "images": n,
+        "sequential_s_per_image": sequential_s / n,
+        "batched_s_per_image": batched_s / n,
+        "speedup": sequential_s / batched_s,
+        "max_pixel_diff": max_diff,
+    }
+
+
+def main():
+    from stand_in_pipeline import TinyInpaintPipeline
+
+    parser = argparse.ArgumentParser(description="Time batched vs sequential inpainting on a CPU stand-in pipeline")
+    parser.add_argument("--image", default="car.png")
+    parser.add_argument("--seeds", type=int, nargs="+", default=list(range(8)))
+    parser.add_argument("--cfgs", type=float, nargs="+", default=[7.0])
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--size", type=int, default=128, help="stand-in resolution")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    image = Image.open(args.image).convert("RGB").resize((512, 512))
+    mask = np.ones((512, 512), dtype=bool)
+    mask[150:350, 100:400] = False
+
+    pipeline = TinyInpaintPipeline(size=args.size, steps=args.steps)
+    report = benchmark(pipeline, image, mask, args.seeds, args.cfgs, args.chunk_size)
+    print(f"{report['images']} images | sequential {report['sequential_s_per_image'] * 1000:.1f} ms/img "
+          f"| batched {report['batched_s_per_image'] * 1000:.1f} ms/img | speedup x{report['speedup']:.2f} "
+          f"| max pixel diff {report['max_pixel_diff']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Headless batch inpainting from a manifest.
+
+Processes a folder's worth of images overnight through the same
+`get_processed_inputs(image, input_points)` / `inpaint(raw_image, input_mask, prompt,
+negative_prompt, seed, cfgs)` callables the app and the notebook use, without Gradio.
+
+The manifest is JSON Lines, one item per line:
+
+    {"image": "photos/car.jpg", "points": [[300, 340], [600, 500]], "prompt": "a car on Mars",
+     "negative_prompt": "artifacts", "seed": 74294536, "cfg": 7, "invert": false, "id": "car"}
+
+Only `image`, `points` and `prompt` are required; relative paths are resolved against
+the manifest's folder. `points` are pixel coordinates in the original image. As in the
+app, the image is padded to a square and resized to 512px, SAM selects the subject and
+the background is repainted (the subject with `"invert": true`).
+
+The run is a pipeline of stages connected by bounded queues, so the GPU is not left
+idle while the next image is decoded or the previous result is encoded:
+
+    decode (thread pool, `prefetch` images ahead) -> SAM -> inpaint -> save (writer thread)
+
+Each finished item is appended to `<out>/results.jsonl` with its output path, status
+and per-stage timings (`decode_s`, `sam_s`, `inpaint_s`, `save_s`, `total_s`). That
+file is also the checkpoint: re-running the same command skips items already done, so
+an interrupted run (Ctrl+C, crash, reboot) resumes where it stopped. Failed items are
+recorded with their error and retried on the next run.
+
+From the notebook, after the SAM and pipeline cells:
+
+    from batch_runner import load_manifest, run_manifest
+    summary = run_manifest(load_manifest("manifest.jsonl"), get_processed_inputs, inpaint, "outputs/batch")
+
+From a shell (loads the notebook's models, or tiny CPU stand-ins with `--stub`):
+
+    python batch_runner.py manifest.jsonl --out outputs/batch
+    python batch_runner.py --demo 12 --stub --out /tmp/batch   # writes a demo manifest first
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app import IMG_SIZE, pad_to_square
+from mask_utils import resize_mask
+
+RESULTS_NAME = "results.jsonl"
+# Sentinel passed down the stage queues once the manifest is exhausted
+_DONE = object()
+
+
+@dataclass
+class ManifestItem:
+    id: str
+    image: str
+    points: List[List[float]]
+    prompt: str
+    negative_prompt: Optional[str] = None
+    seed: int = 74294536
+    cfg: float = 7.0
+    invert: bool = False
+
+
+@dataclass
+class _Work:
+    item: ManifestItem
+    image: Optional[Image.Image] = None
+    # Points mapped onto the padded, resized image
+    points: Optional[list] = None
+    mask: Optional[np.ndarray] = None
+    result: Optional[Image.Image] = None
+    error: Optional[str] = None
+    timings: dict = field(default_factory=dict)
+    started: float = 0.0
+
+
+def load_manifest(path):
+    """`ManifestItem`s of a JSON Lines manifest; image paths made relative to its folder are resolved."""
+    path = Path(path)
+    items = []
+    seen = set()
+    for number, line in enumerate(path.read_text().splitlines(), start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        try:
+            entry = json.loads(line)
+            image = Path(entry["image"])
+            item = ManifestItem(
+                id=str(entry.get("id") or f"{number:05d}_{image.stem}"),
+                image=str(image if image.is_absolute() else path.parent / image),
+                points=[[float(x), float(y)] for x, y in entry["points"]],
+                prompt=entry["prompt"],
+                negative_prompt=entry.get("negative_prompt"),
+                seed=int(entry.get("seed", 74294536)),
+                cfg=float(entry.get("cfg", 7.0)),
+                invert=bool(entry.get("invert", False)),
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}:{number}: invalid manifest entry ({e})") from e
+        if item.id in seen:
+            raise ValueError(f"{path}:{number}: duplicate id {item.id!r}")
+        seen.add(item.id)
+        items.append(item)
+    return items
+
+
+def completed_ids(out_dir):
+    """Ids recorded as done in `<out_dir>/results.jsonl` whose output file still exists."""
+    results = Path(out_dir) / RESULTS_NAME
+    done = set()
+    if not results.exists():
+        return done
+    for line in results.read_text().splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # A line cut short by a crash; that item simply runs again
+            continue
+        if record.get("status") == "ok" and (Path(out_dir) / record["output"]).exists():
+            done.add(record["id"])
+    return done
+
+
+def prepare_image(path, size=IMG_SIZE):
+    """(square image, scale, (left, top)): the app's `pad_to_square`, and how points map onto it."""
+    image, (left, top, width, height) = pad_to_square(Image.open(path), size)
+    return image, size / max(width, height), (left, top)
+
+
+def run_manifest(items, get_processed_inputs, inpaint, out_dir, prefetch=4, resume=True, log=print):
+    """
+    Run every item not already done in `out_dir`; returns a summary dict.
+
+    `prefetch` bounds how many decoded images (and SAM masks) may wait for the
+    diffusion stage; 0 runs the stages one after another for comparison.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    done = completed_ids(out_dir) if resume else set()
+    todo = [item for item in items if item.id not in done]
+    if done:
+        log(f"Resuming: {len(items) - len(todo)} of {len(items)} item(s) already done")
+
+    stop = threading.Event()
+    counts = {"ok": 0, "error": 0}
+    stage_totals = {"decode_s": 0.0, "sam_s": 0.0, "inpaint_s": 0.0, "save_s": 0.0}
+    start = time.perf_counter()
+
+    def decode(item):
+        work = _Work(item, started=time.perf_counter())
+        try:
+            work.image, scale, (left, top) = prepare_image(item.image)
+            work.points = [[(x + left) * scale, (y + top) * scale] for x, y in item.points]
+        except Exception as e:
+            work.error = f"decode: {e}"
+        work.timings["decode_s"] = time.perf_counter() - work.started
+        return work
+
+    def sam(work):
+        if work.error is None:
+            began = time.perf_counter()
+            try:
+                # `get_processed_inputs` returns the background mask (True outside the subject)
+                mask = resize_mask(get_processed_inputs(work.image, [work.points]), (IMG_SIZE, IMG_SIZE))
+                work.mask = ~mask if work.item.invert else mask
+            except Exception as e:
+                work.error = f"sam: {e}"
+            work.timings["sam_s"] = time.perf_counter() - began
+        return work
+
+    def diffuse(work):
+        if work.error is None:
+            began = time.perf_counter()
+            item = work.item
+            try:
+                work.result = inpaint(work.image, work.mask, item.prompt, item.negative_prompt, item.seed, item.cfg)
+            except Exception as e:
+                work.error = f"inpaint: {e}"
+            work.timings["inpaint_s"] = time.perf_counter() - began
+        return work
+
+    results_file = open(out_dir / RESULTS_NAME, "a")
+
+    def save(work):
+        output = f"{work.item.id}.png"
+        if work.error is None:
+            began = time.perf_counter()
+            try:
+                tmp = out_dir / f".{output}.tmp"
+                work.result.save(tmp, format="PNG")
+                tmp.replace(out_dir / output)
+            except Exception as e:
+                work.error = f"save: {e}"
+            work.timings["save_s"] = time.perf_counter() - began
+        work.timings["total_s"] = time.perf_counter() - work.started
+        status = "ok" if work.error is None else "error"
+        counts[status] += 1
+        for name in stage_totals:
+            stage_totals[name] += work.timings.get(name, 0.0)
+        record = {**asdict(work.item), "output": output, "status": status, "error": work.error,
+                  **{name: round(value, 4) for name, value in work.timings.items()}}
+        # One line per finished item, flushed right away: this file is the checkpoint
+        results_file.write(json.dumps(record) + "\n")
+        results_file.flush()
+        finished = counts["ok"] + counts["error"]
+        detail = f"{work.timings.get('inpaint_s', 0.0):.1f}s inpaint" if work.error is None else work.error
+        log(f"[{finished}/{len(todo)}] {work.item.id}: {status} ({detail})")
+
+    try:
+        if prefetch <= 0:
+            for item in todo:
+                if stop.is_set():
+                    break
+                save(diffuse(sam(decode(item))))
+        else:
+            _run_pipelined(todo, decode, sam, diffuse, save, prefetch, stop)
+    except KeyboardInterrupt:
+        stop.set()
+        log("Interrupted: finished items are recorded, run the same command again to resume")
+    finally:
+        results_file.close()
+
+    wall = time.perf_counter() - start
+    finished = counts["ok"] + counts["error"]
+    return {
+        "items": len(items),
+        "skipped": len(items) - len(todo),
+        **counts,
+        "wall_s": wall,
+        "s_per_item": wall / finished if finished else None,
+        **stage_totals,
+    }
+
+
+def _run_pipelined(todo, decode, sam, diffuse, save, prefetch, stop):
+    """Decode pool -> SAM thread -> diffusion on the calling thread -> writer thread, in manifest order."""
+    decoded = queue.Queue(maxsize=prefetch)
+    masked = queue.Queue(maxsize=max(1, prefetch // 2))
+    finished = queue.Queue(maxsize=prefetch)
+
+    def put(q, value):
+        # Give up on a full queue once the run is stopping, so no thread hangs
+        while not stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def produce():
+        with ThreadPoolExecutor(max_workers=max(1, min(prefetch, 4)), thread_name_prefix="decode") as pool:
+            pending = []
+            for item in todo:
+                pending.append(pool.submit(decode, item))
+                # Keep at most `prefetch` decodes in flight beyond what the queue holds
+                while len(pending) >= prefetch:
+                    if not put(decoded, pending.pop(0).result()):
+                        return
+            for future in pending:
+                if not put(decoded, future.result()):
+                    return
+        put(decoded, _DONE)
+
+    def segment():
+        while True:
+            work = get(decoded)
+            if work is _DONE:
+                put(masked, _DONE)
+                return
+            if not put(masked, sam(work)):
+                return
+
+    errors = []
+
+    def write():
+        while True:
+            work = get(finished)
+            if work is _DONE:
+                return
+            try:
+                save(work)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+
+    threads = [threading.Thread(target=target, name=name, daemon=True)
+               for target, name in ((produce, "batch-decode"), (segment, "batch-sam"), (write, "batch-save"))]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            work = get(masked)
+            if work is _DONE:
+                break
+            put(finished, diffuse(work))
+        put(finished, _DONE)
+        threads[2].join()
+    finally:
+        # On Ctrl+C or a writer failure: let the writer drain what is finished, then stop the rest
+        if threads[2].is_alive():
+            put(finished, _DONE)
+            threads[2].join(timeout=30)
+        stop.set()
+        for thread in threads[:2]:
+            thread.join(timeout=5)
+    if errors:
+        raise errors[0]
+
+
+def stub_models(size=64, steps=10, gpu_s=0.0):
+    """
+    (get_processed_inputs, inpaint) CPU stand-ins with the notebook's contract.
+
+    SAM returns a disc around the clicked points; inpainting runs
+    `stand_in_pipeline.TinyInpaintPipeline`, resized back to the input size, then waits
+    `gpu_s` seconds without holding the CPU, like a process waiting on its GPU.
+    """
+    import torch
+
+    from stand_in_pipeline import TinyInpaintPipeline
+
+    pipeline = TinyInpaintPipeline(size=size, steps=steps, offload=False)
+
+    def get_processed_inputs(image, input_points):
+        points = np.asarray(input_points[0], dtype=np.float32)
+        centre = points.mean(axis=0)
+        radius = max(float(np.linalg.norm(points - centre, axis=1).max()), image.width / 8)
+        yy, xx = np.mgrid[:image.height, :image.width]
+        return (xx - centre[0]) ** 2 + (yy - centre[1]) ** 2 > radius ** 2
+
+    def inpaint(raw_image, input_mask, prompt, negative_prompt=None, seed=74294536, cfgs=7):
+        image = pipeline(prompt=prompt, negative_prompt=negative_prompt, image=raw_image,
+                         mask_image=Image.fromarray(input_mask), generator=torch.manual_seed(seed),
+                         guidance_scale=cfgs).images[0]
+        time.sleep(gpu_s)
+        return image.resize(raw_image.size)
+
+    return get_processed_inputs, inpaint
+
+
+def load_models(sam_checkpoint="facebook/sam-vit-base",
+                inpaint_checkpoint="diffusers/stable-diffusion-xl-1.0-inpainting-0.1"):
+    """(get_processed_inputs, inpaint) built like the notebook's cells, SAM cached per image."""
+    import torch
+    from diffusers import AutoPipelineForInpainting
+    from transformers import SamModel, SamProcessor
+
+    from sam_session import SamSession
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = SamModel.from_pretrained(sam_checkpoint).to(device)
+    processor = SamProcessor.from_pretrained(sam_checkpoint)
+    pipeline = AutoPipelineForInpainting.from_pretrained(inpaint_checkpoint, torch_dtype=torch.float16,
+                                                         variant="fp16")
+    pipeline.enable_model_cpu_offload()
+
+    def inpaint(raw_image, input_mask, prompt, negative_prompt=None, seed=74294536, cfgs=7):
+        return pipeline(prompt=prompt, negative_prompt=negative_prompt, image=raw_image,
+                        mask_image=Image.fromarray(input_mask), generator=torch.manual_seed(seed),
+                        guidance_scale=cfgs).images[0]
+
+    return SamSession(model, processor), inpaint
+
+
+def write_demo_manifest(path, count):
+    """A manifest of `count` items over the sample images, for trying the runner out."""
+    samples = [("car.png", [[150, 170], [300, 250]], "a car driving on planet Mars. Studio lights, 1970s"),
+               ("dragon.jpeg", [[256, 256]], "a dragon in a medieval village"),
+               ("monalisa.png", [[256, 200]], "a fantasy landscape with flying dragons")]
+    here = Path(__file__).resolve().parent
+    lines = []
+    for index in range(count):
+        image, points, prompt = samples[index % len(samples)]
+        lines.append(json.dumps({"id": f"demo_{index:03d}", "image": str(here / image), "points": points,
+                                 "prompt": prompt, "negative_prompt": "artifacts, low quality, distortion",
+                                 "seed": 74294536 + index}))
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SAM + inpainting over a JSON Lines manifest")
+    parser.add_argument("manifest", nargs="?", help="JSON Lines manifest (see the module docstring)")
+    parser.add_argument("--out", default="outputs/batch", help="output folder, also holds results.jsonl")
+    parser.add_argument("--prefetch", type=int, default=4, help="images decoded ahead; 0 = no pipelining")
+    parser.add_argument("--no-resume", action="store_true", help="redo items already in results.jsonl")
+    parser.add_argument("--stub", action="store_true", help="tiny CPU stand-ins instead of SAM + SDXL")
+    parser.add_argument("--stub-steps", type=int, default=10, help="denoising steps of the stand-in")
+    parser.add_argument("--stub-gpu-s", type=float, default=0.0,
+                        help="simulated GPU time per stand-in inpaint (CPU stays free, as with CUDA)")
+    parser.add_argument("--demo", type=int, default=None, metavar="N",
+                        help="write an N-item manifest of the sample images to <out>/manifest.jsonl and run it")
+    parser.add_argument("--sam-checkpoint", default="facebook/sam-vit-base")
+    parser.add_argument("--inpaint-checkpoint", default="diffusers/stable-diffusion-xl-1.0-inpainting-0.1")
+    args = parser.parse_args()
+
+    manifest = args.manifest
+    if args.demo is not None:
+        manifest = Path(args.out) / "manifest.jsonl"
+        write_demo_manifest(manifest, args.demo)
+    if manifest is None:
+        parser.error("a manifest (or --demo N) is required")
+
+    items = load_manifest(manifest)
+    if args.stub:
+        get_processed_inputs, inpaint = stub_models(steps=args.stub_steps, gpu_s=args.stub_gpu_s)
+    else:
+        get_processed_inputs, inpaint = load_models(args.sam_checkpoint, args.inpaint_checkpoint)
+
+    summary = run_manifest(items, get_processed_inputs, inpaint, args.out, prefetch=args.prefetch,
+                           resume=not args.no_resume)
+    per_item = f"{summary['s_per_item']:.2f}s/item" if summary["s_per_item"] else "nothing to do"
+    stages = ", ".join(f"{name[:-2]} {summary[name]:.1f}s" for name in ("decode_s", "sam_s", "inpaint_s", "save_s"))
+    print(f"{summary['ok']} ok, {summary['error']} failed, {summary['skipped']} skipped | "
+          f"wall {summary['wall_s']:.1f}s ({per_item}) | stage totals: {stages}")
+
+
+if __name__ == "__main__":
+    main()
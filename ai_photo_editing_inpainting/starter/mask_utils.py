@@ -0,0 +1,251 @@
+"""
+Vectorised mask post-processing.
+
+`run_sam` used to turn every SAM mask into a PIL image, resize it to 512x512 and
+convert it back (`np.array(Image.fromarray(mask).resize(...))`), then invert it
+once for the display and again for the inpaint. The helpers here work directly on
+boolean / uint8 NumPy arrays:
+
+- `resize_mask` nearest-neighbour resize to any (height, width) by slicing,
+  repeating or gathering rows/columns (pixel-identical to PIL's NEAREST),
+- `dilate` / `erode` with a square structuring element and `feather` (soft edge)
+  as box filters on a summed-area table, O(pixels) whatever the radius,
+- `remove_small_components` drops islands (or, on the inverted mask, fills holes)
+  below a pixel count,
+- `pack_mask` / `unpack_mask` store a mask as bits (1/8 of a bool array) for caches.
+
+Shapes are NumPy order, (height, width). Running this file benchmarks the old PIL
+path against the NumPy one:
+
+    python mask_utils.py --size 1024 --target 512
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+try:
+    from scipy import ndimage
+except ImportError:  # optional: a NumPy run-length labelling is used instead
+    ndimage = None
+
+
+def as_bool(mask):
+    mask = np.asarray(mask)
+    return mask if mask.dtype == bool else mask > 0
+
+
+def invert(mask):
+    return np.logical_not(as_bool(mask))
+
+
+def _resize_axis(mask, size, axis):
+    length = mask.shape[axis]
+    if length == size:
+        return mask
+    # Integer factors reduce to slicing / repeating, which are much cheaper than gathers
+    if length % size == 0:
+        step = length // size
+        return mask[(slice(None),) * axis + (slice(step // 2, None, step),)]
+    if size % length == 0:
+        return np.repeat(mask, size // length, axis=axis)
+    # Sample at output pixel centres like PIL's NEAREST, which accumulates the step in
+    # doubles (centre = 0.5 * scale, then += scale); cumsum repeats the same additions so
+    # rounding at exact ties matches too
+    scale = length / size
+    steps = np.full(size, scale)
+    steps[0] = 0.5 * scale
+    index = np.minimum(np.cumsum(steps).astype(np.intp), length - 1)
+    return mask.take(index, axis=axis)
+
+
+def resize_mask(mask, shape):
+    """Nearest-neighbour resize of a 2D mask to `shape` = (height, width)."""
+    mask = np.asarray(mask)
+    height, width = shape
+    return np.ascontiguousarray(_resize_axis(_resize_axis(mask, height, 0), width, 1))
+
+
+def _box_sum(values, radius):
+    """Sum over the (2r+1)x(2r+1) window around every pixel (zero padded), via a summed-area table."""
+    padded = np.pad(values, (radius + 1, radius))
+    table = padded.cumsum(axis=0).cumsum(axis=1)
+    size = 2 * radius + 1
+    return (table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size])
+
+
+def dilate(mask, radius):
+    """Grow the True region by `radius` pixels (square structuring element)."""
+    mask = as_bool(mask)
+    if radius <= 0:
+        return mask
+    return _box_sum(mask.astype(np.int32), radius) > 0
+
+
+def erode(mask, radius):
+    """Shrink the True region by `radius` pixels; pixels near the border count as outside."""
+    mask = as_bool(mask)
+    if radius <= 0:
+        return mask
+    return _box_sum(mask.astype(np.int32), radius) == (2 * radius + 1) ** 2
+
+
+def feather(mask, radius, passes=3):
+    """
+    Soft uint8 alpha (0-255) of a mask.
+
+    Three box blurs approximate a Gaussian with sigma ~ radius; suitable as
+    `mask_image` for diffusers, which accepts grey-level masks.
+    """
+    # float64: a float32 summed-area table of a large mask loses the low bits the
+    # window differences depend on
+    alpha = as_bool(mask).astype(np.float64)
+    if radius > 0:
+        area = float((2 * radius + 1) ** 2)
+        for _ in range(passes):
+            # Edge-replicate so the border does not fade towards 0
+            padded = np.pad(alpha, radius, mode="edge")
+            alpha = _box_sum(padded, radius)[radius:-radius, radius:-radius] / area
+    return np.round(alpha * 255).astype(np.uint8)
+
+
+def _label_runs(mask):
+    """4-connected component labels using row runs and union-find; returns (labels, sizes)."""
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+
+    parent = list(range(len(run_rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Runs are ordered by row, then column: merge each run with overlapping runs of the row above
+    row_bounds = np.searchsorted(run_rows, np.arange(height + 1))
+    for row in range(1, height):
+        above = range(row_bounds[row - 1], row_bounds[row])
+        current = range(row_bounds[row], row_bounds[row + 1])
+        j = above.start
+        for i in current:
+            while j < above.stop and run_ends[j] <= run_starts[i]:
+                j += 1
+            k = j
+            while k < above.stop and run_starts[k] < run_ends[i]:
+                root_i, root_k = find(i), find(k)
+                if root_i != root_k:
+                    parent[root_k] = root_i
+                k += 1
+
+    roots = np.array([find(i) for i in range(len(parent))], dtype=np.intp)
+    _, run_labels = np.unique(roots, return_inverse=True)
+    run_labels = run_labels + 1
+    labels = np.zeros((height, width), dtype=np.int32)
+    lengths = run_ends - run_starts
+    # Paint every run with its component label in one vectorised assignment
+    flat_starts = run_rows * width + run_starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    labels.ravel()[np.repeat(flat_starts, lengths) + offsets] = np.repeat(run_labels, lengths)
+    sizes = np.bincount(labels.ravel())
+    return labels, sizes
+
+
+def label_components(mask):
+    """(labels, sizes): 4-connected labels (0 = background) and pixel count per label."""
+    mask = as_bool(mask)
+    if ndimage is not None:
+        labels, _ = ndimage.label(mask)
+        return labels, np.bincount(labels.ravel())
+    return _label_runs(mask)
+
+
+def remove_small_components(mask, min_size):
+    """Drop True components smaller than `min_size` pixels (use `~mask` to fill small holes)."""
+    mask = as_bool(mask)
+    if min_size <= 1 or not mask.any():
+        return mask
+    labels, sizes = label_components(mask)
+    keep = sizes >= min_size
+    keep[0] = False
+    return keep[labels]
+
+
+def pack_mask(mask):
+    """(shape, bytes) of a mask stored as bits."""
+    mask = as_bool(mask)
+    return mask.shape, np.packbits(mask).tobytes()
+
+
+def unpack_mask(shape, bits):
+    count = int(np.prod(shape))
+    return np.unpackbits(np.frombuffer(bits, dtype=np.uint8), count=count).astype(bool).reshape(shape)
+
+
+def _old_path(mask, size):
+    from PIL import Image
+
+    res_mask = np.array(Image.fromarray(mask).resize((size, size)))
+    return res_mask, ~res_mask, ~res_mask
+
+
+def _new_path(mask, size):
+    res_mask = resize_mask(mask, (size, size))
+    subject = ~res_mask
+    return res_mask, subject, subject
+
+
+def _time(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PIL mask path against mask_utils")
+    parser.add_argument("--size", type=int, default=1024, help="source mask side (SAM returns the image size)")
+    parser.add_argument("--target", type=int, default=512)
+    parser.add_argument("--radius", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    yy, xx = np.mgrid[:args.size, :args.size]
+    centre = args.size / 2
+    mask = (yy - centre) ** 2 + (xx - centre * 0.8) ** 2 > (args.size / 4) ** 2
+    rng = np.random.default_rng(0)
+    mask[rng.integers(0, args.size, 200), rng.integers(0, args.size, 200)] ^= True  # speckle
+
+    old, new = _old_path(mask, args.target), _new_path(mask, args.target)
+    print(f"resize parity with PIL NEAREST: {all(np.array_equal(a, b) for a, b in zip(old, new))}")
+
+    from PIL import Image, ImageFilter
+
+    pil_dilate = lambda: np.array(Image.fromarray(mask.astype(np.uint8) * 255).filter(
+        ImageFilter.MaxFilter(2 * args.radius + 1))) > 0
+    pil_feather = lambda: np.array(Image.fromarray(mask.astype(np.uint8) * 255).filter(
+        ImageFilter.GaussianBlur(args.radius)))
+    cases = [
+        ("resize + invert (run_sam)", lambda: _old_path(mask, args.target), lambda: _new_path(mask, args.target)),
+        (f"dilate r={args.radius}", pil_dilate, lambda: dilate(mask, args.radius)),
+        (f"feather r={args.radius}", pil_feather, lambda: feather(mask, args.radius)),
+    ]
+    for name, old_fn, new_fn in cases:
+        old_ms, new_ms = _time(old_fn, args.repeats), _time(new_fn, args.repeats)
+        print(f"{name:28s} PIL {old_ms:8.3f} ms | NumPy {new_ms:8.3f} ms | x{old_ms / new_ms:.1f}")
+
+    print(f"{'remove_small_components':28s} {_time(lambda: remove_small_components(mask, 64), 5):8.3f} ms "
+          f"({'scipy' if ndimage is not None else 'run-length union-find'})")
+    shape, bits = pack_mask(mask)
+    print(f"packed mask: {len(bits):,} bytes vs {mask.nbytes:,} as bool")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Lazy, warm-start loading of SAM and the SDXL inpainting pipeline.
+
+Before the app can start, the notebook loads SAM and the SDXL pipeline and calls
+`enable_model_cpu_offload()`. That is a long cold start, and every kernel restart
+pays it again. This module provides two fixes.
+
+`LazyModels` loads each model on first use, or in a background thread after
+`start()`. The UI can come up while weights are still loading; a click that needs a
+model waits for it. `timings` records each startup phase:
+
+- `import_s`: importing torch, transformers and diffusers
+- `sam_load_s` / `pipeline_load_s`: reading the weights
+- `sam_place_s` / `pipeline_place_s`: moving to the GPU, or setting up CPU offload
+- `sam_first_call_s` / `inpaint_first_call_s`: the first inference (kernel compiles,
+  allocator warm-up)
+
+`python model_loader.py serve` keeps a `LazyModels` resident in a long-lived worker
+process. Notebooks and apps attach to it with `connect_models()`, so a kernel restart
+costs a reconnect instead of a reload. Images, masks and results cross the process
+boundary by pickling, which takes milliseconds at 512px.
+
+The server only accepts clients holding its authkey. It comes from
+`INPAINT_MODELS_AUTHKEY` if set, otherwise from a random key generated on first use and
+stored (mode 0600) in `~/.cache/inpainting/models.authkey` (under `XDG_CACHE_HOME` if
+set), which `serve` and `connect_models` on the same account both read.
+
+Streaming previews and cancellation (`inpaint_stream`) need the pipeline in the
+kernel's own process; through the server `inpaint` runs blocking.
+
+Usage from the notebook, instead of the SAM and pipeline cells:
+
+    from model_loader import connect_models
+    models = connect_models()  # attaches to `serve` if it runs, else loads in this process
+    my_app = app.generate_app(models.get_processed_inputs, models.inpaint)
+    models.status()            # loaded models and the phase timings
+
+From a shell:
+
+    python model_loader.py serve                # load once, serve until Ctrl+C
+    python model_loader.py timings --stub       # per-phase startup report
+"""
+
+import argparse
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+
+SAM_CHECKPOINT = "facebook/sam-vit-base"
+INPAINT_CHECKPOINT = "diffusers/stable-diffusion-xl-1.0-inpainting-0.1"
+DEFAULT_ADDRESS = ("127.0.0.1", 50077)
+AUTHKEY_ENV = "INPAINT_MODELS_AUTHKEY"
+AUTHKEY_PATH = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "inpainting" / "models.authkey"
+
+
+def default_authkey(path=AUTHKEY_PATH):
+    """`INPAINT_MODELS_AUTHKEY`, else this account's random key in `path` (created 0600 on first use)."""
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode()
+    path = Path(path)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    key = secrets.token_bytes(32)
+    try:
+        # O_EXCL: if `serve` and a client race to create the key, both end up with the winner's
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return path.read_bytes()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def load_sam(phase, checkpoint=SAM_CHECKPOINT, device=None):
+    """`get_processed_inputs` for SAM, as in the notebook but caching image embeddings."""
+    with phase("import"):
+        import torch
+        from transformers import SamModel, SamProcessor
+
+        from sam_session import SamSession
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    with phase("sam_load"):
+        model = SamModel.from_pretrained(checkpoint)
+        processor = SamProcessor.from_pretrained(checkpoint)
+    with phase("sam_place"):
+        model = model.to(device)
+    return SamSession(model, processor)
+
+
+def load_pipeline(phase, checkpoint=INPAINT_CHECKPOINT, cpu_offload=True):
+    """The notebook's `inpaint(raw_image, input_mask, prompt, negative_prompt, seed, cfgs)`."""
+    with phase("import"):
+        import torch
+        from diffusers import AutoPipelineForInpainting
+        from PIL import Image
+    with phase("pipeline_load"):
+        pipeline = AutoPipelineForInpainting.from_pretrained(checkpoint, torch_dtype=torch.float16,
+                                                             variant="fp16")
+    with phase("pipeline_place"):
+        if cpu_offload:
+            pipeline.enable_model_cpu_offload()
+        else:
+            pipeline = pipeline.to("cuda")
+
+    def inpaint(raw_image, input_mask, prompt, negative_prompt=None, seed=74294536, cfgs=7):
+        return pipeline(prompt=prompt, negative_prompt=negative_prompt, image=raw_image,
+                        mask_image=Image.fromarray(input_mask), generator=torch.manual_seed(seed),
+                        guidance_scale=cfgs).images[0]
+
+    return inpaint
+
+
+def stub_loaders(load_s=0.0):
+    """(sam_loader, pipeline_loader) building `batch_runner.stub_models` stand-ins; `load_s` fakes weight loading."""
+
+    def sam_loader(phase):
+        with phase("import"):
+            import torch  # noqa: F401  (loaded by the stand-ins; timed as an import like the real loaders)
+
+            from batch_runner import stub_models
+        with phase("sam_load"):
+            time.sleep(load_s)
+            return stub_models()[0]
+
+    def pipeline_loader(phase):
+        with phase("import"):
+            import torch  # noqa: F401  (loaded by the stand-ins; timed as an import like the real loaders)
+
+            from batch_runner import stub_models
+        with phase("pipeline_load"):
+            time.sleep(load_s)
+            return stub_models()[1]
+
+    return sam_loader, pipeline_loader
+
+
+class LazyModels:
+    """
+    SAM and the inpainting pipeline behind the notebook's two callables, loaded on first use.
+
+    `sam_loader(phase)` and `pipeline_loader(phase)` build the callables; they wrap
+    their steps in `with phase(name):` so the time lands in `timings[name + "_s"]`.
+    Both default to the notebook's models (see `load_sam` / `load_pipeline`).
+    """
+
+    def __init__(self, sam_loader=None, pipeline_loader=None):
+        self._loaders = {"sam": sam_loader or load_sam, "pipeline": pipeline_loader or load_pipeline}
+        self._models = {}
+        self._errors = {}
+        self._locks = {name: threading.Lock() for name in self._loaders}
+        self._timings_lock = threading.Lock()
+        self._first_calls = set()
+        self.timings = {}
+        self._created = time.perf_counter()
+        # Set once the background load of `start()` is over (successfully or not)
+        self._loaded = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._timings_lock:
+                key = f"{name}_s"
+                self.timings[key] = self.timings.get(key, 0.0) + time.perf_counter() - start
+
+    def _get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        # One loader per model runs at a time; later callers wait for it instead of loading twice
+        with self._locks[name]:
+            if name not in self._models:
+                try:
+                    self._models[name] = self._loaders[name](self.phase)
+                except Exception as e:
+                    self._errors[name] = repr(e)
+                    raise
+                self._errors.pop(name, None)
+                with self._timings_lock:
+                    self.timings[f"{name}_ready_after_s"] = time.perf_counter() - self._created
+            return self._models[name]
+
+    def _timed_call(self, name, fn, *args):
+        if name in self._first_calls:
+            return fn(*args)
+        with self.phase(name + "_first_call"):
+            result = fn(*args)
+        self._first_calls.add(name)
+        return result
+
+    def start(self, names=("sam", "pipeline")):
+        """Load `names` in a background thread (SAM first, it is needed for the first click); returns self."""
+
+        def load(name):
+            try:
+                self._get(name)
+            except Exception:
+                # Recorded in `status()`; the next call that needs the model retries and raises
+                pass
+
+        def load_all():
+            for name in names:
+                load(name)
+            loaded.set()
+
+        if self._loaded is None:
+            loaded = self._loaded = threading.Event()
+            threading.Thread(target=load_all, name="model-loader", daemon=True).start()
+        return self
+
+    def wait(self, timeout=None):
+        """Block until the models are loaded (or failed), starting the load if needed; True if all are ready."""
+        self.start()
+        self._loaded.wait(timeout)
+        return all(name in self._models for name in self._loaders)
+
+    def get_processed_inputs(self, image, input_points):
+        return self._timed_call("sam", self._get("sam"), image, input_points)
+
+    def inpaint(self, raw_image, input_mask, prompt, negative_prompt=None, seed=74294536, cfgs=7):
+        return self._timed_call("inpaint", self._get("pipeline"), raw_image, input_mask, prompt,
+                                negative_prompt, seed, cfgs)
+
+    def status(self):
+        with self._timings_lock:
+            timings = dict(self.timings)
+        return {
+            "loaded": sorted(self._models),
+            "errors": dict(self._errors),
+            "pid": os.getpid(),
+            "timings": timings,
+        }
+
+
+class _ModelManager(BaseManager):
+    pass
+
+
+def serve(models, address=DEFAULT_ADDRESS, authkey=None):
+    """Start loading `models` and serve them to `connect_models` clients until interrupted."""
+    authkey = authkey or default_authkey()
+    models.start()
+    _ModelManager.register("models", callable=lambda: models,
+                           exposed=("get_processed_inputs", "inpaint", "status", "wait"))
+    server = _ModelManager(address=address, authkey=authkey).get_server()
+    print(f"Serving models on {address[0]}:{address[1]} (pid {os.getpid()}), loading in the background")
+    server.serve_forever()
+
+
+class RemoteModels:
+    """Client of a `serve` process, with the same methods as `LazyModels`."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        _ModelManager.register("models")
+        manager = _ModelManager(address=address, authkey=authkey or default_authkey())
+        manager.connect()
+        # Proxies open one connection per calling thread, so concurrent app workers are fine
+        self._proxy = manager.models()
+        self.address = address
+
+    def get_processed_inputs(self, image, input_points):
+        return self._proxy.get_processed_inputs(image, input_points)
+
+    def inpaint(self, raw_image, input_mask, prompt, negative_prompt=None, seed=74294536, cfgs=7):
+        return self._proxy.inpaint(raw_image, input_mask, prompt, negative_prompt, seed, cfgs)
+
+    def wait(self, timeout=None):
+        return self._proxy.wait(timeout)
+
+    def status(self):
+        return {**self._proxy.status(), "address": self.address}
+
+
+def connect_models(address=DEFAULT_ADDRESS, authkey=None, fallback=True, **loaders):
+    """
+    Attach to a running `serve` process, or (with `fallback`) start a `LazyModels` here.
+
+    `loaders` (`sam_loader`, `pipeline_loader`) only apply to the in-process fallback.
+    """
+    try:
+        return RemoteModels(address, authkey)
+    except (ConnectionRefusedError, FileNotFoundError):
+        if not fallback:
+            raise
+    return LazyModels(**loaders).start()
+
+
+def format_timings(timings):
+    order = ["import_s", "sam_load_s", "sam_place_s", "sam_first_call_s",
+             "pipeline_load_s", "pipeline_place_s", "inpaint_first_call_s",
+             "sam_ready_after_s", "pipeline_ready_after_s"]
+    names = order + sorted(set(timings) - set(order))
+    return "\n".join(f"  {name[:-2]:24s} {timings[name]:7.2f}s" for name in names if name in timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep SAM + SDXL inpainting resident, or report startup timings")
+    parser.add_argument("command", choices=["serve", "timings"])
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--stub", action="store_true", help="CPU stand-ins instead of SAM + SDXL")
+    parser.add_argument("--stub-load-s", type=float, default=1.0, help="simulated weight loading per stand-in")
+    args = parser.parse_args()
+
+    loaders = {}
+    if args.stub:
+        loaders["sam_loader"], loaders["pipeline_loader"] = stub_loaders(args.stub_load_s)
+    models = LazyModels(**loaders)
+
+    if args.command == "serve":
+        try:
+            serve(models, (args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    import numpy as np
+    from PIL import Image
+
+    start = time.perf_counter()
+    models.start()
+    print(f"start() returned after {time.perf_counter() - start:.3f}s; loading continues in the background")
+    image = Image.new("RGB", (512, 512), "white")
+    mask = models.get_processed_inputs(image, [[[256, 256]]])
+    models.inpaint(image, np.asarray(mask), "a car driving on planet Mars")
+    models.get_processed_inputs(image, [[[200, 200]]])
+    print(f"first SAM mask + inpaint done after {time.perf_counter() - start:.2f}s")
+    print(format_timings(models.status()["timings"]))
+
+
+if __name__ == "__main__":
+    main()
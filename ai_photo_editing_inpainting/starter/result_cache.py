@@ -0,0 +1,395 @@
+"""
+Content-addressed cache of inpainting results.
+
+Re-running the exact same image + mask + prompts + seed + CFG used to recompute a
+multi-minute diffusion job, and every run left another timestamped PNG behind in
+`outputs/app_runs`. `ResultCache` stores each output once under the hash of
+everything that determines it, returns it instantly on a repeat, and evicts the
+least recently used results once the directory grows past `max_bytes` (512 MB by
+default). The key hashes the input image, the mask bits, both prompts, the seed, the
+CFG scale and `model`, so results from different checkpoints stay apart.
+
+`outputs/app_runs/index.json` replaces the single `latest.json`: it lists every
+cached result with its metadata, size and last use, plus the key of the latest run.
+`latest.png` is still written for quick viewing.
+
+Each image is encoded once (PNG by default, or WebP/JPEG with `image_format` and
+`quality`); `latest.<ext>` is a hard link to it (a copy where links are not
+supported), and the image, `latest` and `index.json` are each swapped in with an
+atomic rename so a reader never sees a half-written file. With `background=True`
+`put` only queues the write (at most `max_pending` results wait; beyond that `put`
+blocks) and a worker thread does the encoding off the request path. Queued results
+are already served by `get`; `flush()` waits for the queue to drain.
+
+A cache hit only updates the in-memory index (last use, hit count, latest) and marks
+it dirty; relinking `latest` and rewriting `index.json` happen on the writer thread
+(with `background=True`) or on the next `put` / `flush()`. `close()` flushes and stops
+the writer, and is registered with `atexit` so nothing queued is lost on exit. Write
+failures are logged and counted in `write_errors` instead of raised.
+
+The notebook's "Latest Gradio result" cell reads `image, metadata = ResultCache().latest()`;
+a `latest.png` from before the index existed is still returned (metadata `legacy=True`).
+The notebook's SDXL example cell keeps its results in a separate
+`ResultCache("outputs/notebook_runs")`, so they never become the app's latest result.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image
+
+from mask_utils import pack_mask
+
+DEFAULT_CACHE_DIR = Path("outputs/app_runs")
+INDEX_NAME = "index.json"
+LATEST_STEM = "latest"
+IMAGE_FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}
+# Queue item asking the writer thread to persist the index after cache hits
+_SAVE_INDEX = "save-index"
+
+logger = logging.getLogger(__name__)
+
+
+def image_key(image):
+    """Content hash of a PIL image (mode, size and pixels)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def mask_key(mask):
+    """Hash of a mask's shape and bits (any non-zero value counts as set)."""
+    shape, bits = pack_mask(mask)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(shape).encode())
+    digest.update(bits)
+    return digest.hexdigest()
+
+
+def inpaint_key(image, mask, prompt, negative_prompt=None, seed=74294536, cfg=7, model=""):
+    """
+    Cache key of one inpainting run.
+
+    `model` should change whenever the pipeline does (checkpoint, scheduler, steps),
+    since the cache cannot see it.
+    """
+    fields = [
+        image_key(image),
+        mask_key(mask),
+        prompt or "",
+        negative_prompt or "",
+        str(int(seed)),
+        repr(float(cfg)),
+        model,
+    ]
+    return hashlib.sha256("\0".join(fields).encode()).hexdigest()
+
+
+def _tmp_path(path):
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _atomic_write_bytes(path, data):
+    tmp = _tmp_path(path)
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _atomic_link(source, path):
+    """Point `path` at `source`'s bytes: hard link if possible, else copy; swapped in atomically."""
+    tmp = _tmp_path(path)
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        tmp.write_bytes(Path(source).read_bytes())
+    os.replace(tmp, path)
+
+
+class ResultCache:
+    """Inpainting outputs stored as `<key>.<ext>`, indexed by `index.json`, LRU-bounded in bytes."""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 ** 2, max_entries=None, model="",
+                 image_format="png", compress_level=6, quality=90, background=False, max_pending=8):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"image_format must be one of {sorted(IMAGE_FORMATS)}, got {image_format!r}")
+        self.root = Path(root)
+        self.model = model
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / INDEX_NAME
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.quality = quality
+        self.latest_path = self.root / f"{LATEST_STEM}.{image_format}"
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_errors = 0
+        self._index = self._load_index()
+        self._index_dirty = False
+
+        self.background = background
+        # key -> image for results queued but not yet on disk
+        self._pending = {}
+        self._queue = queue.Queue(maxsize=max_pending) if background else None
+        self._worker = None
+        atexit.register(self.close)
+
+    def _load_index(self):
+        if self.index_path.exists():
+            try:
+                index = json.loads(self.index_path.read_text())
+            except json.JSONDecodeError:
+                index = {}
+        else:
+            index = {}
+        index.setdefault("entries", {})
+        index.setdefault("latest", None)
+        # Drop entries whose image was deleted by hand
+        index["entries"] = {
+            key: entry for key, entry in index["entries"].items() if (self.root / entry["file"]).exists()
+        }
+        if index["latest"] not in index["entries"]:
+            index["latest"] = None
+        return index
+
+    def _write_index(self):
+        _atomic_write_bytes(self.index_path, json.dumps(self._index, indent=2).encode())
+        self._index_dirty = False
+
+    def _save_index(self):
+        """Relink `latest` and write `index.json` if cache hits changed them."""
+        with self._lock:
+            if not self._index_dirty:
+                return
+            latest = self._index["latest"]
+            if latest is not None:
+                _atomic_link(self.root / self._index["entries"][latest]["file"], self.latest_path)
+            self._write_index()
+
+    def key(self, image, mask, prompt, negative_prompt=None, seed=74294536, cfg=7):
+        """`inpaint_key` scoped to this cache's `model` label."""
+        return inpaint_key(image, mask, prompt, negative_prompt, seed, cfg, model=self.model)
+
+    def path_for(self, key):
+        return self.root / f"{key}.{self.image_format}"
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pending or key in self._index["entries"]
+
+    def __len__(self):
+        return len(self._index["entries"])
+
+    @property
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self._index["entries"].values())
+
+    def get(self, key):
+        """The cached image for `key` (marked as latest and recently used), or None."""
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.hits += 1
+                return pending
+            entry = self._index["entries"].get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = self.root / entry["file"]
+            try:
+                image = Image.open(path)
+                image.load()
+            except FileNotFoundError:
+                del self._index["entries"][key]
+                self._index_dirty = True
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._index["latest"] = key
+            self._index_dirty = True
+        if self.background:
+            self._start_worker()
+            try:
+                self._queue.put_nowait(_SAVE_INDEX)
+            except queue.Full:
+                pass  # the queued writes persist the index anyway
+        return image
+
+    def metadata(self, key):
+        with self._lock:
+            entry = self._index["entries"].get(key)
+            return dict(entry) if entry is not None else None
+
+    def _encode(self, image, path):
+        tmp = _tmp_path(path)
+        if self.image_format == "png":
+            image.save(tmp, format="PNG", compress_level=self.compress_level)
+        elif self.image_format == "webp":
+            image.save(tmp, format="WEBP", quality=self.quality, method=min(self.compress_level, 6))
+        else:
+            image.convert("RGB").save(tmp, format="JPEG", quality=self.quality)
+        os.replace(tmp, path)
+
+    def _write(self, key, image, metadata):
+        path = self.path_for(key)
+        # Encoding is the slow part and touches no shared state, so it runs outside the lock
+        self._encode(image, path)
+        with self._lock:
+            now = time.time()
+            self._index["entries"][key] = {
+                **metadata,
+                "file": path.name,
+                "format": self.image_format,
+                "bytes": path.stat().st_size,
+                "created": now,
+                "last_used": now,
+                "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+                "image_path": str(path.resolve()),
+                "hits": 0,
+            }
+            self._index["latest"] = key
+            _atomic_link(path, self.latest_path)
+            self._evict()
+            self._write_index()
+            self._pending.pop(key, None)
+        return path
+
+    def put(self, key, image, **metadata):
+        """
+        Store `image` under `key` with free-form metadata; returns the image path.
+
+        With `background=True` the path is where the image will be once the writer
+        thread gets to it.
+        """
+        if not self.background:
+            return self._write(key, image, metadata)
+
+        self._start_worker()
+        with self._lock:
+            self._pending[key] = image
+        # Blocks while `max_pending` results are already waiting (backpressure)
+        self._queue.put((key, image, metadata))
+        return self.path_for(key)
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._drain, name="result-cache-writer", daemon=True)
+                self._worker.start()
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if item == _SAVE_INDEX:
+                    try:
+                        self._save_index()
+                    except OSError:
+                        logger.exception("ResultCache: could not write %s", self.index_path)
+                    continue
+                key, image, metadata = item
+                try:
+                    self._write(key, image, metadata)
+                except Exception:
+                    with self._lock:
+                        self._pending.pop(key, None)
+                        self.write_errors += 1
+                    logger.exception("ResultCache: could not store %s", key)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued result and index update is on disk."""
+        if self._queue is not None:
+            self._queue.join()
+        self._save_index()
+
+    def close(self):
+        """Flush and stop the writer thread (also run at interpreter exit)."""
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.join()
+            self._queue.put(None)
+            self._worker.join()
+        self._worker = None
+        self._save_index()
+
+    def get_or_create(self, key, create, **metadata):
+        image = self.get(key)
+        if image is None:
+            image = create()
+            self.put(key, image, **metadata)
+        return image
+
+    def _evict(self):
+        entries = self._index["entries"]
+        latest = self._index["latest"]
+
+        def over_budget():
+            too_big = self.max_bytes is not None and self.total_bytes > self.max_bytes
+            too_many = self.max_entries is not None and len(entries) > self.max_entries
+            return too_big or too_many
+
+        # Least recently used first; the latest result is never evicted
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if not over_budget():
+                break
+            if key == latest:
+                continue
+            (self.root / entries.pop(key)["file"]).unlink(missing_ok=True)
+            self.evictions += 1
+
+    def latest(self):
+        """(image, metadata) of the most recent stored run or cache hit, or (None, None)."""
+        with self._lock:
+            key = self._index["latest"]
+            if key is None:
+                return self._legacy_latest()
+            entry = dict(self._index["entries"][key])
+        image = Image.open(self.root / entry["file"])
+        image.load()
+        return image, {"key": key, **entry}
+
+    def _legacy_latest(self):
+        # `latest.png` written before the index existed (its metadata was the old latest.json)
+        if not self.latest_path.exists():
+            return None, None
+        image = Image.open(self.latest_path)
+        image.load()
+        return image, {"key": None, "file": self.latest_path.name, "image_path": str(self.latest_path.resolve()),
+                       "legacy": True}
+
+    def clear(self):
+        self.flush()
+        with self._lock:
+            for entry in self._index["entries"].values():
+                (self.root / entry["file"]).unlink(missing_ok=True)
+            self._index = {"entries": {}, "latest": None}
+            self._write_index()
+
+    def stats(self):
+        return {
+            "entries": len(self),
+            "bytes": self.total_bytes,
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "write_errors": self.write_errors,
+        }
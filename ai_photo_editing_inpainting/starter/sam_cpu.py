@@ -0,0 +1,248 @@
+"""
+CPU-optimised SAM backend for machines without a GPU.
+
+The notebook loads `facebook/sam-vit-base` in fp32 on CUDA; on CPU-only annotation
+boxes each image encode is a full fp32 ViT pass. `CpuSamBackend` keeps the
+`get_processed_inputs(image, input_points)` contract (and `SamSession`'s per-image
+embedding cache) but:
+
+1. applies dynamic int8 quantisation to the Linear layers of the image encoder and
+   mask decoder (weights stored as int8, activations quantised on the fly),
+2. runs the image encoder as a TorchScript graph traced once for SAM's fixed
+   1024x1024 input (optionally saved/loaded with `export_path`),
+3. runs the prompt encoder + mask decoder as TorchScript graphs too, traced once per
+   prompt shape (number of points) and saved next to `export_path`, and
+4. pins the number of intra-op threads used by torch.
+
+Each saved graph gets a `.json` sidecar recording the checkpoint, the quantize flag and
+the torch version; an export whose sidecar does not match is re-traced and overwritten
+rather than loaded.
+
+`torch.ao.quantization.quantize_dynamic`, `torch.jit.trace` and `torch.jit.freeze` are
+deprecated in the pinned torch (2.x) and print DeprecationWarning/FutureWarning on
+first use; they still work, and their replacements (torch.export + torchao) are not
+installed in this environment.
+
+Usage from the notebook:
+
+    from sam_cpu import CpuSamBackend
+    cpu_sam = CpuSamBackend(model, processor, num_threads=4)
+    my_app = app.generate_app(cpu_sam, inpaint)
+
+Running this file compares the backend with the reference fp32 model on the sample
+image: mask IoU per prompt (parity) and per-call latency.
+
+    python sam_cpu.py --threads 4
+"""
+
+import argparse
+import copy
+import json
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from sam_session import ImageEmbedding, SamSession
+
+SAM_INPUT_SIZE = 1024
+
+
+class _ImageEncoder(torch.nn.Module):
+    def __init__(self, sam_model):
+        super().__init__()
+        self.vision_encoder = sam_model.vision_encoder
+
+    def forward(self, pixel_values):
+        return self.vision_encoder(pixel_values, return_dict=False)[0]
+
+
+def quantize_sam(model):
+    """CPU fp32 copy of `model` with int8 dynamic quantisation on its Linear layers."""
+    cpu_model = copy.deepcopy(model).float().cpu().eval()
+    cpu_model.vision_encoder = torch.ao.quantization.quantize_dynamic(
+        cpu_model.vision_encoder, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    cpu_model.mask_decoder = torch.ao.quantization.quantize_dynamic(
+        cpu_model.mask_decoder, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return cpu_model
+
+
+class _PromptDecoder(torch.nn.Module):
+    def __init__(self, sam_model):
+        super().__init__()
+        self.sam_model = sam_model
+
+    def forward(self, image_embeddings, input_points):
+        outputs = self.sam_model(image_embeddings=image_embeddings, input_points=input_points,
+                                 multimask_output=True)
+        return outputs.pred_masks, outputs.iou_scores
+
+
+def export_signature(model, quantize):
+    """What a saved graph was traced from; an export is only reused when this matches."""
+    checkpoint = getattr(getattr(model, "config", None), "_name_or_path", None) or type(model).__name__
+    return {"checkpoint": checkpoint, "quantize": bool(quantize), "torch": torch.__version__}
+
+
+def _load_or_trace(module, example_inputs, export_path=None, signature=None):
+    if export_path is not None:
+        export_path = Path(export_path)
+        sidecar = export_path.with_name(export_path.name + ".json")
+        if export_path.exists() and sidecar.exists() and json.loads(sidecar.read_text()) == signature:
+            return torch.jit.load(str(export_path), map_location="cpu")
+    with torch.inference_mode():
+        traced = torch.jit.trace(module.eval(), example_inputs, check_trace=False)
+    traced = torch.jit.freeze(traced)
+    if export_path is not None:
+        export_path.parent.mkdir(parents=True, exist_ok=True)
+        torch.jit.save(traced, str(export_path))
+        sidecar.write_text(json.dumps(signature, indent=2))
+    return traced
+
+
+def trace_mask_decoder(model, image_embeddings, points, export_path=None, signature=None):
+    """TorchScript graph of SAM's prompt encoder + mask decoder for `points` of this shape."""
+    return _load_or_trace(_PromptDecoder(model), (image_embeddings, points), export_path, signature)
+
+
+def trace_image_encoder(model, export_path=None, signature=None):
+    """TorchScript graph of SAM's image encoder for a 1x3x1024x1024 input."""
+    example = torch.zeros(1, 3, SAM_INPUT_SIZE, SAM_INPUT_SIZE)
+    return _load_or_trace(_ImageEncoder(model), example, export_path, signature)
+
+
+class CpuSamBackend(SamSession):
+    """Quantised, traced SAM behind the `get_processed_inputs` contract."""
+
+    def __init__(self, model, processor, num_threads=None, quantize=True, trace=True,
+                 export_path=None, max_cached_images=8):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        cpu_model = quantize_sam(model) if quantize else copy.deepcopy(model).float().cpu().eval()
+        super().__init__(cpu_model, processor, device=torch.device("cpu"),
+                         max_cached_images=max_cached_images)
+        self.export_signature = export_signature(model, quantize)
+        self.image_encoder = (trace_image_encoder(cpu_model, export_path, self.export_signature) if trace
+                              else _ImageEncoder(cpu_model))
+        self.trace = trace
+        self.export_path = export_path
+        # Traced decoders by input_points shape; a click adds a point, so a session sees a handful
+        self._decoders = {}
+        self._decoder_lock = threading.Lock()
+
+    def _decoder_for(self, image_embeddings, points):
+        shape = tuple(points.shape)
+        with self._decoder_lock:
+            decoder = self._decoders.get(shape)
+            if decoder is None:
+                export_path = None
+                if self.export_path is not None:
+                    base = Path(self.export_path)
+                    export_path = base.with_name(f"{base.stem}-decoder-{'x'.join(map(str, shape))}{base.suffix}")
+                decoder = self._decoders[shape] = trace_mask_decoder(self.model, image_embeddings, points,
+                                                                     export_path, self.export_signature)
+            return decoder
+
+    def _decode(self, image_embeddings, points):
+        if not self.trace:
+            return super()._decode(image_embeddings, points)
+        decoder = self._decoder_for(image_embeddings, points)
+        with torch.inference_mode():
+            return decoder(image_embeddings, points)
+
+    def _encode(self, image):
+        inputs = self.processor(images=image, return_tensors="pt")
+        with torch.inference_mode():
+            embeddings = self.image_encoder(inputs["pixel_values"].float())
+        return ImageEmbedding(
+            image_embeddings=embeddings,
+            original_size=tuple(int(v) for v in inputs["original_sizes"][0]),
+            reshaped_size=tuple(int(v) for v in inputs["reshaped_input_sizes"][0]),
+        )
+
+
+def mask_iou(a, b):
+    a = np.asarray(a, dtype=bool)
+    b = np.asarray(b, dtype=bool)
+    union = np.logical_or(a, b).sum()
+    return 1.0 if union == 0 else float(np.logical_and(a, b).sum() / union)
+
+
+def compare_backends(reference, candidate, image, prompts, repeats=3):
+    """
+    Parity and latency of two `get_processed_inputs`-style callables.
+
+    Both are called on fresh copies of `image` so embedding caches cannot hide the
+    encoder cost; IoU is measured on the subject (`~mask`) region.
+    """
+    report = {"prompts": [], "reference_s": [], "candidate_s": []}
+    for points in prompts:
+        ref_mask = cand_mask = None
+        for _ in range(repeats):
+            if hasattr(candidate, "clear"):
+                candidate.clear()
+            start = time.perf_counter()
+            ref_mask = reference(image.copy(), points)
+            report["reference_s"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            cand_mask = candidate(image.copy(), points)
+            report["candidate_s"].append(time.perf_counter() - start)
+        report["prompts"].append({"points": points, "iou": mask_iou(~ref_mask, ~cand_mask)})
+
+    report["min_iou"] = min(item["iou"] for item in report["prompts"])
+    report["reference_median_s"] = float(np.median(report["reference_s"]))
+    report["candidate_median_s"] = float(np.median(report["candidate_s"]))
+    report["speedup"] = report["reference_median_s"] / report["candidate_median_s"]
+    return report
+
+
+def reference_backend(model, processor):
+    """The notebook's `get_processed_inputs`, pinned to CPU fp32."""
+    model = model.float().cpu().eval()
+
+    def get_processed_inputs(image, input_points):
+        inputs = processor(images=image, input_points=input_points, return_tensors="pt")
+        with torch.inference_mode():
+            outputs = model(**inputs)
+        masks = processor.image_processor.post_process_masks(
+            outputs.pred_masks.cpu(), inputs["original_sizes"].cpu(), inputs["reshaped_input_sizes"].cpu()
+        )
+        return ~masks[0][0][outputs.iou_scores.argmax()].numpy()
+
+    return get_processed_inputs
+
+
+def main():
+    from PIL import Image
+    from transformers import SamModel, SamProcessor
+
+    parser = argparse.ArgumentParser(description="Compare the CPU SAM backend with the fp32 reference")
+    parser.add_argument("--checkpoint", default="facebook/sam-vit-base")
+    parser.add_argument("--image", default="car.png")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-iou", type=float, default=0.9, help="fail if any prompt's IoU is below this")
+    args = parser.parse_args()
+
+    model = SamModel.from_pretrained(args.checkpoint)
+    processor = SamProcessor.from_pretrained(args.checkpoint)
+    image = Image.open(args.image).convert("RGB").resize((512, 512))
+    prompts = [[[[150, 170], [300, 250]]], [[[256, 256]]], [[[100, 300], [400, 300], [250, 200]]]]
+
+    candidate = CpuSamBackend(model, processor, num_threads=args.threads)
+    report = compare_backends(reference_backend(model, processor), candidate, image, prompts, args.repeats)
+
+    for item in report["prompts"]:
+        print(f"points={item['points']}: IoU {item['iou']:.3f}")
+    print(f"reference {report['reference_median_s']:.2f}s | int8+traced {report['candidate_median_s']:.2f}s "
+          f"| speedup x{report['speedup']:.2f}")
+    if report["min_iou"] < args.min_iou:
+        raise SystemExit(f"Parity check failed: min IoU {report['min_iou']:.3f} < {args.min_iou}")
+
+
+if __name__ == "__main__":
+    main()
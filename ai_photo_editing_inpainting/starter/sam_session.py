@@ -0,0 +1,136 @@
+"""
+Cached SAM inference for interactive point prompting.
+
+Every click in the app used to call `get_processed_inputs(input_image, [input_points])`,
+which reruns SAM's ViT image encoder even though only the prompt points changed.
+`SamSession` runs the encoder once per image (keyed by a hash of the pixels), keeps
+the embeddings in a small LRU cache, and on later clicks only runs the lightweight
+prompt encoder + mask decoder.
+
+The session is a drop-in for `get_processed_inputs`: it is called with the same
+`(image, input_points)` arguments and returns the same inverted boolean mask, so the
+notebook can launch the app with
+
+    sam_session = SamSession(model, processor)
+    my_app = app.generate_app(sam_session, inpaint)
+
+Any `SamModel`/`SamProcessor` pair works, including a tiny randomly initialised
+`SamModel(SamConfig(...))` on CPU for quick checks.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+
+# Shared with the result cache, which must not import torch
+from result_cache import image_key
+
+
+@dataclass
+class ImageEmbedding:
+    image_embeddings: torch.Tensor
+    original_size: tuple  # (height, width) of the input image
+    reshaped_size: tuple  # (height, width) after SAM's longest-side resize
+
+
+class SamSession:
+    """Image-embedding cache in front of a SAM model."""
+
+    def __init__(self, model, processor, device=None, max_cached_images=8):
+        self.model = model
+        self.processor = processor
+        self.device = device or next(model.parameters()).device
+        self.max_cached_images = max_cached_images
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_timings = {}
+
+    def _encode(self, image):
+        inputs = self.processor(images=image, return_tensors="pt").to(self.device)
+        with torch.inference_mode():
+            embeddings = self.model.get_image_embeddings(inputs["pixel_values"])
+        return ImageEmbedding(
+            image_embeddings=embeddings,
+            original_size=tuple(int(v) for v in inputs["original_sizes"][0]),
+            reshaped_size=tuple(int(v) for v in inputs["reshaped_input_sizes"][0]),
+        )
+
+    def embedding_for(self, image):
+        """Return the cached embedding for `image`, running the encoder on a miss."""
+        key = image_key(image)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        cached = self._encode(image)
+        with self._lock:
+            self._cache[key] = cached
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached_images:
+                self._cache.popitem(last=False)
+        return cached
+
+    def _scale_points(self, input_points, embedding):
+        # Same transform as SamProcessor: pixel coords -> coords in the resized 1024px frame
+        old_h, old_w = embedding.original_size
+        new_h, new_w = embedding.reshaped_size
+        points = np.asarray(input_points, dtype=np.float32).copy()
+        points[..., 0] *= new_w / old_w
+        points[..., 1] *= new_h / old_h
+        # SAM expects (batch, point_batch, points_per_mask, 2)
+        while points.ndim < 4:
+            points = points[None]
+        return torch.from_numpy(points).to(self.device)
+
+    def _decode(self, image_embeddings, points):
+        """Prompt encoder + mask decoder: (low-resolution pred_masks, iou_scores)."""
+        with torch.inference_mode():
+            outputs = self.model(image_embeddings=image_embeddings, input_points=points, multimask_output=True)
+        return outputs.pred_masks, outputs.iou_scores
+
+    def predict_masks(self, image, input_points):
+        """Low-resolution SAM outputs upscaled to the image size: (masks, iou_scores)."""
+        start = time.perf_counter()
+        embedding = self.embedding_for(image)
+        encoded = time.perf_counter()
+
+        pred_masks, iou_scores = self._decode(embedding.image_embeddings, self._scale_points(input_points, embedding))
+        masks = self.processor.image_processor.post_process_masks(
+            pred_masks.cpu(),
+            torch.tensor([embedding.original_size]),
+            torch.tensor([embedding.reshaped_size]),
+        )
+        self.last_timings = {
+            "encoder_s": encoded - start,
+            "decoder_s": time.perf_counter() - encoded,
+        }
+        return masks[0][0], iou_scores.cpu()
+
+    def __call__(self, image, input_points):
+        """Same contract as the notebook's `get_processed_inputs`."""
+        masks, iou_scores = self.predict_masks(image, input_points)
+        best_mask = masks[iou_scores.argmax()]
+        # Subject = 0 / background = 1, matching get_processed_inputs
+        return ~best_mask.numpy()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        return {
+            "cached_images": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            **self.last_timings,
+        }
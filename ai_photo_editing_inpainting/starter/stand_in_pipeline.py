@@ -0,0 +1,101 @@
+"""
+Tiny CPU stand-in for the notebook's SDXL inpainting pipeline.
+
+Only the benchmark / demo entry points of `batch_inpaint.py`, `region_inpaint.py` and
+`batch_runner.py` use it, so they can run without a GPU or the diffusers weights;
+nothing the app or notebook imports depends on it.
+"""
+
+import copy
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+class _PipelineOutput:
+    def __init__(self, images):
+        self.images = images
+
+
+class TinyInpaintPipeline:
+    """
+    CPU stand-in with the call signature of diffusers' inpainting pipelines.
+
+    It has the same cost structure at toy scale: a text encoder run per call, a
+    conv "UNet" run for every denoising step on a batch doubled by CFG, a VAE-like
+    encode/decode, and (with `offload=True`) a copy of all weights at the start of
+    each call standing in for `enable_model_cpu_offload()` transfers. Outputs are
+    deterministic per generator seed and independent of batch composition.
+    `callback_on_step_end`, `num_timesteps` and `interrupt` follow diffusers.
+    """
+
+    def __init__(self, size=64, channels=64, steps=20, offload=True):
+        torch.manual_seed(0)
+        self.size = size
+        self.steps = steps
+        self.offload = offload
+        self.num_timesteps = steps
+        self._interrupt = False
+        self.text_encoder = torch.nn.Sequential(
+            torch.nn.Embedding(256, 256), torch.nn.Linear(256, 256), torch.nn.GELU(), torch.nn.Linear(256, channels)
+        ).eval()
+        self.unet = torch.nn.Sequential(
+            torch.nn.Conv2d(9, channels, 3, padding=1), torch.nn.SiLU(),
+            torch.nn.Conv2d(channels, channels, 3, padding=1), torch.nn.SiLU(),
+            torch.nn.Conv2d(channels, 4, 3, padding=1),
+        ).eval()
+        self.vae_encoder = torch.nn.Conv2d(3, 4, 8, stride=8).eval()
+        self.vae_decoder = torch.nn.ConvTranspose2d(4, 3, 8, stride=8).eval()
+
+    @property
+    def interrupt(self):
+        return self._interrupt
+
+    def _encode_prompt(self, prompts):
+        tokens = torch.tensor([[b for b in text.encode()[:77].ljust(77, b"\0")] for text in prompts])
+        return self.text_encoder(tokens).mean(dim=1)
+
+    @torch.inference_mode()
+    def __call__(self, prompt, negative_prompt=None, image=None, mask_image=None, generator=None,
+                 guidance_scale=7.0, callback_on_step_end=None, callback_on_step_end_tensor_inputs=("latents",)):
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        negatives = [negative_prompt or ""] * len(prompts) if not isinstance(negative_prompt, list) else negative_prompt
+        generators = generator if isinstance(generator, list) else [generator] * len(prompts)
+        batch = len(prompts)
+
+        if self.offload:
+            for module in (self.text_encoder, self.unet, self.vae_encoder, self.vae_decoder):
+                copy.deepcopy(module)
+
+        images = image if isinstance(image, list) else [image] * batch
+        masks = mask_image if isinstance(mask_image, list) else [mask_image] * batch
+
+        text = self._encode_prompt(negatives + prompts)[:, :, None, None]
+        pixels = torch.from_numpy(np.stack([
+            np.asarray(item.convert("RGB").resize((self.size, self.size)), dtype=np.float32) for item in images
+        ]))
+        pixels = pixels.permute(0, 3, 1, 2) / 127.5 - 1
+        mask = torch.from_numpy(np.stack([
+            np.asarray(item.convert("L").resize((self.size // 8, self.size // 8)), dtype=np.float32) for item in masks
+        ]))[:, None] / 255
+        image_latents = self.vae_encoder(pixels)
+        latent_shape = (1, 4, self.size // 8, self.size // 8)
+        latents = torch.cat([torch.randn(latent_shape, generator=g) for g in generators])
+
+        self._interrupt = False
+        for step in range(self.steps):
+            if self.interrupt:
+                continue
+            sigma = 1 - step / self.steps
+            unet_in = torch.cat([latents, mask, image_latents], dim=1).repeat(2, 1, 1, 1)
+            noise = self.unet(unet_in) + text[:, :4]
+            uncond, cond = noise.chunk(2)
+            latents = latents - sigma / self.steps * (uncond + guidance_scale * (cond - uncond))
+            if callback_on_step_end is not None:
+                outputs = callback_on_step_end(self, step, step, {"latents": latents})
+                latents = outputs.pop("latents", latents)
+
+        decoded = self.vae_decoder(latents).clamp(-1, 1)
+        arrays = ((decoded.permute(0, 2, 3, 1).numpy() + 1) * 127.5).astype(np.uint8)
+        return _PipelineOutput([Image.fromarray(array) for array in arrays])
@@ -0,0 +1,202 @@
+"""Concurrent batch evaluation of baseline vs. context-grounded completions.
+
+``evaluate_question`` in the notebook issues two blocking completion calls per
+question, one after the other, so five questions cost roughly ten round trips
+of wall time. ``evaluate_questions`` fans the basic and custom completions for
+every question out on an asyncio event loop, bounded by a semaphore, retries
+rate-limited or transient failures with jittered exponential backoff, and
+collects rows as they finish into a DataFrame ordered like the input.
+
+Typical notebook usage (Jupyter already runs an event loop, so ``await`` works
+directly in a cell)::
+
+    complete = make_openai_completion(MODEL_NAME, cache=completion_cache)
+    results_df = await evaluate_questions(
+        question_texts, build_context, build_basic_prompt, build_custom_prompt, complete,
+    )
+
+``scripts/stub_completion_server.py`` serves an OpenAI-compatible endpoint with
+configurable latency and 429 responses for exercising this path offline.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from retrieval import DEFAULT_TOP_K
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APIConnectionError", "Timeout", "TryAgain", "ServiceUnavailableError"}
+
+AsyncCompletion = Callable[[str, float, int], Awaitable[str]]
+
+
+class RetryError(RuntimeError):
+    """Raised when a completion keeps failing after every retry attempt."""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attr in ("http_status", "status_code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Rate limits, timeouts and 5xx responses are worth retrying; everything else is not."""
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(exc, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float, rng: random.Random) -> float:
+    """Full-jitter exponential backoff: uniform in ``[0, min(max_delay, base * 2**attempt)]``."""
+    return rng.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+async def call_with_retries(
+    complete: AsyncCompletion,
+    prompt: str,
+    temperature: float,
+    max_tokens: int,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    rng: Optional[random.Random] = None,
+) -> str:
+    rng = rng or random.Random()
+    for attempt in range(max_retries + 1):
+        try:
+            return await complete(prompt, temperature, max_tokens)
+        except Exception as exc:
+            if not is_retryable(exc):
+                raise
+            if attempt == max_retries:
+                raise RetryError(f"Completion failed after {attempt + 1} attempts: {exc}") from exc
+            delay = backoff_delay(attempt, base_delay, max_delay, rng)
+            retry_after = _retry_after(exc)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def make_openai_completion(model: str, cache=None) -> AsyncCompletion:
+    """Async completion callable backed by ``openai.Completion.acreate``.
+
+    When a ``CompletionCache`` is given, cached responses are returned without a
+    network call and fresh responses are stored, sharing entries with the
+    synchronous ``call_completion``.
+    """
+    import openai
+
+    from completion_cache import make_cache_key
+
+    async def complete(prompt: str, temperature: float, max_tokens: int) -> str:
+        cacheable = cache is not None and cache.is_cacheable(temperature)
+        if cacheable:
+            key = make_cache_key(model, prompt, temperature, max_tokens)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        response = await openai.Completion.acreate(
+            model=model,
+            prompt=prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        text = response["choices"][0]["text"].strip()
+        if cacheable:
+            cache.put(key, model, text)
+        return text
+
+    return complete
+
+
+async def evaluate_questions(
+    questions: Sequence[str],
+    build_context: Callable[..., str],
+    build_basic_prompt: Callable[[str], str],
+    build_custom_prompt: Callable[[str, str], str],
+    complete: AsyncCompletion,
+    top_k: int = DEFAULT_TOP_K,
+    concurrency: int = 8,
+    basic_temperature: float = 0.4,
+    custom_temperature: float = 0.2,
+    max_tokens: int = 350,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    seed: Optional[int] = None,
+):
+    """Evaluate every question concurrently and return a DataFrame in input order.
+
+    At most ``concurrency`` completion requests are in flight at once. Each row
+    has the notebook's ``question``/``context``/``basic_answer``/``custom_answer``
+    keys plus per-question latency; ``on_result`` is called as soon as a row is
+    complete so progress can be shown while the batch is still running.
+    """
+    import pandas as pd
+
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = random.Random(seed)
+
+    async def limited(prompt: str, temperature: float) -> str:
+        async with semaphore:
+            return await call_with_retries(
+                complete, prompt, temperature, max_tokens,
+                max_retries=max_retries, base_delay=base_delay, max_delay=max_delay, rng=rng,
+            )
+
+    async def evaluate(position: int, question: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        context = build_context(question, top_k=top_k)
+        basic_answer, custom_answer = await asyncio.gather(
+            limited(build_basic_prompt(question), basic_temperature),
+            limited(build_custom_prompt(question, context), custom_temperature),
+        )
+        return {
+            "position": position,
+            "question": question,
+            "context": context,
+            "basic_answer": basic_answer,
+            "custom_answer": custom_answer,
+            "latency_s": time.perf_counter() - started,
+        }
+
+    rows: List[Dict[str, Any]] = []
+    tasks = [asyncio.ensure_future(evaluate(pos, question)) for pos, question in enumerate(questions)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            row = await finished
+            rows.append(row)
+            if on_result is not None:
+                on_result(row)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    columns = ["question", "context", "basic_answer", "custom_answer", "latency_s"]
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame(rows).sort_values("position").set_index("position")[columns].reset_index(drop=True)
+
+
+def run_evaluation(*args, **kwargs):
+    """Blocking wrapper around ``evaluate_questions`` for scripts (not for use inside Jupyter)."""
+    return asyncio.run(evaluate_questions(*args, **kwargs))
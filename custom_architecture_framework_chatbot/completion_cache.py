@@ -0,0 +1,179 @@
+"""Content-addressed SQLite cache for completion responses.
+
+Re-running the notebook (or the question cells generated by
+``scripts/update_project_notebook.py``) used to pay full OpenAI latency for
+prompts that had already been answered. ``CompletionCache`` keys each response
+on ``(model, prompt, temperature, max_tokens)``, stores it on disk, bounds the
+table with least-recently-used eviction and optionally expires entries after a
+TTL. Hit/miss counters make it easy to check how much a rerun actually saved.
+
+Typical notebook usage::
+
+    completion_cache = CompletionCache(Path("data/completion_cache.sqlite3"), ttl_seconds=7 * 24 * 3600)
+
+    def call_completion(prompt, temperature=0.2, max_tokens=350):
+        return completion_cache.get_or_create(
+            MODEL_NAME, prompt, temperature, max_tokens,
+            lambda: openai.Completion.create(...)["choices"][0]["text"].strip(),
+        )
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access);
+"""
+
+
+def make_cache_key(model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """Stable SHA-256 over the request parameters that determine a completion."""
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "temperature": float(temperature), "max_tokens": int(max_tokens)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Disk-backed completion cache with LRU size bounds, optional TTL and hit/miss counters.
+
+    ``deterministic_only=True`` restricts caching to ``temperature == 0`` requests,
+    for callers that want sampled completions to stay fresh on every call.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path] = ":memory:",
+        max_entries: int = 1000,
+        ttl_seconds: Optional[float] = None,
+        deterministic_only: bool = False,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.deterministic_only = deterministic_only
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL" if str(path) != ":memory:" else "PRAGMA journal_mode=MEMORY")
+        self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def is_cacheable(self, temperature: float) -> bool:
+        return not self.deterministic_only or float(temperature) == 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for ``key`` (refreshing its LRU position) or ``None``."""
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return response
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = self._clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def get_or_create(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        create: Callable[[], str],
+    ) -> str:
+        """Serve a cached response or call ``create()`` and store its result."""
+        if not self.is_cacheable(temperature):
+            return create()
+        key = make_cache_key(model, prompt, temperature, max_tokens)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        response = create()
+        self.put(key, model, response)
+        return response
+
+    def purge_expired(self) -> int:
+        """Delete every entry older than the TTL; returns the number removed."""
+        if self.ttl_seconds is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM completions WHERE created_at < ?", (self._clock() - self.ttl_seconds,)
+            )
+            self.expirations += cursor.rowcount
+            return cursor.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,162 @@
+"""Token-budgeted context packing for the architecture copilot prompt.
+
+Joining the top-k rows verbatim ignores prompt size: a few long descriptions
+can blow past the budget we want to pay for, while short ones leave room that
+could carry more evidence. ``ContextPacker`` pulls a wider candidate pool from
+any retriever (``BM25Retriever`` or ``DenseRetriever``), drops near-duplicate
+rows, then greedily packs rows by relevance per token until ``top_k`` rows are
+chosen or the budget is spent, optionally truncating the last description to use
+the remaining room. ``top_k`` is a hard cap, so the prompt never carries more rows
+than the plain top-k join; the budget can only trim it. The selected rows are
+emitted in relevance order.
+
+``PackingStats`` from the most recent call is kept on ``packer.last_stats`` so
+the budget can be tuned against what actually made it into the prompt.
+"""
+
+import re
+from dataclasses import asdict, dataclass
+from typing import Callable, List, Optional, Set, Tuple
+
+from retrieval import CONTEXT_SEPARATOR, DEFAULT_TOP_K, tokenize
+
+_APPROX_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+TRUNCATION_MARKER = " ..."
+
+
+def approximate_token_count(text: str) -> int:
+    """Dependency-free estimate: one token per word or punctuation mark."""
+    return len(_APPROX_TOKEN_PATTERN.findall(text))
+
+
+def get_token_counter(encoding_name: str = "cl100k_base") -> Callable[[str], int]:
+    """Return a ``tiktoken`` counter when available, else ``approximate_token_count``."""
+    try:
+        import tiktoken
+    except ImportError:
+        return approximate_token_count
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class PackingStats:
+    token_budget: int
+    tokens_used: int = 0
+    rows_considered: int = 0
+    rows_packed: int = 0
+    rows_truncated: int = 0
+    rows_dropped_duplicate: int = 0
+    rows_dropped_budget: int = 0
+    rows_dropped_limit: int = 0
+    fallback: bool = False
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class ContextPacker:
+    """Greedy relevance-per-token packer in front of a retriever."""
+
+    def __init__(
+        self,
+        retriever,
+        token_budget: int = 600,
+        candidate_multiplier: int = 4,
+        dedup_threshold: float = 0.85,
+        allow_truncation: bool = True,
+        min_truncated_tokens: int = 24,
+        token_counter: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        self.retriever = retriever
+        self.token_budget = token_budget
+        self.candidate_multiplier = candidate_multiplier
+        self.dedup_threshold = dedup_threshold
+        self.allow_truncation = allow_truncation
+        self.min_truncated_tokens = min_truncated_tokens
+        self.count_tokens = token_counter or get_token_counter()
+        self.separator_tokens = self.count_tokens(CONTEXT_SEPARATOR) or 1
+        self.last_stats: Optional[PackingStats] = None
+
+    def _deduplicate(self, candidates: List[Tuple[str, float]], stats: PackingStats) -> List[Tuple[str, float]]:
+        kept: List[Tuple[str, float]] = []
+        kept_terms: List[Set[str]] = []
+        for text, score in candidates:
+            terms = set(tokenize(text))
+            if any(jaccard(terms, other) >= self.dedup_threshold for other in kept_terms):
+                stats.rows_dropped_duplicate += 1
+                continue
+            kept.append((text, score))
+            kept_terms.append(terms)
+        return kept
+
+    def _truncate(self, text: str, max_tokens: int) -> Optional[str]:
+        """Longest word-boundary prefix of ``text`` (plus marker) that fits in ``max_tokens``."""
+        words = text.split()
+        lo, hi, best = 1, len(words), None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            candidate = " ".join(words[:mid]) + TRUNCATION_MARKER
+            if self.count_tokens(candidate) <= max_tokens:
+                best, lo = candidate, mid + 1
+            else:
+                hi = mid - 1
+        return best
+
+    def pack(self, question: str, top_k: int = DEFAULT_TOP_K) -> Tuple[str, PackingStats]:
+        stats = PackingStats(token_budget=self.token_budget)
+        hits = self.retriever.search(question, top_k=top_k * self.candidate_multiplier)
+        if not hits:
+            stats.fallback = True
+            context = self.retriever.build_context(question, top_k=top_k)
+            stats.tokens_used = self.count_tokens(context)
+            stats.rows_packed = len(context.split(CONTEXT_SEPARATOR)) if context else 0
+            self.last_stats = stats
+            return context, stats
+
+        candidates = [(self.retriever.text(doc_id), score) for doc_id, score in hits]
+        stats.rows_considered = len(candidates)
+        candidates = self._deduplicate(candidates, stats)
+
+        costed = [(rank, text, score, self.count_tokens(text)) for rank, (text, score) in enumerate(candidates)]
+        by_density = sorted(costed, key=lambda item: (-max(item[2], 0.0) / max(item[3], 1), item[0]))
+
+        chosen: List[Tuple[int, str]] = []
+        remaining = self.token_budget
+        for rank, text, _, tokens in by_density:
+            if len(chosen) >= top_k:
+                stats.rows_dropped_limit += 1
+                continue
+            cost = tokens + (self.separator_tokens if chosen else 0)
+            if cost <= remaining:
+                chosen.append((rank, text))
+                remaining -= cost
+                continue
+            room = remaining - (self.separator_tokens if chosen else 0)
+            truncated = None
+            if self.allow_truncation and room >= self.min_truncated_tokens:
+                truncated = self._truncate(text, room)
+            if truncated is None:
+                stats.rows_dropped_budget += 1
+                continue
+            chosen.append((rank, truncated))
+            remaining -= self.count_tokens(truncated) + (self.separator_tokens if len(chosen) > 1 else 0)
+            stats.rows_truncated += 1
+
+        chosen.sort()
+        context = CONTEXT_SEPARATOR.join(text for _, text in chosen)
+        stats.rows_packed = len(chosen)
+        stats.tokens_used = self.token_budget - remaining
+        self.last_stats = stats
+        return context, stats
+
+    def build_context(self, question: str, top_k: int = DEFAULT_TOP_K) -> str:
+        """Drop-in ``build_context``: at most ``top_k`` rows, fewer when the budget runs out."""
+        context, _ = self.pack(question, top_k=top_k)
+        return context
@@ -0,0 +1,263 @@
+"""Dense embedding retrieval for the architecture framework knowledge base.
+
+Keyword and BM25 scoring only match literal terms, so a question about a
+"timeline" never reaches "Capability Phasing". This module embeds every
+knowledge row once, keeps the vectors as one contiguous, L2-normalised matrix
+and answers a batch of questions with a single matrix multiply followed by
+``argpartition`` top-k.
+
+The matrix is stored as float32, float16 or int8 with per-row scales:
+
+- int8 stays int8 in memory (a quarter of float32). It is scored in row blocks,
+  so only one block at a time is upcast to float32.
+- float16 halves the file on disk, but it is upcast to float32 once when loaded.
+  NumPy has no fast float16 matrix multiply, and upcasting on every query was
+  several times slower than float32.
+
+Embedders are pluggable: anything with a ``name`` attribute and an
+``embed(texts) -> np.ndarray`` method works. ``OpenAIEmbedder`` uses the same
+``openai`` client as the notebook, ``SentenceTransformerEmbedder`` runs a local
+model when ``sentence-transformers`` is installed, and ``HashingEmbedder`` is a
+deterministic, dependency-free stand-in for offline runs and quick checks.
+
+``DenseRetriever.build_context`` has the same signature as the BM25 builder, so
+it can be handed to ``ask_custom_completion(..., context_builder=...)``.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from retrieval import CONTEXT_SEPARATOR, DEFAULT_TOP_K, tokenize
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# Rows of an int8 matrix upcast per block in ``DenseIndex.similarities``; a 1024 x 256 block is 1 MB of float32
+SCORE_BLOCK_ROWS = 1024
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder over word tokens and character trigrams.
+
+    It needs no model download and gives identical vectors in every process,
+    which makes it a convenient local stand-in for the real embedders.
+    """
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        grams = [f"#{token[i:i + 3]}" for token in tokens for i in range(max(1, len(token) - 2))]
+        return tokens + grams
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                vectors[row, bucket] += sign
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embeds text with the OpenAI embeddings endpoint configured on the ``openai`` module."""
+
+    def __init__(self, model: str = "text-embedding-ada-002", batch_size: int = 256) -> None:
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f"openai-{model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        import openai
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start:start + self.batch_size])
+            response = openai.Embedding.create(model=self.model, input=batch)
+            ordered = sorted(response["data"], key=lambda item: item["index"])
+            vectors.extend(item["embedding"] for item in ordered)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class SentenceTransformerEmbedder:
+    """Local embedder backed by ``sentence-transformers`` (optional dependency)."""
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 64) -> None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise ImportError(
+                "SentenceTransformerEmbedder requires `pip install sentence-transformers`."
+            ) from exc
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True),
+            dtype=np.float32,
+        )
+
+
+class DenseIndex:
+    """Contiguous matrix of normalised row embeddings with batched top-k search.
+
+    ``dtype`` is the storage dtype written by ``save``. A float16 matrix is held
+    as float32 in memory (see the module docstring); int8 rows are scored in
+    blocks of ``block_rows``.
+    """
+
+    def __init__(self, matrix: np.ndarray, scales: Optional[np.ndarray] = None,
+                 block_rows: int = SCORE_BLOCK_ROWS) -> None:
+        self.storage_dtype = str(matrix.dtype)
+        if matrix.dtype == np.float16:
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.matrix = matrix
+        self.scales = scales
+        self.block_rows = block_rows
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, dtype: str = "float32") -> "DenseIndex":
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"dtype must be one of {SUPPORTED_DTYPES}, got {dtype!r}")
+        normalized = _normalize(vectors)
+        if dtype == "int8":
+            # Symmetric per-row quantisation: row ~= scale * int8_row.
+            scales = np.abs(normalized).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(normalized / scales[:, None]).astype(np.int8)
+            return cls(np.ascontiguousarray(quantized), scales.astype(np.float32))
+        return cls(np.ascontiguousarray(normalized.astype(dtype)))
+
+    @property
+    def dtype(self) -> str:
+        return self.storage_dtype
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory for search."""
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def similarities(self, query_vectors: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each query row against every indexed row, shape ``(queries, rows)``."""
+        queries = _normalize(np.atleast_2d(query_vectors))
+        if self.matrix.dtype == np.float32:
+            return queries @ self.matrix.T
+        rows = self.matrix.shape[0]
+        scores = np.empty((queries.shape[0], rows), dtype=np.float32)
+        block = np.empty((min(self.block_rows, rows), self.matrix.shape[1]), dtype=np.float32)
+        for start in range(0, rows, self.block_rows):
+            stop = min(start + self.block_rows, rows)
+            upcast = block[:stop - start]
+            upcast[...] = self.matrix[start:stop]
+            np.matmul(queries, upcast.T, out=scores[:, start:stop])
+            if self.scales is not None:
+                scores[:, start:stop] *= self.scales[None, start:stop]
+        return scores
+
+    def search(self, query_vectors: np.ndarray, top_k: int = DEFAULT_TOP_K) -> List[List[Tuple[int, float]]]:
+        """Top-k ``(row, score)`` pairs per query, best first."""
+        scores = self.similarities(query_vectors)
+        k = min(top_k, scores.shape[1])
+        if k <= 0:
+            return [[] for _ in range(scores.shape[0])]
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        rows = np.take_along_axis(candidates, order, axis=1)
+        best = np.take_along_axis(candidate_scores, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(rows, best)
+        ]
+
+    def save(self, directory: Path, metadata: dict) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "matrix.npy", self.matrix.astype(self.storage_dtype, copy=False))
+        scales_path = directory / "scales.npy"
+        if self.scales is not None:
+            np.save(scales_path, self.scales)
+        elif scales_path.exists():
+            # A float index saved over an int8 one must not pick up the old scales on load.
+            scales_path.unlink()
+        (directory / "meta.json").write_text(json.dumps(metadata, indent=2))
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "DenseIndex":
+        directory = Path(directory)
+        mode = "r" if mmap else None
+        matrix = np.load(directory / "matrix.npy", mmap_mode=mode)
+        scales_path = directory / "scales.npy"
+        scales = np.load(scales_path) if matrix.dtype == np.int8 and scales_path.exists() else None
+        return cls(matrix, scales)
+
+
+def corpus_fingerprint(texts: Sequence[str], embedder_name: str, dtype: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{embedder_name}|{dtype}".encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class DenseRetriever:
+    """Embedding-based context builder interchangeable with ``BM25Retriever``."""
+
+    def __init__(self, texts: Sequence[str], index: DenseIndex, embedder) -> None:
+        self.texts = list(texts)
+        self.index = index
+        self.embedder = embedder
+
+    @classmethod
+    def build(cls, texts: Sequence[str], embedder, dtype: str = "float32") -> "DenseRetriever":
+        texts = list(texts)
+        return cls(texts, DenseIndex.from_vectors(embedder.embed(texts), dtype=dtype), embedder)
+
+    @classmethod
+    def load_or_build(cls, directory: Path, texts: Sequence[str], embedder, dtype: str = "float32") -> "DenseRetriever":
+        """Reuse embeddings cached in ``directory`` unless the texts, embedder or dtype changed."""
+        texts = list(texts)
+        directory = Path(directory)
+        fingerprint = corpus_fingerprint(texts, embedder.name, dtype)
+        meta_path = directory / "meta.json"
+        if meta_path.exists() and json.loads(meta_path.read_text()).get("fingerprint") == fingerprint:
+            return cls(texts, DenseIndex.load(directory), embedder)
+
+        retriever = cls.build(texts, embedder, dtype=dtype)
+        retriever.index.save(
+            directory,
+            {"fingerprint": fingerprint, "embedder": embedder.name, "dtype": dtype, "rows": len(texts)},
+        )
+        return retriever
+
+    def search_many(self, questions: Sequence[str], top_k: int = DEFAULT_TOP_K) -> List[List[Tuple[int, float]]]:
+        """Embed all questions in one call and rank them with a single matrix multiply."""
+        return self.index.search(self.embedder.embed(list(questions)), top_k=top_k)
+
+    def search(self, question: str, top_k: int = DEFAULT_TOP_K) -> List[Tuple[int, float]]:
+        return self.search_many([question], top_k=top_k)[0]
+
+    def text(self, row: int) -> str:
+        return self.texts[row]
+
+    def build_context(self, question: str, top_k: int = DEFAULT_TOP_K) -> str:
+        return CONTEXT_SEPARATOR.join(self.texts[row] for row, _ in self.search(question, top_k=top_k))
@@ -0,0 +1,379 @@
+"""BM25 retrieval over the architecture framework knowledge base.
+
+The notebook's original ``build_context`` rescanned every row with ``str.count``
+for every keyword and sorted the whole DataFrame on each question. This module
+tokenizes the knowledge rows once into an inverted index (postings plus
+document lengths) and answers questions by touching only the postings of the
+query terms, keeping the best rows in a bounded heap instead of a full sort.
+
+Typical notebook usage::
+
+    from retrieval import BM25Retriever
+
+    retriever = BM25Retriever.from_csv(DATA_PATH)
+    context = retriever.build_context(question, top_k=DEFAULT_TOP_K)
+
+``scripts/create_architecture_dataset.py`` also persists the index as a compact
+binary file next to the CSV. ``load_index`` opens it through ``mmap`` so a fresh
+kernel (or several worker processes sharing the same pages) skips the pandas
+parse entirely. The index is rebuilt on change: when the CSV content hash no
+longer matches, the whole file is rewritten (there is no incremental update)::
+
+    retriever = BM25Retriever(load_index(INDEX_PATH, source_path=DATA_PATH))
+"""
+
+import csv
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+DEFAULT_TOP_K = 4
+CONTEXT_SEPARATOR = "\n\n"
+
+INDEX_MAGIC = b"AFKBIDX1"
+INDEX_VERSION = 1
+_HEADER_LENGTH = struct.Struct("<I")
+_ALIGNMENT = 8
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into the lowercase alphanumeric tokens used for indexing and querying."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class InvertedIndex:
+    """Term -> postings map with the per-document statistics BM25 needs."""
+
+    def __init__(self, texts: Iterable[str]) -> None:
+        self.texts: List[str] = [str(text) for text in texts]
+        self.doc_lengths: List[int] = []
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}
+
+        for doc_id, text in enumerate(self.texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                doc_ids, tfs = self._postings.setdefault(term, ([], []))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        total_length = sum(self.doc_lengths)
+        self.avg_doc_length = total_length / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.texts)
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._postings)
+
+    def postings(self, term: str) -> Tuple[Sequence[int], Sequence[int]]:
+        """Return ``(doc_ids, term_frequencies)`` for ``term`` (empty when unseen)."""
+        return self._postings.get(term, ((), ()))
+
+    def text(self, doc_id: int) -> str:
+        return self.texts[doc_id]
+
+
+class BM25Retriever:
+    """Okapi BM25 scorer with top-k heap selection over an inverted index."""
+
+    def __init__(self, index: InvertedIndex, k1: float = 1.5, b: float = 0.75, seed: int = 42) -> None:
+        self.index = index
+        self.k1 = k1
+        self.b = b
+        self.seed = seed
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], **kwargs) -> "BM25Retriever":
+        return cls(InvertedIndex(texts), **kwargs)
+
+    @classmethod
+    def from_dataframe(cls, df, text_column: str = "text", **kwargs) -> "BM25Retriever":
+        return cls.from_texts(df[text_column].astype(str).tolist(), **kwargs)
+
+    @classmethod
+    def from_csv(cls, path: Path, text_column: str = "text", **kwargs) -> "BM25Retriever":
+        import pandas as pd
+
+        df = pd.read_csv(path).dropna(subset=[text_column])
+        df[text_column] = df[text_column].astype(str).str.strip()
+        return cls.from_dataframe(df, text_column=text_column, **kwargs)
+
+    def idf(self, doc_freq: int) -> float:
+        n = self.index.num_docs
+        return math.log(1 + (n - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def score(self, question: str) -> Dict[int, float]:
+        """Accumulate BM25 scores for every document that shares a term with the question."""
+        index = self.index
+        avg_length = index.avg_doc_length or 1.0
+        scores: Dict[int, float] = {}
+
+        for term in set(tokenize(question)):
+            doc_ids, tfs = index.postings(term)
+            if len(doc_ids) == 0:
+                continue
+            idf = self.idf(len(doc_ids))
+            for doc_id, tf in zip(doc_ids, tfs):
+                doc_id = int(doc_id)
+                norm = self.k1 * (1 - self.b + self.b * index.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, question: str, top_k: int = DEFAULT_TOP_K) -> List[Tuple[int, float]]:
+        """Return up to ``top_k`` ``(doc_id, score)`` pairs, best first; ties keep corpus order."""
+        scores = self.score(question)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(doc_id, score) for doc_id, score in best]
+
+    def text(self, doc_id: int) -> str:
+        return self.index.text(doc_id)
+
+    def build_context(self, question: str, top_k: int = DEFAULT_TOP_K) -> str:
+        """Drop-in replacement for the notebook's ``build_context(question, top_k)``."""
+        hits = self.search(question, top_k=top_k)
+        if hits:
+            doc_ids = [doc_id for doc_id, _ in hits]
+        else:
+            # Mirror the notebook's behaviour: no overlap means a reproducible random sample.
+            population = range(self.index.num_docs)
+            doc_ids = random.Random(self.seed).sample(population, k=min(top_k, len(population)))
+        return CONTEXT_SEPARATOR.join(self.index.text(doc_id) for doc_id in doc_ids)
+
+
+def file_content_hash(path: Path) -> str:
+    """SHA-256 of a file's bytes; used to tie a persisted index to the CSV it was built from."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_knowledge_texts(csv_path: Path, text_column: str = "text") -> List[str]:
+    """Load the cleaned ``text`` column with the stdlib csv reader (no pandas needed)."""
+    with open(csv_path, newline="", encoding="utf-8") as handle:
+        texts = [(row.get(text_column) or "").strip() for row in csv.DictReader(handle)]
+    return [text for text in texts if text]
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _encode_strings(values: Sequence[str]) -> Tuple[array, bytes]:
+    offsets = array("Q", [0])
+    blob = bytearray()
+    for value in values:
+        blob += value.encode("utf-8")
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def write_index(texts: Iterable[str], path: Path, content_hash: str) -> Path:
+    """Serialize an inverted index to ``path`` in the memory-mappable layout read by ``MappedIndex``.
+
+    The file is a magic string, a little JSON header (content hash, counts and
+    section table), then 8-byte aligned sections: document lengths, text and
+    lowercase-text offsets/blobs, a sorted term dictionary and flat postings
+    arrays. The write goes through a temporary file so readers never see a torn index.
+    """
+    index = InvertedIndex(texts)
+    terms = sorted(index._postings, key=lambda term: term.encode("utf-8"))
+
+    posting_offsets = array("Q", [0])
+    posting_doc_ids = array("I")
+    posting_tfs = array("I")
+    for term in terms:
+        doc_ids, tfs = index._postings[term]
+        posting_doc_ids.extend(doc_ids)
+        posting_tfs.extend(tfs)
+        posting_offsets.append(len(posting_doc_ids))
+
+    text_offsets, text_blob = _encode_strings(index.texts)
+    lower_offsets, lower_blob = _encode_strings([text.lower() for text in index.texts])
+    term_offsets, term_blob = _encode_strings(terms)
+
+    payloads = {
+        "doc_lengths": ("I", array("I", index.doc_lengths).tobytes()),
+        "text_offsets": ("Q", text_offsets.tobytes()),
+        "text_blob": ("B", text_blob),
+        "lower_offsets": ("Q", lower_offsets.tobytes()),
+        "lower_blob": ("B", lower_blob),
+        "term_offsets": ("Q", term_offsets.tobytes()),
+        "term_blob": ("B", term_blob),
+        "posting_offsets": ("Q", posting_offsets.tobytes()),
+        "posting_doc_ids": ("I", posting_doc_ids.tobytes()),
+        "posting_tfs": ("I", posting_tfs.tobytes()),
+    }
+
+    sections = {}
+    cursor = 0
+    for name, (fmt, data) in payloads.items():
+        cursor = _align(cursor)
+        sections[name] = [cursor, len(data), fmt]
+        cursor += len(data)
+
+    header = json.dumps(
+        {
+            "version": INDEX_VERSION,
+            "content_hash": content_hash,
+            "byteorder": sys.byteorder,
+            "num_docs": index.num_docs,
+            "num_terms": len(terms),
+            "avg_doc_length": index.avg_doc_length,
+            "sections": sections,
+        },
+        sort_keys=True,
+    ).encode("utf-8")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as handle:
+        handle.write(INDEX_MAGIC)
+        handle.write(_HEADER_LENGTH.pack(len(header)))
+        handle.write(header)
+        data_start = _align(handle.tell())
+        for name, (_, data) in payloads.items():
+            handle.write(b"\0" * (data_start + sections[name][0] - handle.tell()))
+            handle.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_header(buffer) -> Tuple[dict, int]:
+    if bytes(buffer[: len(INDEX_MAGIC)]) != INDEX_MAGIC:
+        raise ValueError("Not an architecture knowledge-base index (bad magic bytes).")
+    start = len(INDEX_MAGIC)
+    (header_length,) = _HEADER_LENGTH.unpack_from(buffer, start)
+    start += _HEADER_LENGTH.size
+    header = json.loads(bytes(buffer[start : start + header_length]).decode("utf-8"))
+    if header.get("version") != INDEX_VERSION:
+        raise ValueError(f"Unsupported index version {header.get('version')!r}; rebuild the index.")
+    return header, _align(start + header_length)
+
+
+def read_index_hash(path: Path) -> Optional[str]:
+    """Return the content hash recorded in an index file, or ``None`` if it is missing or unreadable."""
+    try:
+        with open(path, "rb") as handle:
+            prefix = handle.read(len(INDEX_MAGIC) + _HEADER_LENGTH.size)
+            (header_length,) = _HEADER_LENGTH.unpack_from(prefix, len(INDEX_MAGIC))
+            header, _ = _read_header(prefix + handle.read(header_length))
+    except (OSError, ValueError, struct.error):
+        return None
+    return header.get("content_hash")
+
+
+class MappedIndex:
+    """Read-only, memory-mapped view of an index written by ``write_index``.
+
+    Exposes the same surface as ``InvertedIndex`` so ``BM25Retriever`` can use
+    either. Opening only parses the small JSON header; postings, texts and the
+    term dictionary stay in the page cache and are shared by every process that
+    maps the same file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        header, data_start = _read_header(buffer)
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Index {self.path} was written on a {header['byteorder']}-endian host.")
+
+        self.content_hash: str = header["content_hash"]
+        self.avg_doc_length: float = header["avg_doc_length"]
+        self._num_docs: int = header["num_docs"]
+        self._num_terms: int = header["num_terms"]
+
+        def section(name: str):
+            offset, size, fmt = header["sections"][name]
+            view = buffer[data_start + offset : data_start + offset + size]
+            return view if fmt == "B" else view.cast(fmt)
+
+        self.doc_lengths = section("doc_lengths")
+        self._text_offsets = section("text_offsets")
+        self._text_blob = section("text_blob")
+        self._lower_offsets = section("lower_offsets")
+        self._lower_blob = section("lower_blob")
+        self._term_offsets = section("term_offsets")
+        self._term_blob = section("term_blob")
+        self._posting_offsets = section("posting_offsets")
+        self._posting_doc_ids = section("posting_doc_ids")
+        self._posting_tfs = section("posting_tfs")
+
+    @property
+    def num_docs(self) -> int:
+        return self._num_docs
+
+    @property
+    def vocabulary_size(self) -> int:
+        return self._num_terms
+
+    def _term_bytes(self, term_id: int) -> bytes:
+        return bytes(self._term_blob[self._term_offsets[term_id] : self._term_offsets[term_id + 1]])
+
+    def _term_id(self, term: str) -> int:
+        target = term.encode("utf-8")
+        lo, hi = 0, self._num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = self._term_bytes(mid)
+            if probe < target:
+                lo = mid + 1
+            elif probe > target:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def postings(self, term: str) -> Tuple[Sequence[int], Sequence[int]]:
+        term_id = self._term_id(term)
+        if term_id < 0:
+            return (), ()
+        start, end = self._posting_offsets[term_id], self._posting_offsets[term_id + 1]
+        return self._posting_doc_ids[start:end], self._posting_tfs[start:end]
+
+    def text(self, doc_id: int) -> str:
+        start, end = self._text_offsets[doc_id], self._text_offsets[doc_id + 1]
+        return bytes(self._text_blob[start:end]).decode("utf-8")
+
+    def lower_text(self, doc_id: int) -> str:
+        start, end = self._lower_offsets[doc_id], self._lower_offsets[doc_id + 1]
+        return bytes(self._lower_blob[start:end]).decode("utf-8")
+
+
+def build_index(csv_path: Path, index_path: Path, force: bool = False) -> bool:
+    """Rebuild on change: rewrite all of ``index_path`` from ``csv_path`` unless it already matches the CSV hash.
+
+    Any edit to the CSV rewrites the whole index. Returns ``True`` when a new index was written.
+    """
+    content_hash = file_content_hash(csv_path)
+    if not force and read_index_hash(index_path) == content_hash:
+        return False
+    write_index(read_knowledge_texts(csv_path), index_path, content_hash)
+    return True
+
+
+def load_index(index_path: Path, source_path: Optional[Path] = None) -> MappedIndex:
+    """Open a persisted index, rebuilding it first when it is missing or stale w.r.t. ``source_path``."""
+    if source_path is not None:
+        build_index(source_path, index_path)
+    return MappedIndex(index_path)
@@ -0,0 +1,247 @@
+"""Benchmark retrieval speed, memory and quality on synthetic knowledge bases.
+
+The corpus is the real ``ROWS`` list from ``create_architecture_dataset.py``
+padded with synthetic distractor rows that reuse its frameworks, versions,
+artifact codes and vocabulary, so term statistics stay realistic as the corpus
+grows from thousands to millions of rows. The original rows keep their
+identity, which lets the labeled questions in ``data/retrieval_eval_questions.json``
+(derived from the notebook's ``question_texts``) plus one "artifact name"
+query per original row be scored for recall@k and MRR at every size.
+
+For each retriever and corpus size the script records index build time,
+p50/p95/p99 query latency, traced memory footprint, and quality, then writes
+everything as JSON so runs of different implementations can be diffed::
+
+    python scripts/benchmark_retrieval.py --sizes 10000 100000 --output bench.json
+    python scripts/benchmark_retrieval.py --sizes 1000000 --retrievers bm25 bm25-mmap
+"""
+
+import argparse
+import gc
+import json
+import math
+import platform
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from create_architecture_dataset import PROJECT_ROOT, ROWS, row_text
+
+from retrieval import BM25Retriever, MappedIndex, write_index
+
+LABELS_PATH = PROJECT_ROOT / "data" / "retrieval_eval_questions.json"
+DEFAULT_SIZES = [10_000, 100_000]
+CODE_PATTERN = re.compile(r"^([A-Za-z]+)-?\d")
+
+
+class KeywordScanRetriever:
+    """The notebook's original scorer: substring counts over every row, then a full sort."""
+
+    def __init__(self, texts: Sequence[str]) -> None:
+        self.texts_lower = [text.lower() for text in texts]
+
+    def search(self, question: str, top_k: int) -> List[Tuple[int, float]]:
+        keywords = set(re.findall(r"[a-z0-9]+", question.lower())) or set(question.lower().split())
+        scored = [
+            (doc_id, float(sum(text.count(keyword) for keyword in keywords)))
+            for doc_id, text in enumerate(self.texts_lower)
+        ]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return [item for item in scored[:top_k] if item[1] > 0]
+
+
+# Index files stay mapped until the process exits, so they share one directory removed at exit.
+_SCRATCH_DIR = tempfile.TemporaryDirectory(prefix="kb-bench-", ignore_cleanup_errors=True)
+_scratch_counter = 0
+
+
+def _mmap_bm25(texts: Sequence[str]) -> BM25Retriever:
+    global _scratch_counter
+    _scratch_counter += 1
+    path = Path(_SCRATCH_DIR.name) / f"bench-{_scratch_counter}.idx"
+    return BM25Retriever(MappedIndex(write_index(texts, path, content_hash="benchmark")))
+
+
+def _dense(dtype: str) -> Callable[[Sequence[str]], object]:
+    def factory(texts: Sequence[str]):
+        from embeddings import DenseRetriever, HashingEmbedder
+
+        return DenseRetriever.build(texts, HashingEmbedder(), dtype=dtype)
+
+    return factory
+
+
+RETRIEVERS: Dict[str, Callable[[Sequence[str]], object]] = {
+    "keyword-scan": KeywordScanRetriever,
+    "bm25": BM25Retriever.from_texts,
+    "bm25-mmap": _mmap_bm25,
+    "dense-hashing": _dense("float32"),
+    "dense-hashing-float16": _dense("float16"),
+    "dense-hashing-int8": _dense("int8"),
+}
+
+
+def row_key(row) -> str:
+    return f"{row['framework']} | {row['object']}"
+
+
+def synthesize_corpus(size: int, seed: int = 7) -> Tuple[List[str], Dict[str, int]]:
+    """Return ``size`` row texts (original rows included) and each original row's doc id."""
+    rng = random.Random(seed)
+    object_words = sorted({word for row in ROWS for word in row["object"].split() if word.isalpha()})
+    description_words = sorted({word.strip(",.") for row in ROWS for word in row["description"].split()})
+    codes = sorted({match.group(1) for row in ROWS if (match := CODE_PATTERN.match(row["object"]))})
+
+    texts: List[str] = []
+    for serial in range(max(size - len(ROWS), 0)):
+        base = rng.choice(ROWS)
+        name = " ".join(rng.sample(object_words, 3)).title()
+        description = " ".join(rng.sample(description_words, rng.randint(10, 20))).capitalize() + "."
+        synthetic = {
+            "framework": base["framework"],
+            "version": base["version"],
+            "object": f"{rng.choice(codes)}-{100 + serial} {name}",
+            "description": description,
+        }
+        texts.append(row_text(synthetic))
+
+    positions = {}
+    for row in ROWS:
+        doc_id = rng.randint(0, len(texts))
+        texts.insert(doc_id, row_text(row))
+        positions = {key: (pos + 1 if pos >= doc_id else pos) for key, pos in positions.items()}
+        positions[row_key(row)] = doc_id
+    return texts, positions
+
+
+def labeled_queries() -> List[Tuple[str, List[str]]]:
+    labeled = json.loads(LABELS_PATH.read_text())
+    queries = [(item["question"], item["relevant"]) for item in labeled["questions"]]
+    # One artifact-name query per original row (e.g. "NATO Cap-V Capability Viewpoint").
+    queries += [(f"{row['framework']} {row['object']}", [row_key(row)]) for row in ROWS]
+    return queries
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def measure_memory(factory, texts) -> Dict[str, int]:
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    retriever = factory(texts)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retriever
+    return {"resident_bytes": current - baseline, "peak_build_bytes": peak - baseline}
+
+
+def benchmark(name: str, texts: List[str], positions: Dict[str, int], top_k: int,
+              repeats: int, track_memory: bool) -> dict:
+    factory = RETRIEVERS[name]
+    gc.collect()
+    started = time.perf_counter()
+    retriever = factory(texts)
+    build_s = time.perf_counter() - started
+
+    queries = labeled_queries()
+    latencies_ms: List[float] = []
+    recalls: List[float] = []
+    reciprocal_ranks: List[float] = []
+    for repeat in range(repeats):
+        for question, relevant_keys in queries:
+            started = time.perf_counter()
+            hits = retriever.search(question, top_k=top_k)
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+            if repeat:
+                continue
+            relevant = {positions[key] for key in relevant_keys}
+            ranked = [doc_id for doc_id, _ in hits]
+            recalls.append(len(relevant.intersection(ranked)) / len(relevant))
+            first = next((rank for rank, doc_id in enumerate(ranked, start=1) if doc_id in relevant), None)
+            reciprocal_ranks.append(1 / first if first else 0.0)
+    del retriever
+
+    latencies_ms.sort()
+    result = {
+        "retriever": name,
+        "rows": len(texts),
+        "build_s": build_s,
+        "latency_ms": {
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "mean": statistics.fmean(latencies_ms),
+        },
+        "queries_timed": len(latencies_ms),
+        "quality": {
+            f"recall@{top_k}": statistics.fmean(recalls),
+            "mrr": statistics.fmean(reciprocal_ranks),
+            "labeled_queries": len(recalls),
+        },
+    }
+    if track_memory:
+        result["memory"] = measure_memory(factory, texts)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="corpus sizes in rows")
+    parser.add_argument("--retrievers", nargs="+", choices=sorted(RETRIEVERS), default=["keyword-scan", "bm25", "bm25-mmap"])
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3, help="passes over the query set for latency percentiles")
+    parser.add_argument("--max-scan-rows", type=int, default=100_000,
+                        help="skip keyword-scan above this size (it is O(rows) per query)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc build pass")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", type=Path, default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        texts, positions = synthesize_corpus(size, seed=args.seed)
+        for name in args.retrievers:
+            if name == "keyword-scan" and size > args.max_scan_rows:
+                print(f"skip {name} @ {size:,} rows (> --max-scan-rows)", file=sys.stderr)
+                continue
+            result = benchmark(name, texts, positions, args.top_k, args.repeats, not args.no_memory)
+            results.append(result)
+            print(
+                f"{name:>18} @ {size:>9,} rows: build {result['build_s']:.2f}s, "
+                f"p50 {result['latency_ms']['p50']:.2f}ms, p99 {result['latency_ms']['p99']:.2f}ms, "
+                f"MRR {result['quality']['mrr']:.3f}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "top_k": args.top_k,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(payload)
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
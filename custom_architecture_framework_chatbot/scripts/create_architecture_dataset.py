@@ -10,12 +10,28 @@ The short descriptions below were validated against the following references:
 * US Federal Enterprise Architecture Framework (FEAF) 2.3
 * NIST Special Publication 1500-201, Cyber-Physical Systems (CPS) Framework
 * The Open Group ArchiMate Modeling Language 3.2 specification
+
+After writing the CSV, the script also builds the memory-mapped BM25 index
+(``data/architecture_framework_knowledge.idx``) consumed by ``retrieval.py``.
+The index records the CSV's content hash, so it is only rewritten when ``ROWS``
+actually changes; pass ``--force-index`` to rebuild it unconditionally.
 """
 
+import argparse
+import sys
 from pathlib import Path
 
 import pandas as pd
 
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from retrieval import build_index  # noqa: E402
+
+DATA_DIR = PROJECT_ROOT / "data"
+CSV_PATH = DATA_DIR / "architecture_framework_knowledge.csv"
+INDEX_PATH = DATA_DIR / "architecture_framework_knowledge.idx"
+
 
 ROWS = [
     {
@@ -489,15 +505,30 @@ ROWS = [
 ]
 
 
+def row_text(row) -> str:
+    """Flatten a knowledge row into the ``text`` column used for retrieval."""
+    return f"{row['framework']} {row['version']} | {row['object']} - {row['description']}"
+
+
+def write_index_stage(csv_path: Path = CSV_PATH, index_path: Path = INDEX_PATH, force: bool = False) -> None:
+    if build_index(csv_path, index_path, force=force):
+        print(f"Wrote BM25 index to {index_path}")
+    else:
+        print(f"Index {index_path} is up to date with {csv_path.name}; skipped rebuild")
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--force-index", action="store_true", help="rebuild the index even if the CSV is unchanged")
+    args = parser.parse_args()
+
     df = pd.DataFrame(ROWS)
-    df["text"] = df.apply(
-        lambda row: f"{row['framework']} {row['version']} | {row['object']} - {row['description']}",
-        axis=1,
-    )
-    out_path = Path(__file__).resolve().parents[1] / "data" / "architecture_framework_knowledge.csv"
-    df.to_csv(out_path, index=False)
-    print(f"Wrote {len(df)} rows to {out_path}")
+    df["text"] = df.apply(row_text, axis=1)
+    CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(CSV_PATH, index=False)
+    print(f"Wrote {len(df)} rows to {CSV_PATH}")
+
+    write_index_stage(force=args.force_index)
 
 
 if __name__ == "__main__":
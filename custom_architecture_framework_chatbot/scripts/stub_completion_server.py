@@ -0,0 +1,154 @@
+"""Local stand-in for the OpenAI Completions endpoint.
+
+Serves ``POST /v1/completions`` with a configurable artificial latency and a
+configurable fraction of ``429 Too Many Requests`` responses, so the batch
+evaluator's concurrency and retry behaviour can be exercised without an API
+key. Point the notebook at it with::
+
+    python scripts/stub_completion_server.py --port 8765 --latency 0.5 --rate-limit 0.2
+    openai.api_base = "http://127.0.0.1:8765/v1"
+    openai.api_key = "stub"
+
+Requests with ``"stream": true`` are answered with server-sent events, one
+chunk per word, with the latency spread across the chunks.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+    rate_limit = 0.0
+    rng = random.Random(0)
+    lock = threading.Lock()
+    stats = {"requests": 0, "rate_limited": 0}
+
+    def log_message(self, format, *args):  # noqa: A002 - signature from BaseHTTPRequestHandler
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with self.lock:
+            self.stats["requests"] += 1
+            limited = self.rng.random() < self.rate_limit
+            if limited:
+                self.stats["rate_limited"] += 1
+
+        if limited:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": "0"},
+            )
+            return
+
+        prompt = request.get("prompt", "")
+        words = (["Stub", "answer", "echoing:"] + prompt.split()[-24:])[: int(request.get("max_tokens", 350))]
+
+        if request.get("stream"):
+            self._stream(request, words)
+            return
+
+        time.sleep(self.latency)
+        text = " " + " ".join(words)
+        self._send_json(
+            200,
+            {
+                "id": "cmpl-stub",
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": len(words),
+                    "total_tokens": len(prompt.split()) + len(words),
+                },
+            },
+        )
+
+    def _stream(self, request, words):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        per_chunk = self.latency / max(len(words), 1)
+        for index, word in enumerate(words):
+            time.sleep(per_chunk)
+            chunk = {
+                "id": "cmpl-stub",
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "text": " " + word,
+                    "index": 0,
+                    "logprobs": None,
+                    "finish_reason": "stop" if index == len(words) - 1 else None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def serve(host="127.0.0.1", port=8765, latency=0.5, rate_limit=0.0, seed=0):
+    """Start the stub server in a daemon thread and return it (call ``shutdown()`` to stop)."""
+    handler = type(
+        "ConfiguredStubHandler",
+        (StubCompletionHandler,),
+        {
+            "latency": latency,
+            "rate_limit": rate_limit,
+            "rng": random.Random(seed),
+            "lock": threading.Lock(),
+            "stats": {"requests": 0, "rate_limited": 0},
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.stats = handler.stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per completion")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.rate_limit, args.seed)
+    print(f"Stub completions endpoint on http://{args.host}:{args.port}/v1 (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
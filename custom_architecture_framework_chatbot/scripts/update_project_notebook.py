@@ -59,14 +59,14 @@ def update_notebook() -> None:
 
     nb.cells[6].source = (
         "## Custom Query Completion\n\n"
-        "I use a lightweight retrieval-augmented prompt: keywords from the user's question score each row, "
+        "I use a lightweight retrieval-augmented prompt: the user's question is scored against a BM25 inverted index "
+        "built once from the knowledge rows (`retrieval.py`), "
         "the top entries become the context block, and that block is prepended to the OpenAI Completion request. "
         "Comparing this grounded response with a baseline completion (no custom context) shows how much the "
         "architecture knowledge base helps."
     )
 
     nb.cells[7].source = (
-        "import re\n"
         "from textwrap import dedent\n\n"
         "import openai\n\n"
         "# Replace this placeholder with your actual Vocareum/OpenAI API key before running the notebook.\n"
@@ -77,56 +77,71 @@ def update_notebook() -> None:
     )
 
     nb.cells[8].source = (
-        "def score_text(text, keywords):\n"
-        "    lowered = text.lower()\n"
-        "    return sum(lowered.count(keyword) for keyword in keywords)\n\n"
+        "from retrieval import BM25Retriever, load_index\n\n"
+        "INDEX_PATH = Path(\"data/architecture_framework_knowledge.idx\")\n\n"
+        "# The inverted index is persisted next to the CSV and opened via mmap; it is rebuilt\n"
+        "# automatically if the CSV content hash changed. Each question then only touches the\n"
+        "# postings of its own terms and keeps the best rows in a top-k heap.\n"
+        "retriever = BM25Retriever(load_index(INDEX_PATH, source_path=DATA_PATH))\n\n"
+        "from context_packing import ContextPacker\n\n"
+        "CONTEXT_TOKEN_BUDGET = 600\n\n"
+        "# Dedupe near-identical rows and pack up to top_k of the most relevant rows per token into the budget;\n"
+        "# context_packer.last_stats reports tokens used and rows dropped for the latest question.\n"
+        "context_packer = ContextPacker(retriever, token_budget=CONTEXT_TOKEN_BUDGET)\n\n"
         "\n"
         "def build_context(question, top_k=DEFAULT_TOP_K):\n"
-        "    tokens = re.findall(r\"[a-z0-9]+\", question.lower())\n"
-        "    keywords = {token for token in tokens if token}\n"
-        "    if not keywords:\n"
-        "        keywords = set(question.lower().split())\n"
+        "    return context_packer.build_context(question, top_k=top_k)\n\n"
         "\n"
-        "    scored = (\n"
-        "        knowledge_df.assign(\n"
-        "            relevance=knowledge_df[\"text_lower\"].apply(lambda txt: score_text(txt, keywords))\n"
-        "        )\n"
-        "        .sort_values(\"relevance\", ascending=False)\n"
+        "# Optional dense alternative for paraphrased questions (e.g. \"timeline\" vs \"Capability Phasing\").\n"
+        "# Off by default: the first build embeds every row through the OpenAI embeddings endpoint.\n"
+        "# When enabled, row embeddings are cached under EMBEDDING_DIR; pass\n"
+        "# context_builder=dense_retriever.build_context to ask_custom_completion to use it.\n"
+        "USE_DENSE_RETRIEVAL = False\n"
+        "EMBEDDING_DIR = Path(\"data/embeddings\")\n"
+        "dense_retriever = None\n"
+        "if USE_DENSE_RETRIEVAL:\n"
+        "    from embeddings import DenseRetriever, OpenAIEmbedder\n\n"
+        "    dense_retriever = DenseRetriever.load_or_build(\n"
+        "        EMBEDDING_DIR, knowledge_df[\"text\"].tolist(), OpenAIEmbedder()\n"
         "    )\n"
-        "\n"
-        "    if scored[\"relevance\"].max() == 0:\n"
-        "        scored = scored.sample(n=min(top_k, len(scored)), random_state=42)\n"
-        "    else:\n"
-        "        scored = scored.head(top_k)\n"
-        "\n"
-        "    return \"\\n\\n\".join(scored[\"text\"].tolist())\n"
     )
 
     nb.cells[9].source = (
-        "def call_completion(prompt, temperature=0.2, max_tokens=350):\n"
-        "    response = openai.Completion.create(\n"
-        "        model=MODEL_NAME,\n"
-        "        prompt=prompt,\n"
-        "        temperature=temperature,\n"
-        "        max_tokens=max_tokens,\n"
-        "    )\n"
-        "    return response[\"choices\"][0][\"text\"].strip()\n\n"
+        "from completion_cache import CompletionCache\n"
+        "from streaming import stream_completion\n\n"
+        "# Identical (model, prompt, temperature, max_tokens) requests are served from disk on reruns.\n"
+        "# Only deterministic (temperature=0) calls are cached: the evaluation cells run at\n"
+        "# EVAL_TEMPERATURE=0 and hit the cache on reruns, while sampled chat calls always go to the API.\n"
+        "completion_cache = CompletionCache(\n"
+        "    Path(\"data/completion_cache.sqlite3\"), max_entries=2000, ttl_seconds=7 * 24 * 3600,\n"
+        "    deterministic_only=True,\n"
+        ")\n\n"
+        "\n"
+        "def call_completion(prompt, temperature=0.2, max_tokens=350, stream=False):\n"
+        "    if stream:\n"
+        "        # Iterate the returned stream for tokens; .text and .usage are filled in at the end.\n"
+        "        return stream_completion(MODEL_NAME, prompt, temperature, max_tokens, cache=completion_cache)\n\n"
+        "    def create():\n"
+        "        response = openai.Completion.create(\n"
+        "            model=MODEL_NAME,\n"
+        "            prompt=prompt,\n"
+        "            temperature=temperature,\n"
+        "            max_tokens=max_tokens,\n"
+        "        )\n"
+        "        return response[\"choices\"][0][\"text\"].strip()\n\n"
+        "    return completion_cache.get_or_create(MODEL_NAME, prompt, temperature, max_tokens, create)\n\n"
         "\n"
-        "def ask_basic_completion(question):\n"
-        "    prompt = dedent(\n"
+        "def build_basic_prompt(question):\n"
+        "    return dedent(\n"
         "        f\"\"\"\n"
         "        You are a helpful enterprise architecture assistant.\n"
         "        Question: {question}\n"
         "        Answer:\n"
         "        \"\"\"\n"
-        "    ).strip()\n"
-        "    return call_completion(prompt, temperature=0.4)\n\n"
-        "\n"
-        "def ask_custom_completion(question, top_k=DEFAULT_TOP_K, context=None):\n"
-        "    if context is None:\n"
-        "        context = build_context(question, top_k=top_k)\n"
+        "    ).strip()\n\n"
         "\n"
-        "    prompt = dedent(\n"
+        "def build_custom_prompt(question, context):\n"
+        "    return dedent(\n"
         "        f\"\"\"\n"
         "        You are an enterprise architecture copilot. Use only the provided context to answer the question, and cite the relevant framework names when possible.\n"
         "\n"
@@ -136,8 +151,17 @@ def update_notebook() -> None:
         "        Question: {question}\n"
         "        Answer:\n"
         "        \"\"\"\n"
-        "    ).strip()\n"
-        "    return call_completion(prompt, temperature=0.2)\n"
+        "    ).strip()\n\n"
+        "\n"
+        "def ask_basic_completion(question, temperature=0.4):\n"
+        "    return call_completion(build_basic_prompt(question), temperature=temperature)\n\n"
+        "\n"
+        "def ask_custom_completion(question, top_k=DEFAULT_TOP_K, context=None, context_builder=None, stream=False,\n"
+        "                          temperature=0.2):\n"
+        "    if context is None:\n"
+        "        context_builder = context_builder or build_context\n"
+        "        context = context_builder(question, top_k=top_k)\n"
+        "    return call_completion(build_custom_prompt(question, context), temperature=temperature, stream=stream)\n"
     )
 
     nb.cells[10].source = (
@@ -149,14 +173,36 @@ def update_notebook() -> None:
     )
 
     nb.cells[11].source = (
-        "def evaluate_question(question, top_k=DEFAULT_TOP_K):\n"
+        "# Evaluation answers are generated at temperature 0: reproducible, and served from the\n"
+        "# completion cache on reruns. Set EVAL_TEMPERATURE = None to sample at the chat defaults\n"
+        "# (0.4 basic / 0.2 custom), which are never cached.\n"
+        "EVAL_TEMPERATURE = 0\n\n"
+        "\n"
+        "def evaluate_question(question, top_k=DEFAULT_TOP_K, temperature=EVAL_TEMPERATURE):\n"
         "    context = build_context(question, top_k=top_k)\n"
+        "    overrides = {} if temperature is None else {\"temperature\": temperature}\n"
         "    return {\n"
         "        \"question\": question,\n"
         "        \"context\": context,\n"
-        "        \"basic_answer\": ask_basic_completion(question),\n"
-        "        \"custom_answer\": ask_custom_completion(question, top_k=top_k, context=context),\n"
-        "    }\n"
+        "        \"basic_answer\": ask_basic_completion(question, **overrides),\n"
+        "        \"custom_answer\": ask_custom_completion(question, top_k=top_k, context=context, **overrides),\n"
+        "    }\n\n"
+        "\n"
+        "from batch_evaluation import evaluate_questions, make_openai_completion\n\n"
+        "\n"
+        "async def evaluate_batch(questions, top_k=DEFAULT_TOP_K, concurrency=8, temperature=EVAL_TEMPERATURE):\n"
+        "    \"\"\"Evaluate many questions concurrently; use `await evaluate_batch([...])` in a cell.\"\"\"\n"
+        "    overrides = {} if temperature is None else {\"basic_temperature\": temperature, \"custom_temperature\": temperature}\n"
+        "    return await evaluate_questions(\n"
+        "        questions,\n"
+        "        build_context,\n"
+        "        build_basic_prompt,\n"
+        "        build_custom_prompt,\n"
+        "        make_openai_completion(MODEL_NAME, cache=completion_cache),\n"
+        "        top_k=top_k,\n"
+        "        concurrency=concurrency,\n"
+        "        **overrides,\n"
+        "    )\n"
     )
 
     nb.cells[12].source = (
@@ -197,7 +243,15 @@ def update_notebook() -> None:
 
         tail_cells.append(new_code_cell(f"{answers_var}[\"context\"]\n"))
 
-    nb.cells = nb.cells[:13] + tail_cells
+    # Reuse unchanged question cells so their recorded outputs survive a regeneration,
+    # and keep anything after the question block (the closing Conclusion cell)
+    existing = nb.cells[13:]
+    for position, cell in enumerate(tail_cells):
+        if position < len(existing):
+            old = existing[position]
+            if old.cell_type == cell.cell_type and old.source.rstrip("\n") == cell.source.rstrip("\n"):
+                tail_cells[position] = old
+    nb.cells = nb.cells[:13] + tail_cells + nb.cells[13 + len(tail_cells):]
 
     nbformat.write(nb, PROJECT_NOTEBOOK)
     print("Updated project.ipynb with architecture chatbot content.")
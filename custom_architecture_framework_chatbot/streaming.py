@@ -0,0 +1,266 @@
+"""Streaming completions for the architecture copilot.
+
+``call_completion`` waits for the full 350-token answer before returning. The
+helpers here request ``stream=True`` from the Completions endpoint and hand the
+text back chunk by chunk, so the first words appear after the model's
+first-chunk latency instead of its full generation time. Once the stream is
+exhausted the wrappers expose the assembled ``text``, ``finish_reason`` and
+``usage`` plus client-side timings (time to first token, total time).
+
+Typical notebook usage::
+
+    stream = stream_completion(MODEL_NAME, prompt, temperature=0.2, max_tokens=350)
+    for token in stream:
+        print(token, end="", flush=True)
+    stream.usage  # {"prompt_tokens": ..., "completion_tokens": ..., "total_tokens": ...}
+
+    async for token in astream_completion(MODEL_NAME, prompt):
+        ...
+
+When a ``CompletionCache`` is passed, cached answers are replayed as a single
+chunk and freshly streamed answers are stored once they finish.
+
+The legacy streaming API does not report usage, so ``completion_tokens`` is then
+counted from the assembled text with ``context_packing.get_token_counter`` (the
+same counter the context budget uses); pass ``count_tokens`` to override it.
+"""
+
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+from completion_cache import make_cache_key
+from context_packing import get_token_counter
+
+
+class _StreamState:
+    """Accumulates chunks from either the sync or the async stream wrapper."""
+
+    def __init__(
+        self,
+        prompt_tokens: Optional[int],
+        on_complete: Optional[Callable[[str], None]],
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        self.pieces: List[str] = []
+        self.finish_reason: Optional[str] = None
+        self.server_usage: Optional[Dict[str, int]] = None
+        self.prompt_tokens = prompt_tokens
+        self.on_complete = on_complete
+        self.count_tokens = count_tokens
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def add(self, chunk: Any) -> str:
+        if isinstance(chunk, str):
+            piece = chunk
+        else:
+            if chunk.get("usage"):
+                self.server_usage = dict(chunk["usage"])
+            choices = chunk.get("choices") or [{}]
+            piece = choices[0].get("text") or ""
+            self.finish_reason = choices[0].get("finish_reason") or self.finish_reason
+        if piece:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.pieces.append(piece)
+        return piece
+
+    def finish(self) -> None:
+        if self.finished_at is not None:
+            return
+        self.finished_at = time.perf_counter()
+        if self.on_complete is not None:
+            self.on_complete(self.text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pieces).strip()
+
+    @property
+    def usage(self) -> Dict[str, Optional[int]]:
+        if self.server_usage is not None:
+            return self.server_usage
+        # Chunks are not tokens (a cached replay is a single chunk), so count the text itself.
+        if self.count_tokens is None:
+            self.count_tokens = get_token_counter()
+        completion_tokens = self.count_tokens("".join(self.pieces))
+        total = None if self.prompt_tokens is None else self.prompt_tokens + completion_tokens
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total}
+
+    @property
+    def timings(self) -> Dict[str, Optional[float]]:
+        ttft = None if self.first_token_at is None else self.first_token_at - self.started
+        total = None if self.finished_at is None else self.finished_at - self.started
+        return {"time_to_first_token_s": ttft, "total_s": total}
+
+
+class _StreamResultMixin:
+    _state: _StreamState
+
+    @property
+    def done(self) -> bool:
+        return self._state.finished_at is not None
+
+    @property
+    def finish_reason(self) -> Optional[str]:
+        return self._state.finish_reason
+
+    @property
+    def usage(self) -> Dict[str, Optional[int]]:
+        return self._state.usage
+
+    @property
+    def timings(self) -> Dict[str, Optional[float]]:
+        return self._state.timings
+
+
+class CompletionStream(_StreamResultMixin):
+    """Generator-style iterator over completion text pieces.
+
+    Reading ``text`` before the stream is exhausted drains the remaining chunks.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[Any],
+        prompt_tokens: Optional[int] = None,
+        on_complete: Optional[Callable[[str], None]] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        self._chunks = iter(chunks)
+        self._state = _StreamState(prompt_tokens, on_complete, count_tokens)
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        while True:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._state.finish()
+                raise
+            piece = self._state.add(chunk)
+            if piece:
+                return piece
+
+    @property
+    def text(self) -> str:
+        for _ in self:
+            pass
+        return self._state.text
+
+
+class AsyncCompletionStream(_StreamResultMixin):
+    """Async-iterator counterpart of ``CompletionStream``; ``await stream.read()`` drains it."""
+
+    def __init__(
+        self,
+        chunks: Callable[[], Any],
+        prompt_tokens: Optional[int] = None,
+        on_complete: Optional[Callable[[str], None]] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ) -> None:
+        self._open = chunks
+        self._chunks: Optional[AsyncIterator[Any]] = None
+        self._state = _StreamState(prompt_tokens, on_complete, count_tokens)
+
+    def __aiter__(self) -> "AsyncCompletionStream":
+        return self
+
+    async def __anext__(self) -> str:
+        if self._chunks is None:
+            source = await self._open()
+            self._chunks = source.__aiter__() if isinstance(source, AsyncIterable) else _aiter_sync(source)
+        while True:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._state.finish()
+                raise
+            piece = self._state.add(chunk)
+            if piece:
+                return piece
+
+    async def read(self) -> str:
+        async for _ in self:
+            pass
+        return self._state.text
+
+    @property
+    def text(self) -> str:
+        if not self.done:
+            raise RuntimeError("Async stream not finished; use `await stream.read()`.")
+        return self._state.text
+
+
+async def _aiter_sync(items: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+def _cache_hooks(cache, model: str, prompt: str, temperature: float, max_tokens: int):
+    if cache is None or not cache.is_cacheable(temperature):
+        return None, None
+    key = make_cache_key(model, prompt, temperature, max_tokens)
+    return cache.get(key), (lambda text: cache.put(key, model, text))
+
+
+def stream_completion(
+    model: str,
+    prompt: str,
+    temperature: float = 0.2,
+    max_tokens: int = 350,
+    cache=None,
+    prompt_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> CompletionStream:
+    """Start a streamed completion and return a ``CompletionStream`` over its text pieces."""
+    cached, store = _cache_hooks(cache, model, prompt, temperature, max_tokens)
+    if cached is not None:
+        return CompletionStream([cached], prompt_tokens=prompt_tokens, count_tokens=count_tokens)
+
+    import openai
+
+    chunks = openai.Completion.create(
+        model=model,
+        prompt=prompt,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    return CompletionStream(chunks, prompt_tokens=prompt_tokens, on_complete=store, count_tokens=count_tokens)
+
+
+def astream_completion(
+    model: str,
+    prompt: str,
+    temperature: float = 0.2,
+    max_tokens: int = 350,
+    cache=None,
+    prompt_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> AsyncCompletionStream:
+    """Async variant of ``stream_completion``; the request is sent on first iteration."""
+    cached, store = _cache_hooks(cache, model, prompt, temperature, max_tokens)
+    if cached is not None:
+        async def replay():
+            return [cached]
+
+        return AsyncCompletionStream(replay, prompt_tokens=prompt_tokens, count_tokens=count_tokens)
+
+    import openai
+
+    async def open_stream():
+        return await openai.Completion.acreate(
+            model=model,
+            prompt=prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+
+    return AsyncCompletionStream(
+        open_stream, prompt_tokens=prompt_tokens, on_complete=store, count_tokens=count_tokens
+    )
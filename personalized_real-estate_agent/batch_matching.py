@@ -0,0 +1,284 @@
+"""Nightly matching of many buyer profiles against the whole HomeMatch inventory.
+
+``run_multimodal_search`` serves one ``PreferenceProfile`` per call: two query
+embeddings and one ranking pass each. ``iter_profile_matches`` takes the profiles in
+chunks instead. Per chunk it:
+
+- embeds every ``to_text_query()`` and ``visual_prompt`` with one batched call per
+  embedder,
+- scores the chunk against all listings with one matrix-matrix product per modality
+  (``FusedIndex.score``),
+- takes each profile's top ``k`` with a row-wise ``argpartition``.
+
+Only one chunk of scores is alive at a time (``chunk_size x listings`` floats per
+matrix), and ``match_profiles_to_file`` writes each chunk to JSONL before scoring the
+next, so memory stays bounded however many profiles there are.
+
+Usage from the notebook (``index`` from ``ranking.FusedIndex``):
+
+    from batch_matching import match_profiles_to_file
+    count = match_profiles_to_file(
+        profiles, index, text_embedder.embed_documents, clip.embed_queries, "matches.jsonl", top_k=12)
+
+Running this file compares the batch path with looping over ``run_multimodal_search``
+(hashed text embeddings and a random CLIP text tower, so it runs offline):
+
+    python batch_matching.py --profiles 2000 --listings 5000
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import re
+import tempfile
+import textwrap
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from listing_index import listing_document
+from ranking import FusedIndex, run_multimodal_search, synthetic_listings
+
+PROFILE_CHUNK_SIZE = 256
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """(m, k) column indices of the largest `scores` in each row, best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def iter_profile_matches(
+    profiles: Iterable[Any],
+    index: FusedIndex,
+    embed_text_queries: Callable[[List[str]], Sequence[Sequence[float]]],
+    embed_image_queries: Callable[[List[str]], Sequence[Sequence[float]]],
+    top_k: int = 5,
+    weight_text: float = 0.65,
+    chunk_size: int = PROFILE_CHUNK_SIZE,
+    filters_for: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    **filters: Any,
+) -> Iterator[Tuple[Any, List[Dict[str, Any]]]]:
+    """Yield ``(profile, ranked_results)`` per profile, in input order.
+
+    ``ranked_results`` are ``run_multimodal_search`` result dicts. The embedders take
+    a list of strings, e.g. ``text_embedder.embed_documents`` and
+    ``ClipEmbedder.embed_queries``. ``filters`` (``FusedIndex.filter_mask``
+    arguments) apply to every profile and narrow the rows before scoring;
+    ``filters_for(profile)`` returns extra per-profile filters such as a budget.
+    """
+    mask = index.filter_mask(**filters)
+    rows = None if mask is None else np.flatnonzero(mask)
+    for chunk in _chunks(profiles, chunk_size):
+        text_queries = np.asarray(embed_text_queries([profile.to_text_query() for profile in chunk]), dtype=np.float32)
+        image_queries = np.asarray(embed_image_queries([profile.visual_prompt for profile in chunk]), dtype=np.float32)
+        text_scores, image_scores, fused = index.score(text_queries, image_queries, weight_text, rows)
+        if filters_for is not None:
+            profile_masks = []
+            for profile in chunk:
+                profile_mask = index.filter_mask(**filters_for(profile))
+                profile_mask = np.ones(len(index), dtype=bool) if profile_mask is None else profile_mask
+                profile_masks.append(profile_mask if rows is None else profile_mask[rows])
+            fused = np.where(np.stack(profile_masks), fused, -np.inf)
+        best = top_k_rows(fused, top_k)
+        for position, profile in enumerate(chunk):
+            columns = best[position][np.isfinite(fused[position, best[position]])]
+            yield profile, index.format_results(text_scores[position], image_scores[position], fused[position],
+                                                rows, columns)
+
+
+def _match_record(profile_id: Any, profile: Any, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "profile_id": profile_id,
+        "persona_name": getattr(profile, "persona_name", None),
+        "results": [
+            {
+                "listing_id": result["listing"].listing_id,
+                "score": round(result["score"], 6),
+                "text_score": round(result["text_score"], 6),
+                "image_score": round(result["image_score"], 6),
+            }
+            for result in results
+        ],
+    }
+
+
+def match_profiles_to_file(
+    profiles: Iterable[Any],
+    index: FusedIndex,
+    embed_text_queries: Callable[[List[str]], Sequence[Sequence[float]]],
+    embed_image_queries: Callable[[List[str]], Sequence[Sequence[float]]],
+    out_path: Path,
+    top_k: int = 5,
+    weight_text: float = 0.65,
+    chunk_size: int = PROFILE_CHUNK_SIZE,
+    filters_for: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    **filters: Any,
+) -> int:
+    """Write one JSONL line per profile to `out_path`, a chunk at a time; returns the profile count.
+
+    Lines hold ``profile_id`` (the profile's ``profile_id`` attribute, else its
+    position), ``persona_name`` and the ranked ``listing_id``/score entries.
+    """
+    matches = iter_profile_matches(profiles, index, embed_text_queries, embed_image_queries, top_k, weight_text,
+                                   chunk_size, filters_for, **filters)
+    count = 0
+    with Path(out_path).open("w", encoding="utf-8") as handle:
+        for chunk in _chunks(matches, chunk_size):
+            lines = []
+            for profile, results in chunk:
+                profile_id = getattr(profile, "profile_id", None)
+                lines.append(json.dumps(_match_record(count if profile_id is None else profile_id, profile, results)))
+                count += 1
+            handle.write("\n".join(lines) + "\n")
+            handle.flush()
+    return count
+
+
+class HashingEmbedder:
+    """Offline stand-in for ``HuggingFaceEmbeddings``: signed feature hashing of word unigrams and bigrams."""
+
+    def __init__(self, dim: int = 384) -> None:
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    def _vector(self, text: str) -> np.ndarray:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokens + [" ".join(pair) for pair in zip(tokens, tokens[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text).tolist()
+
+
+@dataclass
+class SyntheticProfile:
+    """A ``PreferenceProfile`` look-alike for benchmarks (same ``to_text_query``)."""
+
+    profile_id: str
+    persona_name: str
+    summary: str
+    priorities: List[str]
+    transit_story: str
+    cultural_musts: List[str]
+    visual_prompt: str
+    raw_answers: Dict[str, str] = field(default_factory=dict)
+
+    def to_text_query(self) -> str:
+        return textwrap.dedent(
+            f"""
+            {self.summary}
+            Priorities: {', '.join(self.priorities)}.
+            Transit: {self.transit_story}.
+            Culture: {', '.join(self.cultural_musts)}.
+            Visual tone: {self.visual_prompt}.
+            """
+        ).strip()
+
+
+def synthetic_profiles(count: int, seed: int = 0) -> List[SyntheticProfile]:
+    """`count` buyer profiles assembled from phrases of the sample listings."""
+    rng = np.random.default_rng(seed)
+    listings = synthetic_listings(12)
+    phrases = sorted({phrase for listing in listings
+                      for phrase in listing.amenities + listing.technology_features + listing.vibe_tags})
+    transit = sorted({stop for listing in listings for stop in listing.transit})
+    visuals = [listing.visual_prompt for listing in listings]
+
+    def pick(options: List[str], size: int) -> List[str]:
+        return [options[i] for i in rng.choice(len(options), size=size, replace=False)]
+
+    return [
+        SyntheticProfile(
+            profile_id=f"buyer-{number:06d}",
+            persona_name=f"Buyer {number}",
+            summary=f"Buyer wants {', '.join(pick(phrases, 3))}.",
+            priorities=pick(phrases, 4),
+            transit_story=f"Near {', '.join(pick(transit, 2))}",
+            cultural_musts=pick(phrases, 2),
+            visual_prompt=visuals[int(rng.integers(len(visuals)))] + f", {pick(phrases, 1)[0]}",
+        )
+        for number in range(count)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch profile matching vs looping over run_multimodal_search")
+    parser.add_argument("--profiles", type=int, default=2000)
+    parser.add_argument("--listings", type=int, default=5000)
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--chunk-size", type=int, default=PROFILE_CHUNK_SIZE)
+    parser.add_argument("--loop-profiles", type=int, default=200,
+                        help="profiles timed through the per-profile loop (extrapolated to --profiles)")
+    parser.add_argument("--clip", choices=["tiny", "base"], default="tiny", help="random CLIP text tower size")
+    args = parser.parse_args()
+
+    from clip_embedding import ClipEmbedder, random_clip
+
+    text_embedder = HashingEmbedder()
+    clip = ClipEmbedder(*random_clip(args.clip), batch_size=args.chunk_size, text_cache_size=0)
+    listings = synthetic_listings(args.listings)
+    start = time.perf_counter()
+    image_dim = clip.model.config.projection_dim
+    rng = np.random.default_rng(0)
+    image_vectors = rng.standard_normal((len(listings), image_dim)).astype(np.float32)
+    image_vectors /= np.linalg.norm(image_vectors, axis=1, keepdims=True)
+    text_vectors = text_embedder.embed_documents([listing_document(listing)[0] for listing in listings])
+    index = FusedIndex(listings, text_vectors, image_vectors)
+    print(f"indexed {len(index)} listings in {time.perf_counter() - start:.2f}s")
+    profiles = synthetic_profiles(args.profiles)
+
+    loop_profiles = profiles[:args.loop_profiles]
+    start = time.perf_counter()
+    looped = [run_multimodal_search(profile, index, text_embedder.embed_query, clip.embed_query, args.top_k)
+              for profile in loop_profiles]
+    loop_s = (time.perf_counter() - start) * len(profiles) / len(loop_profiles)
+    print(f"run_multimodal_search loop  {len(profiles) / loop_s:8.1f} profiles/s "
+          f"(~{loop_s:.1f}s for {len(profiles)}, timed on {len(loop_profiles)})")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = Path(tmp) / "matches.jsonl"
+        start = time.perf_counter()
+        count = match_profiles_to_file(profiles, index, text_embedder.embed_documents, clip.embed_queries,
+                                       out_path, args.top_k, chunk_size=args.chunk_size)
+        batch_s = time.perf_counter() - start
+        print(f"batch matching              {count / batch_s:8.1f} profiles/s "
+              f"({batch_s:.1f}s, x{loop_s / batch_s:.1f}, {out_path.stat().st_size / 1e6:.1f} MB written)")
+        with out_path.open(encoding="utf-8") as handle:
+            batched = [json.loads(line) for line in itertools.islice(handle, len(loop_profiles))]
+
+    same = np.mean([[result["listing"].listing_id for result in old] == [entry["listing_id"] for entry in new["results"]]
+                    for old, new in zip(looped, batched)])
+    print(f"identical rankings on the looped profiles: {same:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Batched CLIP embeddings for HomeMatch's image index.
+
+``compute_image_embedding`` in ``HomeMatch.ipynb`` runs one processor call and one
+CLIP forward pass per listing image, and ``ImageVectorIndex.search`` re-encodes the
+query prompt on every call. ``ClipEmbedder`` embeds images in batches instead:
+
+- images (PIL images or file paths) are decoded and preprocessed in a thread pool,
+  batch ``n + 1`` while CLIP runs batch ``n``,
+- each batch is a single ``get_image_features`` call under ``torch.inference_mode``,
+- ``precision="bfloat16"`` runs CPU inference under bf16 autocast and ``"int8"``
+  applies dynamic int8 quantisation to the Linear layers,
+- query texts go through ``embed_query``, an LRU cache keyed by prompt, so a
+  repeated search skips CLIP's text tower.
+
+Vectors are L2-normalised float32 rows, like the notebook's.
+
+``HomeMatch.ipynb``'s CLIP cell uses it this way:
+
+    from clip_embedding import ClipEmbedder
+    clip = ClipEmbedder(clip_model, clip_processor, batch_size=32)
+    # compute_image_embedding / compute_text_embedding delegate to clip.compute_image_embedding
+    # and clip.embed_query, so ImageVectorIndex.search hits the query cache
+    collection, report = sync_image_index(listings, clip.embed_images, IMAGE_VECTOR_DIR)
+
+Running this file compares the per-image loop with batched embedding:
+
+    python clip_embedding.py --images 256 --batch-sizes 1 8 32
+"""
+
+import argparse
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+PRECISIONS = ("float32", "bfloat16", "int8")
+ImageInput = Union[Image.Image, str, Path]
+
+
+def _normalize(features: Any) -> np.ndarray:
+    # transformers 5 returns a model output whose pooler_output holds the projected embeddings
+    features = features if isinstance(features, torch.Tensor) else features.pooler_output
+    features = features.float()
+    features = features / features.norm(p=2, dim=-1, keepdim=True)
+    return features.cpu().numpy()
+
+
+class ClipEmbedder:
+    """CLIP image/text embeddings in batches, with a cached query-text path."""
+
+    def __init__(
+        self,
+        model: Any,
+        processor: Any,
+        batch_size: int = 32,
+        num_workers: int = 4,
+        precision: str = "float32",
+        text_cache_size: int = 1024,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        model = model.eval()
+        if precision == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.processor = processor
+        # CLIPProcessor wraps the image processor; a bare CLIPImageProcessor works too
+        self.image_processor = getattr(processor, "image_processor", processor)
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.precision = precision
+        self.device = next(model.parameters()).device if any(True for _ in model.parameters()) else torch.device("cpu")
+        self.text_cache_size = text_cache_size
+        self._text_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_pretrained(cls, model_name: str = "openai/clip-vit-base-patch32", **kwargs: Any) -> "ClipEmbedder":
+        from transformers import CLIPModel, CLIPProcessor
+
+        return cls(CLIPModel.from_pretrained(model_name), CLIPProcessor.from_pretrained(model_name), **kwargs)
+
+    def _autocast(self):
+        if self.precision == "bfloat16":
+            return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+        return torch.autocast(device_type=self.device.type, enabled=False)
+
+    def _preprocess(self, item: ImageInput) -> np.ndarray:
+        image = item if isinstance(item, Image.Image) else Image.open(item)
+        pixels = self.image_processor(images=image.convert("RGB"), return_tensors="np")["pixel_values"]
+        return pixels[0]
+
+    def _pixel_batches(self, items: Sequence[ImageInput]) -> Iterator[np.ndarray]:
+        if self.num_workers <= 1:
+            for start in range(0, len(items), self.batch_size):
+                yield np.stack([self._preprocess(item) for item in items[start:start + self.batch_size]])
+            return
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="clip-decode") as pool:
+            # Submit one batch ahead so decoding overlaps the forward pass of the current batch
+            starts = list(range(0, len(items), self.batch_size))
+            pending = [pool.map(self._preprocess, items[start:start + self.batch_size]) for start in starts[:2]]
+            for index in range(len(starts)):
+                batch = np.stack(list(pending.pop(0)))
+                following = index + 2
+                if following < len(starts):
+                    start = starts[following]
+                    pending.append(pool.map(self._preprocess, items[start:start + self.batch_size]))
+                yield batch
+
+    def embed_images(self, images: Sequence[ImageInput]) -> np.ndarray:
+        """(n, dim) normalised image embeddings for PIL images or image paths."""
+        images = list(images)
+        if not images:
+            return np.zeros((0, self.model.config.projection_dim), dtype=np.float32)
+        outputs = []
+        for pixels in self._pixel_batches(images):
+            with torch.inference_mode(), self._autocast():
+                features = self.model.get_image_features(pixel_values=torch.from_numpy(pixels).to(self.device))
+            outputs.append(_normalize(features))
+        return np.concatenate(outputs)
+
+    def embed_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """(n, dim) normalised text embeddings, uncached."""
+        texts = list(texts)
+        outputs = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.processor(text=texts[start:start + self.batch_size], padding=True, truncation=True,
+                                    return_tensors="pt").to(self.device)
+            with torch.inference_mode(), self._autocast():
+                features = self.model.get_text_features(**inputs)
+            outputs.append(_normalize(features))
+        if not outputs:
+            return np.zeros((0, self.model.config.projection_dim), dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def embed_queries(self, prompts: Sequence[str]) -> np.ndarray:
+        """Like ``embed_texts`` but served from / stored in the query LRU cache."""
+        prompts = list(prompts)
+        found = {}
+        with self._lock:
+            for prompt in dict.fromkeys(prompts):
+                if prompt in self._text_cache:
+                    self._text_cache.move_to_end(prompt)
+                    found[prompt] = self._text_cache[prompt]
+            hits = sum(prompt in found for prompt in prompts)
+            self.hits += hits
+            self.misses += len(prompts) - hits
+        missing = [prompt for prompt in dict.fromkeys(prompts) if prompt not in found]
+        if missing:
+            vectors = self.embed_texts(missing)
+            with self._lock:
+                for prompt, vector in zip(missing, vectors):
+                    # Shared between callers, so nobody may normalise or scale it in place
+                    vector.setflags(write=False)
+                    found[prompt] = self._text_cache[prompt] = vector
+                while len(self._text_cache) > self.text_cache_size:
+                    self._text_cache.popitem(last=False)
+        return np.stack([found[prompt] for prompt in prompts])
+
+    def embed_query(self, prompt: str) -> np.ndarray:
+        """Cached drop-in for the notebook's ``compute_text_embedding`` (read-only vector)."""
+        return self.embed_queries([prompt])[0]
+
+    def compute_image_embedding(self, image: Image.Image) -> np.ndarray:
+        """Drop-in for the notebook's single-image function."""
+        return self.embed_images([image])[0]
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._text_cache.clear()
+
+    def cache_info(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._text_cache),
+                "max_size": self.text_cache_size}
+
+
+class _HashingClipProcessor:
+    """Offline stand-in for ``CLIPProcessor``: CLIP's image preprocessing plus words hashed into the CLIP vocabulary."""
+
+    def __init__(self, image_processor: Any, config: Any) -> None:
+        self.image_processor = image_processor
+        self.vocab_size = config.text_config.vocab_size
+        self.bos_token_id = config.text_config.bos_token_id
+        self.eos_token_id = config.text_config.eos_token_id
+        self.max_length = config.text_config.max_position_embeddings
+
+    def _token_ids(self, text: str) -> List[int]:
+        words = re.findall(r"[a-z0-9]+", text.lower())[:self.max_length - 2]
+        # Word IDs stay below the special tokens at the top of the vocabulary
+        ids = [int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little")
+               % (self.vocab_size - 3) + 1 for word in words]
+        return [self.bos_token_id] + ids + [self.eos_token_id]
+
+    def __call__(self, text: Any = None, images: Any = None, return_tensors: str = "pt", **kwargs: Any) -> Any:
+        from transformers import BatchEncoding
+
+        if images is not None:
+            return self.image_processor(images=images, return_tensors=return_tensors)
+        rows = [self._token_ids(item) for item in ([text] if isinstance(text, str) else text)]
+        width = max(len(row) for row in rows)
+        return BatchEncoding({
+            "input_ids": [row + [self.eos_token_id] * (width - len(row)) for row in rows],
+            "attention_mask": [[1] * len(row) + [0] * (width - len(row)) for row in rows],
+        }, tensor_type=return_tensors)
+
+
+def random_clip(size: str = "tiny", seed: int = 0) -> tuple:
+    """A randomly initialised CLIP model and processor for offline runs.
+
+    ``size="base"`` has the shapes of ``openai/clip-vit-base-patch32``, so timings are
+    representative; ``"tiny"`` is a few MB for quick checks. The processor applies
+    CLIP's 224px image preprocessing and hashes words into token IDs (no tokenizer
+    download).
+    """
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel
+
+    torch.manual_seed(seed)
+    if size == "base":
+        config = CLIPConfig(projection_dim=512)
+    else:
+        config = CLIPConfig(
+            text_config={"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+                         "num_attention_heads": 2},
+            vision_config={"hidden_size": 128, "intermediate_size": 256, "num_hidden_layers": 4,
+                           "num_attention_heads": 4, "image_size": 224, "patch_size": 32},
+            projection_dim=64,
+        )
+    return CLIPModel(config).eval(), _HashingClipProcessor(CLIPImageProcessor(), config)
+
+
+def _per_image_loop(model: Any, image_processor: Any, paths: Sequence[Path]) -> np.ndarray:
+    """The notebook's path: open, preprocess and embed one image at a time."""
+    vectors = []
+    for path in paths:
+        inputs = image_processor(images=Image.open(path).convert("RGB"), return_tensors="pt")
+        with torch.no_grad():
+            features = model.get_image_features(**inputs)
+        vectors.append(_normalize(features)[0])
+    return np.stack(vectors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-image vs batched CLIP image embedding throughput")
+    parser.add_argument("--images", type=int, default=128, help="listing images to embed (sample PNGs repeated)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32")
+    parser.add_argument("--model", default=None, help="e.g. openai/clip-vit-base-patch32 (default: random weights)")
+    parser.add_argument("--random-size", choices=["tiny", "base"], default="base",
+                        help="shape of the random CLIP used without --model")
+    args = parser.parse_args()
+
+    if args.model:
+        from transformers import CLIPModel, CLIPProcessor
+
+        model, processor = CLIPModel.from_pretrained(args.model).eval(), CLIPProcessor.from_pretrained(args.model)
+        image_processor = processor.image_processor
+    else:
+        model, processor = random_clip(args.random_size)
+        image_processor = processor.image_processor
+
+    samples = sorted((Path(__file__).resolve().parent / "listings" / "images").glob("*.png"))
+    paths = [samples[index % len(samples)] for index in range(args.images)]
+
+    start = time.perf_counter()
+    reference = _per_image_loop(model, image_processor, paths)
+    loop_s = time.perf_counter() - start
+    print(f"per-image loop        {args.images / loop_s:7.1f} img/s")
+
+    for batch_size in args.batch_sizes:
+        embedder = ClipEmbedder(model, processor, batch_size=batch_size, num_workers=args.workers,
+                                precision=args.precision)
+        start = time.perf_counter()
+        vectors = embedder.embed_images(paths)
+        batched_s = time.perf_counter() - start
+        cosine = float(np.min(np.sum(vectors * reference, axis=1)))
+        print(f"batch_size={batch_size:<4d}       {args.images / batched_s:7.1f} img/s "
+              f"(x{loop_s / batched_s:.2f}, min cosine vs loop {cosine:.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Incremental HomeMatch vector stores.
+
+The notebook's original ``build_text_vector_store`` and ``ImageVectorIndex.build``
+deleted their Chroma directory and re-embedded every listing on every run; when the
+delete failed (a Windows file lock) they wrote a fresh ``text-chroma-<uuid>`` /
+``image-chroma-<uuid>`` directory next to it and left it behind.
+
+The sync functions here keep one persistent collection per store, keyed by
+``listing_id``. Every record carries a ``fingerprint`` in its metadata: a hash of
+exactly what was embedded (the document text and metadata, plus the image bytes for
+the CLIP store). A sync compares fingerprints, then:
+
+- embeds and upserts only new or changed listings,
+- deletes IDs that are no longer in the feed,
+- leaves unchanged listings alone (no embedding call at all).
+
+A restart over an unchanged feed therefore only reads IDs and metadata back from
+Chroma. Stores written by the old code (random document IDs, no fingerprints) are
+migrated on the first sync: their records are replaced by ``listing_id``-keyed ones.
+
+``HomeMatch.ipynb`` builds its stores this way (text store in the embeddings cell,
+CLIP index in the image cell, ``clip`` being its ``clip_embedding.ClipEmbedder``):
+
+    from listing_index import remove_stale_store_dirs, sync_image_index, sync_text_store
+    remove_stale_store_dirs(VECTOR_DB_DIR)
+    text_store, report = sync_text_store(listings, text_embedder, TEXT_VECTOR_DIR)
+    collection, report = sync_image_index(listings, clip.embed_images, IMAGE_VECTOR_DIR,
+                                          model_name=CLIP_MODEL_NAME)
+    image_index = ImageVectorIndex(collection)
+"""
+
+import hashlib
+import json
+import re
+import shutil
+import textwrap
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TEXT_COLLECTION = "langchain"
+IMAGE_COLLECTION = "listing_images"
+# Directories left behind by the old rmtree fallback, e.g. text-chroma-1a2b3c4d
+STALE_STORE_PATTERN = re.compile(r"^(text|image)-chroma-[0-9a-f]{8}$")
+SYNC_BATCH_SIZE = 64
+
+
+@dataclass
+class SyncReport:
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    skipped: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def embedded(self) -> int:
+        return len(self.added) + len(self.updated)
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.updated)} updated, {len(self.deleted)} deleted, "
+            f"{self.unchanged} unchanged, {len(self.skipped)} skipped in {self.seconds:.2f}s"
+        )
+
+
+def _hash(*parts: Any) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def listing_document(listing: Any) -> Tuple[str, Dict[str, Any]]:
+    """Page content and metadata of a listing, exactly as the notebook's old ``build_text_vector_store`` built them."""
+    content = textwrap.dedent(f"""
+    Listing {listing.listing_id} in {listing.city} ({listing.neighborhood}).
+    Bedrooms/Bathrooms: {listing.bedrooms}/{listing.bathrooms}, size {listing.size_sqft} sqft.
+    Amenities: {', '.join(listing.amenities)}.
+    Technology: {', '.join(listing.technology_features)}.
+    Transit: {', '.join(listing.transit)}.
+    Description: {listing.description}
+    Neighborhood: {listing.neighborhood_description}
+    Vibes: {', '.join(listing.vibe_tags)}
+    """).strip()
+    metadata = {
+        "listing_id": listing.listing_id,
+        "city": listing.city,
+        "neighborhood": listing.neighborhood,
+        "beds": listing.bedrooms,
+        "baths": listing.bathrooms,
+        "price": listing.price,
+        "currency": listing.currency,
+    }
+    return content, metadata
+
+
+def image_metadata(listing: Any) -> Dict[str, Any]:
+    return {
+        "listing_id": listing.listing_id,
+        "city": listing.city,
+        "neighborhood": listing.neighborhood,
+        "image_path": listing.image_path,
+    }
+
+
+def text_fingerprint(listing: Any, embedder_name: str = "") -> str:
+    content, metadata = listing_document(listing)
+    return _hash("text", embedder_name, content, metadata)
+
+
+def image_fingerprint(listing: Any, model_name: str = "") -> Optional[str]:
+    """Hash of the image bytes, visual prompt and metadata; None when the listing has no readable image."""
+    if not listing.image_path:
+        return None
+    try:
+        image_bytes = Path(listing.image_path).read_bytes()
+    except OSError:
+        return None
+    return _hash("image", model_name, image_bytes, listing.visual_prompt, image_metadata(listing))
+
+
+def listing_fingerprint(listing: Any) -> str:
+    """Content hash of a whole listing (every field plus its image bytes), e.g. for caches keyed by listing."""
+    if hasattr(listing, "model_dump"):
+        data = listing.model_dump()
+    elif hasattr(listing, "dict"):
+        data = listing.dict()
+    else:
+        data = dict(vars(listing))
+    image_bytes = b""
+    if getattr(listing, "image_path", None):
+        try:
+            image_bytes = Path(listing.image_path).read_bytes()
+        except OSError:
+            pass
+    return _hash("listing", data, image_bytes)
+
+
+def _existing_fingerprints(collection: Any) -> Dict[str, Optional[str]]:
+    records = collection.get(include=["metadatas"])
+    return {
+        record_id: (metadata or {}).get("fingerprint")
+        for record_id, metadata in zip(records["ids"], records["metadatas"] or [None] * len(records["ids"]))
+    }
+
+
+def _batches(items: Sequence[Any], size: int) -> Iterable[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _plan(collection: Any, fingerprints: Dict[str, str], report: SyncReport) -> List[str]:
+    """IDs to (re-)embed; removed IDs are deleted from `collection` right away."""
+    existing = _existing_fingerprints(collection)
+    stale = [record_id for record_id in existing if record_id not in fingerprints]
+    if stale:
+        collection.delete(ids=stale)
+        report.deleted.extend(stale)
+
+    todo = []
+    for listing_id, fingerprint in fingerprints.items():
+        if listing_id not in existing:
+            report.added.append(listing_id)
+        elif existing[listing_id] != fingerprint:
+            report.updated.append(listing_id)
+        else:
+            report.unchanged += 1
+            continue
+        todo.append(listing_id)
+    return todo
+
+
+def _unique_listings(listings: Iterable[Any]) -> Dict[str, Any]:
+    # Later duplicates of an ID win, like repeated writes would
+    return {listing.listing_id: listing for listing in listings}
+
+
+def sync_text_collection(
+    listings: Iterable[Any],
+    collection: Any,
+    embed_documents: Callable[[List[str]], Sequence[Sequence[float]]],
+    embedder_name: str = "",
+    batch_size: int = SYNC_BATCH_SIZE,
+) -> SyncReport:
+    """Bring a Chroma collection of listing documents in line with `listings`."""
+    start = time.perf_counter()
+    report = SyncReport()
+    by_id = _unique_listings(listings)
+    fingerprints = {listing_id: text_fingerprint(listing, embedder_name) for listing_id, listing in by_id.items()}
+
+    todo = _plan(collection, fingerprints, report)
+    for chunk in _batches(todo, batch_size):
+        documents, metadatas = [], []
+        for listing_id in chunk:
+            content, metadata = listing_document(by_id[listing_id])
+            documents.append(content)
+            metadatas.append({**metadata, "fingerprint": fingerprints[listing_id]})
+        embeddings = [list(map(float, vector)) for vector in embed_documents(documents)]
+        collection.upsert(ids=list(chunk), embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def sync_image_collection(
+    listings: Iterable[Any],
+    collection: Any,
+    embed_images: Callable[[List[str]], Sequence[Sequence[float]]],
+    model_name: str = "",
+    batch_size: int = SYNC_BATCH_SIZE,
+) -> SyncReport:
+    """Bring a Chroma collection of CLIP image vectors in line with `listings` (listings without images are skipped).
+
+    ``embed_images`` receives the image paths of a batch, so it can decode them in parallel.
+    """
+    start = time.perf_counter()
+    report = SyncReport()
+    by_id = _unique_listings(listings)
+    fingerprints = {}
+    for listing_id, listing in by_id.items():
+        fingerprint = image_fingerprint(listing, model_name)
+        if fingerprint is None:
+            report.skipped.append(listing_id)
+        else:
+            fingerprints[listing_id] = fingerprint
+
+    todo = _plan(collection, fingerprints, report)
+    for chunk in _batches(todo, batch_size):
+        paths = [by_id[listing_id].image_path for listing_id in chunk]
+        vectors = np.asarray(embed_images(paths), dtype=np.float32)
+        collection.upsert(
+            ids=list(chunk),
+            embeddings=vectors.tolist(),
+            metadatas=[{**image_metadata(by_id[listing_id]), "fingerprint": fingerprints[listing_id]}
+                       for listing_id in chunk],
+            documents=[by_id[listing_id].visual_prompt for listing_id in chunk],
+        )
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def _embedder_name(embedder: Any) -> str:
+    return str(getattr(embedder, "model_name", None) or getattr(embedder, "name", None) or type(embedder).__name__)
+
+
+def sync_text_store(
+    listings: Iterable[Any],
+    embedder: Any,
+    persist_dir: Path,
+    collection_name: str = TEXT_COLLECTION,
+) -> Tuple[Any, SyncReport]:
+    """(LangChain ``Chroma`` store, report) over a persistent collection synced with `listings`.
+
+    ``embedder`` is a LangChain embeddings object such as the notebook's
+    ``HuggingFaceEmbeddings``; its model name is part of every fingerprint, so
+    switching models re-embeds everything once.
+    """
+    import chromadb
+
+    try:
+        from langchain_community.vectorstores import Chroma
+    except ImportError:
+        from langchain.vectorstores import Chroma
+
+    Path(persist_dir).mkdir(parents=True, exist_ok=True)
+    client = chromadb.PersistentClient(path=str(persist_dir))
+    collection = client.get_or_create_collection(collection_name)
+    report = sync_text_collection(listings, collection, embedder.embed_documents, _embedder_name(embedder))
+    store = Chroma(client=client, collection_name=collection_name, embedding_function=embedder)
+    return store, report
+
+
+def sync_image_index(
+    listings: Iterable[Any],
+    embed_images: Callable[[List[str]], Sequence[Sequence[float]]],
+    persist_dir: Path,
+    collection_name: str = IMAGE_COLLECTION,
+    model_name: str = "openai/clip-vit-base-patch32",
+) -> Tuple[Any, SyncReport]:
+    """(Chroma collection for ``ImageVectorIndex``, report) synced with `listings`."""
+    import chromadb
+
+    Path(persist_dir).mkdir(parents=True, exist_ok=True)
+    client = chromadb.PersistentClient(path=str(persist_dir))
+    collection = client.get_or_create_collection(collection_name)
+    report = sync_image_collection(listings, collection, embed_images, model_name)
+    return collection, report
+
+
+def remove_stale_store_dirs(vector_db_dir: Path, dry_run: bool = False) -> List[Path]:
+    """Delete ``text-chroma-<hex>`` / ``image-chroma-<hex>`` leftovers of the old rebuild fallback.
+
+    Directories that are still locked are left in place and retried next time.
+    """
+    removed = []
+    for path in sorted(Path(vector_db_dir).glob("*-chroma-*")):
+        if not path.is_dir() or not STALE_STORE_PATTERN.match(path.name):
+            continue
+        if not dry_run:
+            try:
+                shutil.rmtree(path)
+            except OSError as exc:
+                print(f"Warning: could not remove {path} ({exc}); will retry on the next run.")
+                continue
+        removed.append(path)
+    return removed
@@ -0,0 +1,419 @@
+"""Concurrent, cached LLM narratives for HomeMatch recommendations.
+
+The notebook's original ``personalize_recommendations`` called
+``personalize_listing_description`` once per listing, one blocking ``llm.invoke``
+after another, so ``top_k=12`` cost twelve serial round trips. The version here,
+which ``HomeMatch.ipynb`` now imports together with the prompt and fact sheet:
+
+- serves narratives from ``NarrativeCache``, a SQLite table keyed on
+  ``(listing fact sheet, profile fingerprint, model, prompt template)``, so a
+  repeated recommendation needs no LLM call and any change to one of the four
+  produces a fresh narrative (listing fields the prompt never sees, such as the
+  image, do not invalidate it),
+- sends the cache misses to the LLM from a bounded thread pool,
+- retries rate limits, timeouts and 5xx errors with full-jitter exponential
+  backoff.
+
+``ChatOpenAI`` already retries inside the OpenAI client (``max_retries=2`` by
+default), so each of our attempts can be up to three requests and the two backoffs
+stack. Build the client with ``max_retries=0`` to leave retrying to
+``personalize_recommendations`` alone.
+
+Results keep the notebook's order and dict layout. ``build_fact_sheet`` and
+``default_prompt`` are the single definitions of what the LLM is sent, so the cache
+key cannot drift from the request. In the notebook:
+
+    from personalization import NarrativeCache, default_prompt, personalize_recommendations
+    personalize_prompt = default_prompt()
+    narrative_cache = NarrativeCache(VECTOR_DB_DIR / "narratives.sqlite3")
+    narrative_llm = maybe_build_llm(max_retries=0)
+    personalized = personalize_recommendations(
+        ranked_results, high_tech_profile, narrative_llm, top_k=12, prompt=personalize_prompt,
+        cache=narrative_cache)
+
+Running this file exercises the path offline with ``FakeLLM`` (injected latency and
+rate-limit failures):
+
+    python personalization.py --top-k 12 --latency 0.5 --failure-rate 0.2
+"""
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import random
+import sqlite3
+import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+# Messages of the notebook's ``personalize_prompt`` (built by ``default_prompt``)
+PERSONALIZE_MESSAGES = [
+    ("system", "You are a detail-oriented real-estate concierge. Personalize listings without inventing facts."),
+    ("human", "Buyer persona: {persona}. Preferences: {preferences}. Listing facts: {facts}. "
+              "Compose a vivid but factual blurb (120-160 words)."),
+]
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APIConnectionError", "APITimeoutError", "Timeout", "InternalServerError"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS narratives (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    narrative TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS narratives_last_access ON narratives (last_access);
+"""
+
+
+class RetryError(RuntimeError):
+    """Raised when an LLM call keeps failing after every retry attempt."""
+
+
+def _digest(payload: Any) -> str:
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def profile_fingerprint(profile: Any) -> str:
+    """Content hash of a ``PreferenceProfile`` (every field)."""
+    data = dataclasses.asdict(profile) if dataclasses.is_dataclass(profile) else dict(vars(profile))
+    return _digest(["profile", data])
+
+
+def prompt_fingerprint(prompt: Any) -> str:
+    """Hash of a prompt's message templates (a LangChain ``ChatPromptTemplate`` or ``TuplePrompt``)."""
+    messages = getattr(prompt, "messages", None)
+    if messages is None:
+        return _digest(["prompt", repr(prompt)])
+    parts = []
+    for message in messages:
+        if isinstance(message, tuple):
+            parts.append(list(message))
+        else:
+            template = getattr(getattr(message, "prompt", None), "template", None)
+            parts.append([type(message).__name__, template if template is not None else repr(message)])
+    return _digest(["prompt", parts])
+
+
+def model_identity(llm: Any) -> str:
+    """Model name plus temperature, e.g. ``gpt-3.5-turbo@0.2``."""
+    name = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    return f"{name}@{getattr(llm, 'temperature', None)}"
+
+
+def narrative_key(listing: Any, profile: Any, model: str, prompt: Any) -> str:
+    """Cache key over exactly what the prompt is filled with: the fact sheet, profile, model and template."""
+    return _digest(["narrative", build_fact_sheet(listing), profile_fingerprint(profile), model,
+                    prompt_fingerprint(prompt)])
+
+
+class TuplePrompt:
+    """Stand-in for ``ChatPromptTemplate.from_messages`` that formats to ``(role, content)`` tuples.
+
+    LangChain chat models accept these tuples as messages, so it works with
+    ``ChatOpenAI`` too when ``langchain_core`` is not installed.
+    """
+
+    def __init__(self, messages: Sequence[tuple]) -> None:
+        self.messages = list(messages)
+
+    def format_messages(self, **values: Any) -> List[tuple]:
+        return [(role, template.format(**values)) for role, template in self.messages]
+
+
+def default_prompt() -> Any:
+    """The notebook's ``personalize_prompt``: a ``ChatPromptTemplate`` of ``PERSONALIZE_MESSAGES``."""
+    try:
+        from langchain_core.prompts import ChatPromptTemplate
+    except ImportError:
+        return TuplePrompt(PERSONALIZE_MESSAGES)
+    return ChatPromptTemplate.from_messages(PERSONALIZE_MESSAGES)
+
+
+class NarrativeCache:
+    """SQLite cache of generated narratives with least-recently-used eviction and hit/miss counters."""
+
+    def __init__(self, path: Union[str, Path] = ":memory:", max_entries: int = 5000) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL" if str(path) != ":memory:" else "PRAGMA journal_mode=MEMORY")
+        self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT narrative FROM narratives WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE narratives SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, narrative: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO narratives (key, model, narrative, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, narrative, now, now),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM narratives").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM narratives WHERE key IN "
+                    "(SELECT key FROM narratives ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM narratives")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM narratives").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Rate limits, timeouts and 5xx responses are worth retrying; everything else is not."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    for attr in ("status_code", "http_status", "status"):
+        status = getattr(exc, attr, None)
+        if isinstance(status, int):
+            return status in RETRYABLE_STATUS_CODES
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def call_with_retries(
+    call: Callable[[], Any],
+    max_retries: int = 4,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    rng: Optional[random.Random] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Any:
+    """``call()``, retrying retryable errors after full-jitter exponential backoff."""
+    rng = rng or random.Random()
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except Exception as exc:
+            if not is_retryable(exc):
+                raise
+            if attempt == max_retries:
+                raise RetryError(f"LLM call failed after {attempt + 1} attempts: {exc}") from exc
+            sleep(rng.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+    raise AssertionError("unreachable")
+
+
+def build_fact_sheet(listing: Any) -> str:
+    """Listing facts for the prompt; the notebook imports this one."""
+    return textwrap.dedent(
+        f"""
+        Listing {listing.listing_id} - {listing.city}, {listing.neighborhood}
+        Price: {listing.price:,.0f} {listing.currency}; Size: {listing.size_sqft} sqft; Bedrooms/Baths: {listing.bedrooms}/{listing.bathrooms}
+        Amenities: {', '.join(listing.amenities)}
+        Transit: {', '.join(listing.transit)}
+        Technology: {', '.join(listing.technology_features)}
+        Neighborhood vibe: {listing.neighborhood_description}
+        Core description: {listing.description}
+        Visual prompt: {listing.visual_prompt}
+        """
+    ).strip()
+
+
+def fallback_narrative(listing: Any, profile: Any) -> str:
+    """The notebook's template narrative, used without an LLM."""
+    return textwrap.dedent(
+        f"""{listing.neighborhood} keeps you {profile.transit_story.lower()}. {listing.description} The tech stack ({', '.join(listing.technology_features[:3])}) pairs with {', '.join(listing.amenities[:2])} so you can bounce between {', '.join(profile.cultural_musts[:3])}."""
+    ).strip()
+
+
+def personalize_listing_description(listing: Any, profile: Any, llm: Any, prompt: Any = None) -> str:
+    """One narrative with a single LLM call (no cache, no retries)."""
+    if llm is None:
+        return fallback_narrative(listing, profile)
+    prompt = prompt or default_prompt()
+    response = llm.invoke(prompt.format_messages(
+        persona=profile.persona_name,
+        preferences=profile.summary + " | " + ", ".join(profile.priorities),
+        facts=build_fact_sheet(listing),
+    ))
+    return response.content.strip()
+
+
+def personalize_recommendations(
+    ranked_results: List[Dict[str, Any]],
+    profile: Any,
+    llm: Any,
+    top_k: int = 3,
+    prompt: Any = None,
+    cache: Optional[NarrativeCache] = None,
+    max_workers: int = 4,
+    max_retries: int = 4,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    fallback_on_error: bool = False,
+) -> List[Dict[str, Any]]:
+    """Narratives for the top ``top_k`` results, with cached, concurrent LLM calls.
+
+    At most ``max_workers`` requests are in flight. A listing whose call still fails
+    after ``max_retries`` (or with a non-retryable error) raises, or gets the template
+    narrative when ``fallback_on_error`` is set. Only LLM narratives are cached.
+    These retries come on top of the client's own (see the module docstring); pass
+    ``max_retries=0`` here or to ``ChatOpenAI`` so only one layer retries.
+    """
+    prompt = prompt or default_prompt()
+    selected = ranked_results[:top_k]
+    narratives: List[Optional[str]] = [None] * len(selected)
+    model = model_identity(llm)
+    keys = [None] * len(selected)
+    pending = []
+    for position, result in enumerate(selected):
+        listing = result["listing"]
+        if llm is None:
+            narratives[position] = fallback_narrative(listing, profile)
+            continue
+        if cache is not None:
+            keys[position] = narrative_key(listing, profile, model, prompt)
+            narratives[position] = cache.get(keys[position])
+        if narratives[position] is None:
+            pending.append(position)
+
+    def generate(position: int) -> str:
+        listing = selected[position]["listing"]
+        try:
+            narrative = call_with_retries(
+                lambda: personalize_listing_description(listing, profile, llm, prompt),
+                max_retries, base_delay, max_delay,
+            )
+        except Exception:
+            if not fallback_on_error:
+                raise
+            return fallback_narrative(listing, profile)
+        if cache is not None:
+            cache.put(keys[position], model, narrative)
+        return narrative
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending))),
+                                thread_name_prefix="personalize") as pool:
+            for position, narrative in zip(pending, pool.map(generate, pending)):
+                narratives[position] = narrative
+
+    return [
+        {
+            "listing_id": result["listing"].listing_id,
+            "city": result["listing"].city,
+            "score": round(result["score"], 3),
+            "narrative": narrative,
+        }
+        for result, narrative in zip(selected, narratives)
+    ]
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeLLM:
+    """Chat-model stand-in for offline runs: ``invoke`` sleeps `latency` (+ jitter) and fails at `failure_rate` with a 429."""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, failure_rate: float = 0.0,
+                 model_name: str = "fake-chat", temperature: float = 0.2, seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.model_name = model_name
+        self.temperature = temperature
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def invoke(self, messages: Any) -> Any:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            failed = self._rng.random() < self.failure_rate
+            self.failures += failed
+        time.sleep(delay)
+        if failed:
+            raise FakeRateLimitError("429 Too Many Requests (injected)")
+        facts = messages[-1][1] if isinstance(messages[-1], tuple) else getattr(messages[-1], "content", "")
+        return SimpleNamespace(content=f"[{self.model_name}] {facts[:120]}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sequential vs concurrent, cached listing narratives with a fake LLM")
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="share of calls failing with a 429")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from batch_matching import synthetic_profiles
+    from ranking import synthetic_listings
+
+    listings = synthetic_listings(args.top_k)
+    ranked = [{"listing": listing, "score": 1.0 - position / 100} for position, listing in enumerate(listings)]
+    profile = synthetic_profiles(1)[0]
+    retry = {"base_delay": 0.2, "max_delay": 2.0}
+
+    llm = FakeLLM(args.latency, failure_rate=args.failure_rate, seed=args.seed)
+    start = time.perf_counter()
+    personalize_recommendations(ranked, profile, llm, args.top_k, max_workers=1, **retry)
+    print(f"sequential          {time.perf_counter() - start:6.2f}s  ({llm.calls} calls, {llm.failures} failed)")
+
+    cache = NarrativeCache()
+    llm = FakeLLM(args.latency, failure_rate=args.failure_rate, seed=args.seed)
+    start = time.perf_counter()
+    cold = personalize_recommendations(ranked, profile, llm, args.top_k, cache=cache, max_workers=args.workers,
+                                       **retry)
+    print(f"concurrent, cold    {time.perf_counter() - start:6.2f}s  ({llm.calls} calls, {llm.failures} failed)")
+
+    start = time.perf_counter()
+    warm = personalize_recommendations(ranked, profile, llm, args.top_k, cache=cache, max_workers=args.workers,
+                                       **retry)
+    print(f"concurrent, warm    {time.perf_counter() - start:6.2f}s  ({llm.calls} calls total, "
+          f"identical: {warm == cold})")
+
+    changed = dataclasses.replace(profile, priorities=profile.priorities[:2])
+    start = time.perf_counter()
+    personalize_recommendations(ranked, changed, llm, args.top_k, cache=cache, max_workers=args.workers, **retry)
+    print(f"changed profile     {time.perf_counter() - start:6.2f}s  (misses again; {llm.calls} calls total)")
+    print(f"cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""Single-pass fused text + CLIP ranking for HomeMatch.
+
+The notebook's original ``run_multimodal_search`` asked the Chroma text store and
+``ImageVectorIndex`` for their top ``2 * top_k`` hits each, merged the two lists in a
+dict and sorted. A listing that ranked well overall but missed one of the two lists
+got 0 for that modality or was dropped entirely, and every search paid two
+round trips. ``HomeMatch.ipynb`` now uses the version here.
+
+``FusedIndex`` keeps both vector sets in memory as NumPy matrices whose rows line up
+with ``listing_ids``. A search scores every candidate in one vectorised pass and
+picks the top ``k`` with ``argpartition``. City, price and bedroom filters are
+boolean masks applied before scoring.
+
+Scores use the notebook's conventions, so fused scores are on the same scale:
+
+- text: LangChain's Chroma relevance for the default l2 space, ``1 - d / sqrt(2)``,
+- image: ``ImageVectorIndex.search``'s ``1 / (1 + d)``,
+
+where ``d`` is Chroma's squared L2 distance. A listing without an image (or
+without a text vector) scores 0 for that modality, as when the notebook misses it.
+
+In the notebook, after the vector stores are synced (see ``listing_index``):
+
+    from ranking import FusedIndex, run_multimodal_search
+    fused_index = FusedIndex.from_collections(listings, text_store._collection, image_collection)
+    ranked_results = run_multimodal_search(
+        high_tech_profile, fused_index, text_embedder.embed_query, compute_text_embedding, top_k=12)
+
+Keyword filters such as ``cities=["Berlin"], max_price=1_500_000`` narrow the candidates.
+
+Running this file times the engine against the two-list merge on a synthetic
+inventory:
+
+    python ranking.py --listings 20000 --queries 200
+"""
+
+import argparse
+import json
+import math
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from listing_index import listing_document
+
+SQRT2 = math.sqrt(2)
+
+
+def text_relevance(squared_distance: np.ndarray) -> np.ndarray:
+    """LangChain's relevance score for Chroma's l2 space (``similarity_search_with_relevance_scores``)."""
+    return 1.0 - squared_distance / SQRT2
+
+
+def image_relevance(squared_distance: np.ndarray) -> np.ndarray:
+    """``ImageVectorIndex.search``'s score."""
+    return 1.0 / (1.0 + squared_distance)
+
+
+def _as_matrix(vectors: Any, count: int) -> np.ndarray:
+    matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    if matrix.ndim != 2 or matrix.shape[0] != count:
+        raise ValueError(f"expected a ({count}, dim) matrix, got shape {matrix.shape}")
+    return matrix
+
+
+def _squared_l2(matrix: np.ndarray, squared_norms: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """(m, n) squared L2 distances between `queries` (m, dim) and the rows of `matrix` (n, dim)."""
+    distances = squared_norms[None, :] + np.einsum("ij,ij->i", queries, queries)[:, None] - 2.0 * (queries @ matrix.T)
+    return np.maximum(distances, 0.0)
+
+
+def _modality_scores(
+    matrix: np.ndarray,
+    squared_norms: np.ndarray,
+    present: np.ndarray,
+    queries: np.ndarray,
+    relevance: Callable[[np.ndarray], np.ndarray],
+) -> np.ndarray:
+    """(m, n) relevance of `queries` to the rows of `matrix`; 0 where a row has no vector."""
+    if not present.any():
+        # No stored vector at all (no images, an empty collection): `matrix` is a zero-width
+        # placeholder that cannot be compared with the queries, and every score is 0 anyway
+        return np.zeros((queries.shape[0], matrix.shape[0]))
+    return np.where(present, relevance(_squared_l2(matrix, squared_norms, queries)), 0.0)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` largest `scores`, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class FusedIndex:
+    """Text and CLIP vectors of the inventory as aligned matrices, ranked in one pass.
+
+    Row ``i`` of ``text_vectors`` / ``image_vectors`` belongs to ``listings[i]``;
+    ``has_text`` / ``has_image`` mark the rows that hold a real vector.
+    """
+
+    def __init__(
+        self,
+        listings: Sequence[Any],
+        text_vectors: Any,
+        image_vectors: Any,
+        has_text: Optional[Sequence[bool]] = None,
+        has_image: Optional[Sequence[bool]] = None,
+    ) -> None:
+        self.listings = list(listings)
+        self.listing_ids = [listing.listing_id for listing in self.listings]
+        self.positions = {listing_id: row for row, listing_id in enumerate(self.listing_ids)}
+        if len(self.positions) != len(self.listing_ids):
+            raise ValueError("listing IDs must be unique")
+        count = len(self.listings)
+        self.text_vectors = _as_matrix(text_vectors, count)
+        self.image_vectors = _as_matrix(image_vectors, count)
+        self.has_text = np.ones(count, dtype=bool) if has_text is None else np.asarray(has_text, dtype=bool)
+        self.has_image = np.ones(count, dtype=bool) if has_image is None else np.asarray(has_image, dtype=bool)
+        self._text_norms = np.einsum("ij,ij->i", self.text_vectors, self.text_vectors)
+        self._image_norms = np.einsum("ij,ij->i", self.image_vectors, self.image_vectors)
+        # Filter columns; cities compare case-insensitively
+        self.cities = np.array([listing.city.casefold() for listing in self.listings], dtype=object)
+        self.prices = np.array([listing.price for listing in self.listings], dtype=np.float64)
+        self.bedrooms = np.array([listing.bedrooms for listing in self.listings], dtype=np.int64)
+        self.metadata = [listing_document(listing)[1] for listing in self.listings]
+
+    def __len__(self) -> int:
+        return len(self.listings)
+
+    @classmethod
+    def from_embedders(
+        cls,
+        listings: Iterable[Any],
+        embed_documents: Callable[[List[str]], Sequence[Sequence[float]]],
+        embed_images: Callable[[List[str]], Sequence[Sequence[float]]],
+    ) -> "FusedIndex":
+        """Embed `listings` directly, e.g. with ``text_embedder.embed_documents`` and ``ClipEmbedder.embed_images``."""
+        listings = list(listings)
+        text_vectors = np.asarray(embed_documents([listing_document(listing)[0] for listing in listings]),
+                                  dtype=np.float32)
+        has_image = np.array([bool(listing.image_path) and Path(listing.image_path).is_file()
+                              for listing in listings])
+        paths = [listing.image_path for listing, present in zip(listings, has_image) if present]
+        embedded = np.asarray(embed_images(paths), dtype=np.float32) if paths else None
+        image_vectors = np.zeros((len(listings), embedded.shape[1] if embedded is not None else 1), dtype=np.float32)
+        if embedded is not None:
+            image_vectors[has_image] = embedded
+        return cls(listings, text_vectors, image_vectors, has_image=has_image)
+
+    @classmethod
+    def from_collections(cls, listings: Iterable[Any], text_collection: Any, image_collection: Any) -> "FusedIndex":
+        """Load the vectors already stored in the Chroma collections kept by ``listing_index``, keyed by ``listing_id``."""
+        listings = list(listings)
+        text_vectors, has_text = cls._collection_vectors(text_collection, listings)
+        image_vectors, has_image = cls._collection_vectors(image_collection, listings)
+        return cls(listings, text_vectors, image_vectors, has_text=has_text, has_image=has_image)
+
+    @staticmethod
+    def _collection_vectors(collection: Any, listings: Sequence[Any]) -> tuple:
+        records = collection.get(ids=[listing.listing_id for listing in listings], include=["embeddings"])
+        by_id = dict(zip(records["ids"], records["embeddings"]))
+        dim = len(next(iter(by_id.values()))) if by_id else 1
+        vectors = np.zeros((len(listings), dim), dtype=np.float32)
+        present = np.zeros(len(listings), dtype=bool)
+        for row, listing in enumerate(listings):
+            vector = by_id.get(listing.listing_id)
+            if vector is not None:
+                vectors[row] = vector
+                present[row] = True
+        return vectors, present
+
+    def filter_mask(
+        self,
+        cities: Optional[Iterable[str]] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_bedrooms: Optional[int] = None,
+        max_bedrooms: Optional[int] = None,
+    ) -> Optional[np.ndarray]:
+        """Boolean mask of the listings passing every given filter; None when no filter is set."""
+        mask = None
+
+        def narrow(condition: np.ndarray) -> None:
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if cities is not None:
+            narrow(np.isin(self.cities, [city.casefold() for city in cities]))
+        if min_price is not None:
+            narrow(self.prices >= min_price)
+        if max_price is not None:
+            narrow(self.prices <= max_price)
+        if min_bedrooms is not None:
+            narrow(self.bedrooms >= min_bedrooms)
+        if max_bedrooms is not None:
+            narrow(self.bedrooms <= max_bedrooms)
+        return mask
+
+    def score(
+        self,
+        text_queries: Any,
+        image_queries: Any,
+        weight_text: float = 0.65,
+        rows: Optional[np.ndarray] = None,
+    ) -> tuple:
+        """(text, image, fused) score matrices of shape (m, len(rows)) for m query pairs.
+
+        `rows` restricts scoring to those listing rows (all rows when None).
+        """
+        text_queries = np.atleast_2d(np.asarray(text_queries, dtype=np.float32))
+        image_queries = np.atleast_2d(np.asarray(image_queries, dtype=np.float32))
+        if rows is None:
+            text_matrix, text_norms, has_text = self.text_vectors, self._text_norms, self.has_text
+            image_matrix, image_norms, has_image = self.image_vectors, self._image_norms, self.has_image
+        else:
+            text_matrix, text_norms, has_text = self.text_vectors[rows], self._text_norms[rows], self.has_text[rows]
+            image_matrix, image_norms, has_image = self.image_vectors[rows], self._image_norms[rows], self.has_image[rows]
+        text_scores = _modality_scores(text_matrix, text_norms, has_text, text_queries, text_relevance)
+        image_scores = _modality_scores(image_matrix, image_norms, has_image, image_queries, image_relevance)
+        fused = weight_text * text_scores + (1 - weight_text) * image_scores
+        return text_scores, image_scores, fused
+
+    def search(
+        self,
+        text_query: Any,
+        image_query: Any,
+        top_k: int = 5,
+        weight_text: float = 0.65,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top `top_k` listings by fused score, as ``run_multimodal_search`` result dicts."""
+        rows = None if mask is None else np.flatnonzero(mask)
+        text_scores, image_scores, fused = self.score(text_query, image_query, weight_text, rows)
+        return self.format_results(text_scores[0], image_scores[0], fused[0], rows, top_k_indices(fused[0], top_k))
+
+    def format_results(
+        self,
+        text_scores: np.ndarray,
+        image_scores: np.ndarray,
+        fused: np.ndarray,
+        rows: Optional[np.ndarray],
+        columns: Iterable[int],
+    ) -> List[Dict[str, Any]]:
+        """Result dicts for `columns` of one query's score vectors (scored over `rows`, or all rows when None)."""
+        results = []
+        for column in columns:
+            row = int(column if rows is None else rows[column])
+            results.append({
+                "text_score": float(text_scores[column]),
+                "image_score": float(image_scores[column]),
+                "metadata": self.metadata[row],
+                "score": float(fused[column]),
+                "listing": self.listings[row],
+            })
+        return results
+
+
+def run_multimodal_search(
+    profile: Any,
+    index: FusedIndex,
+    embed_text_query: Callable[[str], Sequence[float]],
+    embed_image_query: Callable[[str], Sequence[float]],
+    top_k: int = 5,
+    weight_text: float = 0.65,
+    **filters: Any,
+) -> List[Dict[str, Any]]:
+    """Fused top ``top_k`` listings for `profile`, with optional ``FusedIndex.filter_mask`` filters.
+
+    ``embed_text_query`` is the text store's embedder (``text_embedder.embed_query``),
+    ``embed_image_query`` CLIP's text tower (``compute_text_embedding`` or
+    ``ClipEmbedder.embed_query``).
+    """
+    return index.search(
+        embed_text_query(profile.to_text_query()),
+        embed_image_query(profile.visual_prompt),
+        top_k=top_k,
+        weight_text=weight_text,
+        mask=index.filter_mask(**filters),
+    )
+
+
+def synthetic_listings(count: int, seed: int = 0) -> List[Any]:
+    """`count` variants of ``listings/listings.json`` with shuffled cities, prices and bedrooms, for benchmarks."""
+    rng = np.random.default_rng(seed)
+    base = json.loads((Path(__file__).resolve().parent / "listings" / "listings.json").read_text(encoding="utf-8"))
+    cities = sorted({raw["city"] for raw in base}) + ["Osaka", "Hamburg", "Seoul", "Lisbon"]
+    listings = []
+    for number in range(count):
+        raw = dict(base[number % len(base)])
+        raw.update(
+            listing_id=f"{raw['listing_id']}-{number:06d}",
+            city=cities[int(rng.integers(len(cities)))],
+            price=float(rng.integers(300, 3000)) * 1000,
+            bedrooms=int(rng.integers(1, 6)),
+            image_path=None,
+        )
+        listings.append(SimpleNamespace(**raw))
+    return listings
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = vectors.astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_vectors(rng: np.random.Generator, latents: np.ndarray, text_dim: int, image_dim: int,
+                      noise: float = 0.5) -> tuple:
+    """Text and image vectors sharing the low-rank `latents`, so modalities correlate like real embeddings do."""
+    text_projection = np.random.default_rng(1).standard_normal((latents.shape[1], text_dim))
+    image_projection = np.random.default_rng(2).standard_normal((latents.shape[1], image_dim))
+    text = latents @ text_projection + noise * rng.standard_normal((len(latents), text_dim))
+    image = latents @ image_projection + noise * rng.standard_normal((len(latents), image_dim))
+    return _unit_rows(text), _unit_rows(image)
+
+
+def _two_list_merge(index: FusedIndex, text_query: np.ndarray, image_query: np.ndarray, top_k: int,
+                    weight_text: float) -> List[str]:
+    """The notebook's old algorithm: top 2k per modality, dict merge, sort (exact top-2k, no Chroma round trip)."""
+    fetch = min(top_k * 2, len(index))
+    text_scores, image_scores, _ = index.score(text_query, image_query, weight_text)
+    combined: Dict[str, Dict[str, float]] = {}
+    for row in top_k_indices(text_scores[0], fetch):
+        combined.setdefault(index.listing_ids[row], {"text_score": 0.0, "image_score": 0.0})["text_score"] = \
+            float(text_scores[0, row])
+    for row in top_k_indices(image_scores[0], fetch):
+        combined.setdefault(index.listing_ids[row], {"text_score": 0.0, "image_score": 0.0})["image_score"] = \
+            float(image_scores[0, row])
+    ranked = sorted(combined.items(), key=lambda item: weight_text * item[1]["text_score"]
+                    + (1 - weight_text) * item[1]["image_score"], reverse=True)
+    return [listing_id for listing_id, _ in ranked[:top_k]]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fused single-pass ranking vs the two-list merge")
+    parser.add_argument("--listings", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--weight-text", type=float, default=0.65)
+    parser.add_argument("--text-dim", type=int, default=384, help="all-MiniLM-L6-v2")
+    parser.add_argument("--image-dim", type=int, default=512, help="CLIP ViT-B/32")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    listings = synthetic_listings(args.listings)
+    start = time.perf_counter()
+    text_vectors, image_vectors = synthetic_vectors(rng, rng.standard_normal((len(listings), 16)),
+                                                    args.text_dim, args.image_dim)
+    index = FusedIndex(listings, text_vectors, image_vectors)
+    print(f"indexed {len(index)} listings in {time.perf_counter() - start:.2f}s")
+    text_queries, image_queries = synthetic_vectors(rng, rng.standard_normal((args.queries, 16)),
+                                                    args.text_dim, args.image_dim)
+
+    start = time.perf_counter()
+    merged = [_two_list_merge(index, text_queries[i], image_queries[i], args.top_k, args.weight_text)
+              for i in range(args.queries)]
+    merge_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    start = time.perf_counter()
+    fused = [[result["listing"].listing_id for result in
+              index.search(text_queries[i], image_queries[i], args.top_k, args.weight_text)]
+             for i in range(args.queries)]
+    fused_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    recall = np.mean([len(set(old) & set(new)) / len(new) for old, new in zip(merged, fused)])
+    print(f"two-list merge   {merge_ms:7.2f} ms/query (in-memory, excludes two Chroma round trips)")
+    print(f"fused engine     {fused_ms:7.2f} ms/query")
+    print(f"two-list merge found {recall:.1%} of the true fused top-{args.top_k}")
+
+    mask = index.filter_mask(cities=["Berlin", "Tokyo"], max_price=1_500_000, min_bedrooms=3)
+    start = time.perf_counter()
+    for i in range(args.queries):
+        index.search(text_queries[i], image_queries[i], args.top_k, args.weight_text, mask=mask)
+    filtered_ms = (time.perf_counter() - start) * 1000 / args.queries
+    print(f"fused + filters  {filtered_ms:7.2f} ms/query over {int(mask.sum())} matching listings")
+
+
+if __name__ == "__main__":
+    main()